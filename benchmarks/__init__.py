@@ -0,0 +1 @@
+"""ServeIt performance benchmarks."""
@@ -0,0 +1,141 @@
+"""Benchmark server backends serving the example Scikit-Learn models.
+
+Starts each example in `examples/sklearn_*` on each installed backend (see
+`serveit.backends`), then drives it with concurrent keep-alive clients for a
+fixed duration and reports throughput, latency percentiles and errors.
+
+Usage: python -m benchmarks.backends [--duration S] [--clients N] [--workers N] [--threads N] [--backend NAME ...]
+"""
+from http.client import HTTPConnection
+from timeit import default_timer as timer
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from serveit import backends
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLES = (
+    ('iris', 'sklearn_iris_logistic_regression.py', [[5.1, 3.5, 1.4, .2]]),
+    ('boston', 'sklearn_boston_linear_regression.py',
+     [[.00632, 18., 2.31, 0., .538, 6.575, 65.2, 4.09, 1., 296., 15.3, 396.9, 4.98]]),
+)
+
+
+def free_port():
+    """Return a free local port."""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_example(script, backend, port, workers, threads, cwd):
+    """Start an example server on a backend and wait until it accepts connections."""
+    env = dict(os.environ, WSGI_BACKEND=backend, WSGI_PORT=str(port), WSGI_WORKERS=str(workers),
+               WSGI_THREADS=str(threads), LOGLEVEL='WARNING', PYTHONWARNINGS='ignore', PYTHONPATH=ROOT)
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'examples', script)], cwd=cwd, env=env)
+    deadline = timer() + 60  # the first run fits and saves the model
+    while timer() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('{} exited with status {}'.format(script, process.returncode))
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except socket.error:
+            time.sleep(.1)
+    process.kill()
+    raise RuntimeError('{} did not start on {}'.format(script, backend))
+
+
+def stop_example(process):
+    """Stop an example server."""
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def client(port, body, stop, latencies, errors):
+    """Post predictions over a keep-alive connection until stopped, reconnecting when the server closes it."""
+    connection = HTTPConnection('127.0.0.1', port, timeout=10)
+    headers = {'Content-Type': 'application/json'}
+    while not stop.is_set():
+        start = timer()
+        try:
+            connection.request('POST', '/predictions', body, headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+            else:
+                latencies.append(timer() - start)
+            if response.getheader('Connection', '').lower() == 'close':
+                connection.close()
+        except Exception as e:
+            errors.append(type(e).__name__)
+            connection.close()
+    connection.close()
+
+
+def benchmark(port, body, clients, duration):
+    """Run concurrent clients against a server; return requests per second, latency percentiles and errors."""
+    stop = threading.Event()
+    latencies, errors = [], []
+    threads = [threading.Thread(target=client, args=(port, body, stop, latencies, errors)) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    latencies = np.array(latencies) * 1e3 if latencies else np.zeros(1)
+    return len(latencies) / duration, np.percentile(latencies, 50), np.percentile(latencies, 99), len(errors)
+
+
+def main():
+    """Run benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--duration', type=float, default=5., help='seconds of load per backend')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent client connections')
+    parser.add_argument('--workers', type=int, default=1, help='server processes')
+    parser.add_argument('--threads', type=int, default=4, help='request handling threads per process')
+    parser.add_argument('--backend', action='append', choices=sorted(backends.BACKENDS),
+                        help='backend to benchmark (repeatable); defaults to all installed backends')
+    args = parser.parse_args()
+
+    names = args.backend or sorted(name for name in backends.BACKENDS if backends.is_available(name))
+    skipped = sorted(set(backends.BACKENDS) - set(names))
+    if skipped and not args.backend:
+        print('Not installed: {}'.format(', '.join(skipped)))
+    cwd = tempfile.mkdtemp()
+    try:
+        for example, script, row in EXAMPLES:
+            body = json.dumps(row)
+            for name in names:
+                port = free_port()
+                process = start_example(script, name, port, args.workers, args.threads, cwd)
+                try:
+                    benchmark(port, body, args.clients, min(1., args.duration))  # warm up
+                    rps, p50, p99, errors = benchmark(port, body, args.clients, args.duration)
+                finally:
+                    stop_example(process)
+                print('{:<8} {:<18} {:9.0f} req/s   p50: {:7.2f} ms   p99: {:7.2f} ms   errors: {}'.format(
+                    example, name, rps, p50, p99, errors))
+    finally:
+        shutil.rmtree(cwd)
+
+
+if __name__ == '__main__':
+    main()
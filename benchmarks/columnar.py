@@ -0,0 +1,56 @@
+"""Benchmark building arrays from columnar versus row-major JSON input.
+
+Times decoding a request body and converting it to the 2D array passed to
+`predict` (and the conversion alone), for batches of increasing width.
+
+Usage: python -m benchmarks.columnar [--rows N] [--repeat N]
+"""
+import argparse
+import json
+import os
+import timeit
+
+os.environ.setdefault('LOGLEVEL', 'WARNING')
+
+import numpy as np
+
+from serveit.columnar import ColumnarFormat
+
+
+def time_per_call(fn, repeat):
+    """Return the best mean time per call in milliseconds."""
+    return min(timeit.repeat(fn, number=repeat, repeat=5)) / repeat * 1e3
+
+
+def benchmark(rows, width, repeat):
+    """Benchmark one batch shape."""
+    data = np.random.RandomState(0).rand(rows, width).round(4)
+    names = ['feature_{}'.format(i) for i in range(width)]
+    columnar = ColumnarFormat(names)
+    row_body = json.dumps(data.tolist())
+    column_body = json.dumps({name: column.tolist() for name, column in zip(names, data.T)})
+    np.testing.assert_array_equal(columnar(json.loads(column_body)), np.asarray(json.loads(row_body)))
+
+    row_data, column_data = json.loads(row_body), json.loads(column_body)
+    for label, build_rows, build_columns in (
+            ('decode+build', lambda: np.asarray(json.loads(row_body)), lambda: columnar(json.loads(column_body))),
+            ('build', lambda: np.asarray(row_data), lambda: columnar(column_data))):
+        rows_time = time_per_call(build_rows, repeat)
+        columns_time = time_per_call(build_columns, repeat)
+        print('{:>6} x {:<5} {:<13} rows: {:8.2f} ms   columns: {:8.2f} ms   speedup: {:.1f}x'.format(
+            rows, width, label, rows_time, columns_time, rows_time / columns_time))
+
+
+def main():
+    """Run benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=1000, help='rows per batch')
+    parser.add_argument('--repeat', type=int, default=10, help='calls per timing run')
+    args = parser.parse_args()
+
+    for width in (4, 16, 64, 256):
+        benchmark(args.rows, width, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Benchmark KerasModelAdapter against `model.predict`.
+
+Times per-request predictions of the Boston housing example's network for
+small batch sizes, with `model.predict` and with the adapter.
+
+Usage: python -m benchmarks.keras_adapter [--repeat N]
+"""
+import argparse
+import os
+import timeit
+
+os.environ.setdefault('LOGLEVEL', 'WARNING')
+
+import numpy as np
+
+from serveit.adapters.keras import KerasModelAdapter
+
+
+def get_model(input_dim):
+    """Create and compile the example's model."""
+    from keras.models import Sequential
+    from keras.layers import Dense
+    model = Sequential()
+    model.add(Dense(100, input_dim=input_dim, activation='sigmoid'))
+    model.add(Dense(1))
+    model.compile(loss='mean_squared_error', optimizer='SGD')
+    return model
+
+
+def time_per_call(fn, repeat):
+    """Return the best mean time per call in milliseconds."""
+    return min(timeit.repeat(fn, number=repeat, repeat=5)) / repeat * 1e3
+
+
+def main():
+    """Run benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=100, help='calls per timing run')
+    args = parser.parse_args()
+
+    model = get_model(13)
+    adapter = KerasModelAdapter(model)
+    data = np.random.RandomState(0).rand(64, 13).astype(np.float32)
+    adapter.verify(data)
+    for n in (1, 5, 32, 64):
+        batch = data[:n]
+        model.predict(batch)  # warm up
+        predict_time = time_per_call(lambda: model.predict(batch), args.repeat)
+        adapter_time = time_per_call(lambda: adapter(batch), args.repeat)
+        print('batch {:<4} model.predict: {:7.3f} ms   adapter: {:7.3f} ms   speedup: {:.1f}x'.format(
+            n, predict_time, adapter_time, predict_time / adapter_time))
+
+
+if __name__ == '__main__':
+    main()
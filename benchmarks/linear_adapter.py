@@ -0,0 +1,75 @@
+"""Benchmark LinearModelAdapter against Scikit-Learn `predict` per request.
+
+Compares single-row `predict` calls and full `/predictions` requests through
+the Flask test client for the models served in `examples/sklearn_*`.
+
+Usage: python -m benchmarks.linear_adapter [--repeat N]
+"""
+import argparse
+import json
+import os
+import timeit
+import warnings
+
+os.environ.setdefault('LOGLEVEL', 'WARNING')
+
+from sklearn.datasets import load_iris
+from sklearn.linear_model import LinearRegression, LogisticRegression
+
+from serveit.adapters.linear import LinearModelAdapter
+from serveit.server import ModelServer
+
+
+def load_regression_data():
+    """Load Boston housing data as in the examples, falling back to diabetes data."""
+    try:
+        from sklearn.datasets import load_boston
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return load_boston()
+    except ImportError:  # removed in Scikit-Learn 1.2
+        from sklearn.datasets import load_diabetes
+        return load_diabetes()
+
+
+def time_per_call(fn, repeat):
+    """Return the best mean time per call in microseconds."""
+    return min(timeit.repeat(fn, number=repeat, repeat=5)) / repeat * 1e6
+
+
+def benchmark(name, model, data, repeat):
+    """Benchmark a fitted model with and without the adapter."""
+    adapter = LinearModelAdapter(model)
+    adapter.verify(data.data)
+    row = data.data[:1]
+    body = json.dumps(row.tolist())
+    results = {}
+    for label, predict in (('sklearn', model.predict), ('adapter', adapter)):
+        app = ModelServer(model, predict).app.test_client()
+
+        def request():
+            app.post('/predictions', headers={'Content-Type': 'application/json'}, data=body)
+
+        results[label] = (time_per_call(lambda: predict(row), repeat), time_per_call(request, repeat // 10 or 1))
+    for label, (predict_time, request_time) in sorted(results.items(), reverse=True):
+        print('{:<20} {:<8} predict: {:8.1f} us   request: {:8.1f} us'.format(name, label, predict_time, request_time))
+    speedup = results['sklearn'][0] / results['adapter'][0]
+    print('{:<20} {:<8} predict speedup: {:.1f}x'.format(name, '', speedup))
+
+
+def main():
+    """Run benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=2000, help='calls per timing run')
+    args = parser.parse_args()
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        iris = load_iris()
+        regression = load_regression_data()
+        benchmark('LogisticRegression', LogisticRegression().fit(iris.data, iris.target), iris, args.repeat)
+        benchmark('LinearRegression', LinearRegression().fit(regression.data, regression.target), regression, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""Microbenchmarks of the hot stages of serving a prediction, with regression thresholds.
+
+Times each stage (best of several runs of many calls), compares the times
+with a baseline file, and exits with status 1 if any stage is still slower
+than its baseline by more than the threshold after being re-timed:
+
+- `make_serializable`: nested numpy outputs (arrays, scalars, dicts and lists)
+- `json_loader`: `json_numpy_loader` in a request context, and `np.array` conversion
+- `bytes_to_image`: `get_bytes_to_image_callback` on `tests/SuccessKid.jpg`
+- `predictions_post`: a full `Predictions.post` through the Flask test client
+- `predictions_post_fast_path`: the same request through the WSGI fast path
+
+Baselines are machine-specific, so none is committed (`benchmarks/baselines/`
+is ignored by git): record one with `--update` on the machine that runs the
+suite, in the environment it runs in, and again after an intended change in
+performance. Without a baseline every stage is reported as new and the suite passes.
+
+Usage: python -m benchmarks.microbench [--update] [--threshold FRACTION] [--baseline PATH] [--stage NAME ...]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+
+os.environ.setdefault('LOGLEVEL', 'WARNING')
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'baselines', 'microbench.json')
+THRESHOLD = float(os.getenv('SERVEIT_BENCHMARK_THRESHOLD', .25))  # allowed fractional slowdown per stage
+
+
+class SumModel(object):
+    """Model that predicts the row sums of its input, so that requests time serving rather than the model."""
+
+    @staticmethod
+    def predict(data):
+        """Sum rows."""
+        return data.sum(axis=1)
+
+
+def bench_make_serializable():
+    """Return a call serializing nested numpy outputs."""
+    from serveit.utils import make_serializable
+    random = np.random.RandomState(0)
+    prediction = dict(
+        probabilities=random.rand(32, 10),
+        labels=np.array(['label_{}'.format(i) for i in range(32)]),
+        top=[[(np.int64(i), np.float32(p)) for i, p in enumerate(row[:3])] for row in random.rand(32, 3)],
+        summary=dict(mean=np.float64(.5), counts=np.arange(10)),
+    )
+    return lambda: make_serializable(prediction)
+
+
+def bench_json_loader():
+    """Return a call loading a JSON request body and converting it to a numpy array."""
+    from flask import Flask
+    from serveit.utils import json_numpy_loader
+    app = Flask(__name__)
+    body = json.dumps(np.random.RandomState(0).rand(32, 13).round(4).tolist())
+
+    def call():
+        with app.test_request_context('/predictions', method='POST', data=body, content_type='application/json'):
+            return np.array(json_numpy_loader())
+    return call
+
+
+def bench_bytes_to_image():
+    """Return a call decoding and resizing an image."""
+    from serveit.utils import get_bytes_to_image_callback
+    with open(os.path.join(ROOT, 'tests', 'SuccessKid.jpg'), 'rb') as f:
+        image_bytes = f.read()
+    bytes_to_image = get_bytes_to_image_callback(image_dims=(224, 224))
+    return lambda: bytes_to_image(image_bytes)
+
+
+def _post(fast_path):
+    """Return a call posting a prediction request to a server."""
+    from werkzeug.test import Client
+    from werkzeug.wrappers import Response
+    from serveit.server import ModelServer
+    model = SumModel()
+    server = ModelServer(model, model.predict, lambda data: (data.ndim == 2, 'Data should have two dimensions.'),
+                         fast_path=fast_path)
+    client = Client(server.get_wsgi_app(), Response) if fast_path else server.app.test_client()
+    body = json.dumps(np.random.RandomState(0).rand(8, 13).round(4).tolist())
+
+    def call():
+        response = client.post('/predictions', data=body, content_type='application/json')
+        assert response.status_code == 200, response.get_data()
+    return call
+
+
+def bench_predictions_post():
+    """Return a call posting a prediction request through the Flask test client."""
+    return _post(fast_path=False)
+
+
+def bench_predictions_post_fast_path():
+    """Return a call posting a prediction request through the WSGI fast path."""
+    return _post(fast_path=True)
+
+
+STAGES = dict(
+    make_serializable=bench_make_serializable,
+    json_loader=bench_json_loader,
+    bytes_to_image=bench_bytes_to_image,
+    predictions_post=bench_predictions_post,
+    predictions_post_fast_path=bench_predictions_post_fast_path,
+)
+
+
+def time_stage(call, repeat=5, min_time=.2):
+    """Return the best mean time per call in microseconds, over runs of at least `min_time` seconds."""
+    call()  # warm up
+    timer = timeit.Timer(call)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+def environment():
+    """Describe the machine and library versions that timings depend on."""
+    from importlib.metadata import version
+    return dict(
+        python=platform.python_version(),
+        numpy=np.__version__,
+        flask=version('flask'),
+        machine=platform.machine(),
+        processor=platform.processor(),
+        cpus=os.cpu_count(),
+    )
+
+
+def load_baseline(path):
+    """Load a baseline file; None if it doesn't exist."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    """Save stage timings (in microseconds) as a baseline file."""
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        json.dump(dict(environment=environment(), stages_us=results), f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """Compare stage timings with baseline timings.
+
+    Returns a list of (stage, baseline us, current us, relative change, status)
+    rows, where status is 'regressed' if the stage is slower than its baseline
+    by more than `threshold` (a fraction), 'new' if it has no baseline, and 'ok'
+    otherwise.
+    """
+    rows = []
+    for stage, current in sorted(results.items()):
+        reference = baseline.get(stage)
+        if reference is None:
+            rows.append((stage, None, current, None, 'new'))
+            continue
+        change = current / reference - 1
+        rows.append((stage, reference, current, change, 'regressed' if change > threshold else 'ok'))
+    return rows
+
+
+def main(argv=None):
+    """Run benchmarks; return the exit status."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline file')
+    parser.add_argument('--update', action='store_true', help='save the timings as the new baseline')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='allowed fractional slowdown per stage (default: %(default)s)')
+    parser.add_argument('--stage', action='append', choices=sorted(STAGES), help='stage to run (repeatable)')
+    parser.add_argument('--repeat', type=int, default=5, help='timing runs per stage')
+    parser.add_argument('--retries', type=int, default=2,
+                        help='times a stage that seems to regress is re-timed (keeping its best time) before failing')
+    args = parser.parse_args(argv)
+
+    stages = args.stage or list(STAGES)
+    results = {stage: time_stage(STAGES[stage](), repeat=args.repeat) for stage in stages}
+
+    if args.update:
+        baseline = load_baseline(args.baseline) or {}
+        save_baseline(args.baseline, dict(baseline.get('stages_us', {}), **results))
+        for stage in stages:
+            print('{:<28} {:10.1f} us'.format(stage, results[stage]))
+        print('Saved baseline to {}'.format(args.baseline))
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print('No baseline at {}; record one with --update'.format(args.baseline))
+        baseline = {}
+    elif baseline.get('environment') != environment():
+        print('Warning: baseline was recorded in a different environment: {}'.format(baseline.get('environment')))
+    rows = compare(results, baseline.get('stages_us', {}), args.threshold)
+    for _ in range(args.retries):
+        # confirm regressions, which are often noise from other processes
+        regressed = [row[0] for row in rows if row[4] == 'regressed']
+        if not regressed:
+            break
+        for stage in regressed:
+            results[stage] = min(results[stage], time_stage(STAGES[stage](), repeat=args.repeat))
+        rows = compare(results, baseline.get('stages_us', {}), args.threshold)
+    for stage, reference, current, change, status in rows:
+        print('{:<28} baseline: {:>10} us   current: {:10.1f} us   change: {:>7}   {}'.format(
+            stage, '{:.1f}'.format(reference) if reference is not None else '-', current,
+            '{:+.0%}'.format(change) if change is not None else '-', status))
+    regressed = [row[0] for row in rows if row[4] == 'regressed']
+    if regressed:
+        print('Regressed by more than {:.0%}: {}'.format(args.threshold, ', '.join(regressed)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
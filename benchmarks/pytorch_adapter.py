@@ -0,0 +1,91 @@
+"""Benchmark TorchModelAdapter against the preprocessing chain of the PyTorch example.
+
+Times one ResNet50 request (from a decoded 224x224 image to top 3 labels) and
+reports the increase in peak resident memory from a single request, measured
+in a fresh process for each approach.
+
+Usage: python -m benchmarks.pytorch_adapter [--repeat N]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import timeit
+
+os.environ.setdefault('LOGLEVEL', 'WARNING')
+
+import numpy as np
+import torch
+import torchvision.models as models
+import torchvision.transforms as transforms
+
+from serveit.adapters.pytorch import TorchModelAdapter, topk_labels, IMAGENET_MEAN, IMAGENET_STD
+
+
+def example_request(model, labels):
+    """Return a request handler using the example's preprocessing and postprocessing."""
+    normalize = transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
+
+    def request(image):
+        tensor = torch.from_numpy(image.swapaxes(3, 1).swapaxes(2, 3).copy()) / 255
+        prediction = model(torch.autograd.Variable(normalize(tensor)))
+        prediction = prediction.data.numpy()[0]
+        return [labels[index] for index in prediction.argsort()[-3:][::-1]]
+    return request
+
+
+def adapter_request(model, labels):
+    """Return a request handler using the PyTorch adapter."""
+    adapter = TorchModelAdapter(model, mean=IMAGENET_MEAN, std=IMAGENET_STD, scale=255., channels_last_input=True)
+    postprocessor = topk_labels(labels, k=3)
+
+    def request(image):
+        return postprocessor(adapter(image))[0]
+    return request
+
+
+REQUESTS = dict(example=example_request, adapter=adapter_request)
+
+
+def peak_memory_increase(name):
+    """Return the increase in peak RSS (MB) from a first request, measured in a new process."""
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'benchmarks.pytorch_adapter', '--measure-memory', name],
+        stderr=subprocess.DEVNULL,
+    )
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    """Run benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=10, help='requests per timing run')
+    parser.add_argument('--measure-memory', choices=sorted(REQUESTS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    try:
+        model = models.resnet50(weights=None)
+    except TypeError:  # torchvision < 0.13
+        model = models.resnet50(pretrained=False)
+    model.eval()
+    labels = {i: str(i) for i in range(1000)}
+    image = np.random.randint(0, 256, size=(1, 224, 224, 3)).astype(np.float32)
+
+    if args.measure_memory:
+        request = REQUESTS[args.measure_memory](model, labels)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        request(image)
+        print((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / 1024.)  # KB on Linux
+        return
+
+    for name in ('example', 'adapter'):
+        request = REQUESTS[name](model, labels)
+        request(image)  # warm up
+        latency = min(timeit.repeat(lambda: request(image), number=args.repeat, repeat=3)) / args.repeat
+        print('{:<8} latency: {:7.1f} ms   peak memory increase: {:7.1f} MB'.format(
+            name, latency * 1e3, peak_memory_increase(name)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 """Sample ServeIt prediction server."""
 from sklearn.datasets import load_boston
+from serveit.adapters.keras import KerasModelAdapter
 from serveit.server import ModelServer
 from keras.models import Sequential
 from keras.layers import Dense
@@ -38,8 +39,9 @@ def validator(input_data):
     # validation passed
     return True, None
 
-# deploy model to a ModelServer
-server = ModelServer(model, model.predict, validator)
+# deploy model to a ModelServer, calling its inference function directly (with
+# requests padded to a few fixed batch sizes) instead of through `model.predict`
+server = ModelServer(model, KerasModelAdapter(model), validator)
 
 # add informational endpoints
 server.create_info_endpoint('features', data.feature_names)
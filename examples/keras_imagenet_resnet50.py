@@ -3,6 +3,9 @@
 Prediction endpoint, served at `/predictions` takes a URL pointing to an image
 and returns a list of class probabilities.
 """
+import os
+
+from serveit.persistence import save_model, load_model
 from serveit.server import ModelServer
 from serveit.utils import get_bytes_to_image_callback
 
@@ -13,8 +16,12 @@ from keras.applications.resnet50 import preprocess_input
 from flask import request
 import requests
 
-# load Resnet50 model pretrained on ImageNet
-model = ResNet50(weights='imagenet')
+# load Resnet50 model pretrained on ImageNet, saving it on first run so later
+# runs load the saved architecture and weights instead of rebuilding the model
+MODEL_PATH = 'keras_imagenet_resnet50.model'
+if not os.path.exists(MODEL_PATH):
+    save_model(ResNet50(weights='imagenet'), MODEL_PATH)
+model = load_model(MODEL_PATH)
 
 
 # define a loader callback for the API to fetch the relevant data and
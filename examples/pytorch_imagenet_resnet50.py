@@ -3,12 +3,11 @@
 Prediction endpoint, served at `/predictions` takes a URL pointing to an image
 and returns a list of class probabilities.
 """
+from serveit.adapters.pytorch import TorchModelAdapter, topk_labels, IMAGENET_MEAN, IMAGENET_STD
 from serveit.server import ModelServer
 from serveit.utils import get_bytes_to_image_callback
 
 import torchvision.models as models
-import torchvision.transforms as transforms
-import torch
 
 from flask import request
 import requests
@@ -35,29 +34,23 @@ def loader():
     response = requests.get(url)  # make request to static image file
     return response.content
 
-#  define preprocessing callback chain
-preprocessor = [
-    get_bytes_to_image_callback(image_dims=(224, 224)),  # convert bytes to image of size 224 x 224
-    lambda img: torch.from_numpy(img.swapaxes(3, 1).swapaxes(2, 3).copy()) / 255,  # convert to tensor, rescale
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),  # normalize pixel intensities
-    torch.autograd.Variable,  # convert to PyTorch Variable
-]
-
-
-# define a postprocessor callback for the API to transform the model predictions
-def postprocessor(prediction):
-    """Map prediction tensor to labels."""
-    prediction = prediction.data.numpy()[0]
-    top_predictions = prediction.argsort()[-3:][::-1]
-    return [labels[prediction] for prediction in top_predictions]
+# run the model without recording gradients, reading (N, H, W, C) images in place
+# and rescaling and normalizing pixel intensities in a single pass
+adapter = TorchModelAdapter(
+    model,
+    mean=IMAGENET_MEAN,
+    std=IMAGENET_STD,
+    scale=255.,
+    channels_last_input=True,
+)
 
 # deploy model to a ModelServer
 server = ModelServer(
     model,
-    model,
+    adapter,
     data_loader=loader,
-    preprocessor=preprocessor,
-    postprocessor=postprocessor,
+    preprocessor=get_bytes_to_image_callback(image_dims=(224, 224)),  # convert bytes to image of size 224 x 224
+    postprocessor=topk_labels(labels, k=3),  # map the top 3 scores of each image to labels
     to_numpy=False
 )
 
@@ -1,12 +1,19 @@
 """Sample ServeIt Scikit-Learn server."""
+import os
 from sklearn.datasets import load_boston
 from sklearn.linear_model import LinearRegression
+from serveit.persistence import save_model, load_model
 from serveit.server import ModelServer
 
-# fit a model on the Boston housing dataset
+# fit a model on the Boston housing dataset once and save it to disk; later runs
+# (and other server processes) memory-map the saved model instead of retraining
+MODEL_PATH = 'boston_linear_regression.model'
 data = load_boston()
-reg = LinearRegression()
-reg.fit(data.data, data.target)
+if not os.path.exists(MODEL_PATH):
+    reg = LinearRegression()
+    reg.fit(data.data, data.target)
+    save_model(reg, MODEL_PATH)
+reg = load_model(MODEL_PATH)
 
 
 def validator(input_data):
@@ -34,5 +41,7 @@ server = ModelServer(reg, reg.predict, validator)
 # add informational endpoints
 server.create_info_endpoint('features', data.feature_names)
 
-# start API
-server.serve()
+# start API; guarded so the server can be imported for batch scoring, e.g.
+# `serveit-score sklearn_boston_linear_regression:server input.npy output.jsonl`
+if __name__ == '__main__':
+    server.serve()
@@ -1,12 +1,19 @@
 """Sample ServeIt Scikit-Learn server."""
+import os
 from sklearn.datasets import load_iris
 from sklearn.linear_model import LogisticRegression
+from serveit.persistence import save_model, load_model
 from serveit.server import ModelServer
 
-# fit a model on the Iris dataset
+# fit a model on the Iris dataset once and save it to disk; later runs (and
+# other server processes) memory-map the saved model instead of retraining
+MODEL_PATH = 'iris_logistic_regression.model'
 data = load_iris()
-clf = LogisticRegression()
-clf.fit(data.data, data.target)
+if not os.path.exists(MODEL_PATH):
+    clf = LogisticRegression()
+    clf.fit(data.data, data.target)
+    save_model(clf, MODEL_PATH)
+clf = load_model(MODEL_PATH)
 
 
 def validator(input_data):
@@ -35,5 +42,7 @@ server = ModelServer(clf, clf.predict, validator)
 server.create_info_endpoint('features', data.feature_names)
 server.create_info_endpoint('target_labels', data.target_names.tolist())
 
-# start API
-server.serve()
+# start API; guarded so the server can be imported for batch scoring, e.g.
+# `serveit-score sklearn_iris_logistic_regression:server input.npy output.jsonl`
+if __name__ == '__main__':
+    server.serve()
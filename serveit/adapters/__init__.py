@@ -0,0 +1,24 @@
+"""Framework-specific model adapters that speed up prediction.
+
+Adapters are imported lazily, so that importing one (or this package) doesn't
+import the other frameworks:
+
+    from serveit.adapters import LinearModelAdapter  # imports NumPy, not PyTorch or Keras
+"""
+import importlib
+
+# adapter name -> module defining it
+ADAPTERS = {
+    'LinearModelAdapter': 'linear',
+    'TorchModelAdapter': 'pytorch',
+    'KerasModelAdapter': 'keras',
+}
+
+__all__ = sorted(ADAPTERS)
+
+
+def __getattr__(name):
+    """Import adapters on first access (Python 3.7+)."""
+    if name not in ADAPTERS:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    return getattr(importlib.import_module('.' + ADAPTERS[name], __name__), name)
@@ -0,0 +1,180 @@
+"""Keras inference adapter.
+
+`model.predict` is built for large offline datasets: every call sets up a
+batching loop, callbacks and (with TensorFlow 1 backends) graph and session
+lookups, which dominates the latency of small per-request batches, and it
+isn't safe to call from request threads that don't own the model's graph.
+`KerasModelAdapter` builds the model's inference function once and calls it
+directly, as `predict_on_batch` does:
+
+    adapter = KerasModelAdapter(model, bucket_sizes=(1, 8, 32))
+    server = ModelServer(model, adapter, validator)
+
+Batches are zero-padded up to the smallest of a few fixed bucket sizes (and
+larger batches are split by the largest), so the inference function only
+ever sees `len(bucket_sizes)` input shapes: TensorFlow 2 traces one concrete
+function per bucket up front instead of retracing for new batch sizes, and
+each bucket is run once on initialization so that the first requests don't
+pay for tracing or memory allocation. With TensorFlow 1 backends, the graph
+and session the model was built in are pinned and entered on every call, so
+predictions are safe from any thread.
+"""
+from threading import local
+
+import numpy as np
+
+from ..log_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+def executing_eagerly():
+    """Check if Keras runs on TensorFlow 2 (eager execution), rather than TensorFlow 1 graphs and sessions."""
+    try:
+        import tensorflow as tf
+    except ImportError:
+        return False
+    return hasattr(tf, 'executing_eagerly') and tf.executing_eagerly()
+
+
+class KerasModelAdapter(object):
+    """Prediction function that runs a single-input Keras model's inference function directly."""
+
+    def __init__(self, model, bucket_sizes=(1, 8, 32, 128), dtype=np.float32, warmup=True):
+        """Initialize adapter.
+
+        Arguments:
+            - model (keras.Model): compiled or uncompiled model with a single input
+            - bucket_sizes (sequence): batch sizes that inputs are padded to; batches
+                larger than the largest bucket are split into several calls
+            - dtype (np.dtype): input type expected by the model
+            - warmup (bool): run each bucket once on initialization
+        """
+        input_shape = model.input_shape
+        if isinstance(input_shape, list):
+            raise ValueError('Only single-input models are supported; got inputs of shapes {}'.format(input_shape))
+        if None in input_shape[1:]:
+            raise ValueError('Inputs must have fixed dimensions besides the batch size; got {}'.format(input_shape))
+        self.model = model
+        self.input_shape = tuple(input_shape[1:])
+        self.bucket_sizes = sorted(set(bucket_sizes))
+        self._exact_sizes = frozenset(self.bucket_sizes)
+        self.dtype = np.dtype(dtype)
+        self.eager = executing_eagerly()
+        if self.eager:
+            self._build_function()
+        else:
+            self._build_graph_function()
+        self._local = local()
+        if warmup:
+            self.warmup()
+
+    def __repr__(self):
+        """String representation."""
+        return '<KerasModelAdapter: {}, buckets {}>'.format(
+            getattr(self.model, 'name', type(self.model).__name__), self.bucket_sizes)
+
+    def _build_function(self):
+        """Trace one concrete inference function per bucket (TensorFlow 2)."""
+        import tensorflow as tf
+        model = self.model
+
+        @tf.function(autograph=False)
+        def infer(inputs):
+            return model(inputs, training=False)
+
+        self._functions = {
+            size: infer.get_concrete_function(tf.TensorSpec((size,) + self.input_shape, tf.as_dtype(self.dtype)))
+            for size in self.bucket_sizes
+        }
+
+        def run(batch):
+            return tf.nest.map_structure(lambda output: output.numpy(), self._functions[len(batch)](tf.constant(batch)))
+        self._run = run
+
+    def _build_graph_function(self):
+        """Build the model's predict function, and pin its graph and session (TensorFlow 1 backends)."""
+        from keras import backend as K
+        model = self.model
+        model._make_predict_function()
+        predict_function = model.predict_function
+        session = K.get_session()
+        graph = session.graph
+        # models with dropout (etc.) need the learning phase fed as test mode (0)
+        learning_phase = [0] if model.uses_learning_phase and not isinstance(K.learning_phase(), int) else []
+        self.graph, self.session = graph, session
+
+        def run(batch):
+            with graph.as_default(), session.as_default():
+                outputs = predict_function([batch] + learning_phase)
+            return outputs[0] if len(outputs) == 1 else outputs
+        self._run = run
+
+    def warmup(self):
+        """Run each bucket once, so that first requests don't trace functions or allocate memory."""
+        for size in self.bucket_sizes:
+            self._run(np.zeros((size,) + self.input_shape, dtype=self.dtype))
+        logger.info('Warmed up {!r}'.format(self))
+
+    def bucket_size(self, n):
+        """Return the bucket that a batch of `n` samples is padded to."""
+        for size in self.bucket_sizes:
+            if size >= n:
+                return size
+        return self.bucket_sizes[-1]
+
+    def _padded(self, batch):
+        """Copy a batch into this thread's zero-padded input buffer for its bucket."""
+        size = self.bucket_size(len(batch))
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            buffers = self._local.buffers = {}
+        buffer = buffers.get(size)
+        if buffer is None:
+            buffer = buffers[size] = np.zeros((size,) + self.input_shape, dtype=self.dtype)
+        buffer[:len(batch)] = batch
+        buffer[len(batch):] = 0
+        return buffer
+
+    def _predict_batch(self, batch):
+        """Predict a batch of at most the largest bucket size."""
+        n = len(batch)
+        outputs = self._run(batch if n in self._exact_sizes else self._padded(batch))
+        if isinstance(outputs, (list, tuple)):
+            return [output[:n] for output in outputs]
+        if isinstance(outputs, dict):
+            return {name: output[:n] for name, output in outputs.items()}
+        return outputs[:n]
+
+    def predict(self, data):
+        """Predict a batch, padded to its bucket size (or split by the largest bucket)."""
+        data = np.ascontiguousarray(data, dtype=self.dtype)
+        if data.shape[1:] != self.input_shape:
+            raise ValueError('Expected inputs of shape (n,) + {}, got {}'.format(self.input_shape, data.shape))
+        largest = self.bucket_sizes[-1]
+        if len(data) <= largest:
+            return self._predict_batch(data)
+        chunks = [self._predict_batch(data[start:start + largest]) for start in range(0, len(data), largest)]
+        if isinstance(chunks[0], list):
+            return [np.concatenate(outputs) for outputs in zip(*chunks)]
+        if isinstance(chunks[0], dict):
+            return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+        return np.concatenate(chunks)
+
+    __call__ = predict
+
+    def verify(self, data, rtol=1e-4, atol=1e-6):
+        """Check that the adapter's predictions match `model.predict` on sample data.
+
+        Raises ValueError on mismatch.
+        """
+        def as_list(outputs):
+            if isinstance(outputs, dict):
+                return [outputs[name] for name in sorted(outputs)]
+            return list(outputs) if isinstance(outputs, (list, tuple)) else [outputs]
+
+        for expected, actual in zip(as_list(self.model.predict(data)), as_list(self.predict(data))):
+            if not np.allclose(expected, actual, rtol=rtol, atol=atol):
+                raise ValueError('Adapter predictions differ from model predictions by up to {}'.format(
+                    np.abs(np.asarray(expected) - actual).max()))
+        logger.info('Verified {} predictions on {:,} samples'.format(type(self.model).__name__, len(data)))
@@ -0,0 +1,114 @@
+"""PyTorch inference adapter.
+
+`TorchModelAdapter` runs a module under inference mode (no autograd graph is
+recorded), reads channels-last image arrays without transposing them, and
+fuses rescaling and normalization into a single pass over a reusable input
+buffer:
+
+    adapter = TorchModelAdapter(model, mean=IMAGENET_MEAN, std=IMAGENET_STD, scale=255, channels_last_input=True)
+    server = ModelServer(model, adapter, preprocessor=bytes_to_image, postprocessor=topk_labels(labels), to_numpy=False)
+"""
+from threading import local
+
+import numpy as np
+import torch
+
+from ..log_utils import get_logger
+
+logger = get_logger(__name__)
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+def inference_mode():
+    """Return a context manager that disables autograd, preferring `torch.inference_mode`."""
+    if hasattr(torch, 'inference_mode'):
+        return torch.inference_mode()
+    return torch.no_grad()
+
+
+class TorchModelAdapter(object):
+    """Prediction function that runs a PyTorch module on numpy arrays."""
+
+    def __init__(self, model, mean=None, std=None, scale=1., channels_last_input=False, dtype=torch.float32):
+        """Initialize adapter.
+
+        Arguments:
+            - model (torch.nn.Module): module to run; switched to evaluation mode
+            - mean (sequence): per-channel mean subtracted after rescaling; channels are
+                the second axis of input tensors (e.g., (N, C, H, W) images or (N, C) features)
+            - std (sequence): per-channel standard deviation divided by after rescaling
+            - scale (float): inputs are divided by `scale` before normalization (e.g.,
+                255 for 8-bit pixel intensities)
+            - channels_last_input (bool): inputs are (N, H, W, C) arrays, as returned by
+                image loading callbacks; they are viewed as (N, C, H, W) tensors in
+                channels-last memory format, and the model is converted to match
+            - dtype (torch.dtype): input type expected by the model
+        """
+        self.model = model.eval()
+        self.channels_last_input = channels_last_input
+        if channels_last_input:
+            self.model = self.model.to(memory_format=torch.channels_last)
+        self.dtype = dtype
+        self.normalize = mean is not None or std is not None or scale != 1
+        if self.normalize:
+            # fold rescaling and normalization into x * multiplier + offset, per channel
+            mean = torch.as_tensor(mean if mean is not None else 0., dtype=dtype)
+            std = torch.as_tensor(std if std is not None else 1., dtype=dtype)
+            self.multiplier = (1. / (std * scale)).reshape(-1)
+            self.offset = (-mean / std).reshape(-1)
+        self._local = local()
+
+    def __repr__(self):
+        """String representation."""
+        return '<TorchModelAdapter: {}>'.format(type(self.model).__name__)
+
+    def _buffer(self, tensor):
+        """Return this thread's reusable input buffer matching `tensor`'s shape."""
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None or buffer.shape != tensor.shape:
+            memory_format = torch.channels_last if self.channels_last_input else torch.contiguous_format
+            buffer = torch.empty(tensor.shape, dtype=self.dtype, memory_format=memory_format)
+            self._local.buffer = buffer
+        return buffer
+
+    def to_tensor(self, data):
+        """Convert a numpy array (or tensor) to a normalized model input tensor.
+
+        Channels-last arrays are permuted as views, and normalization writes
+        directly into a per-thread buffer that is reused across requests.
+        """
+        tensor = torch.as_tensor(data)
+        if self.channels_last_input:
+            tensor = tensor.permute(0, 3, 1, 2)
+        if not self.normalize:
+            return tensor if tensor.dtype == self.dtype else tensor.to(self.dtype)
+        # broadcast per-channel factors along the channel axis (the second) of the input
+        shape = (1, -1) + (1,) * (tensor.dim() - 2)
+        multiplier, offset = self.multiplier.view(shape), self.offset.view(shape)
+        buffer = self._buffer(tensor)
+        if tensor.dtype == self.dtype:
+            torch.addcmul(offset, tensor, multiplier, out=buffer)
+        else:
+            buffer.copy_(tensor).mul_(multiplier).add_(offset)
+        return buffer
+
+    def predict(self, data):
+        """Run the model on a batch without recording an autograd graph."""
+        with inference_mode():
+            return self.model(self.to_tensor(data))
+
+    __call__ = predict
+
+
+def topk_labels(labels, k=3):
+    """Return a postprocessor that maps each sample's top `k` scores to labels.
+
+    Uses `torch.topk`, which avoids fully sorting the scores.
+    """
+    def postprocessor(prediction):
+        """Map prediction tensor to the labels of the top scores, per sample."""
+        indices = torch.topk(torch.as_tensor(prediction), k, dim=1).indices
+        return [[labels[index] for index in row] for row in indices.tolist()]
+    return postprocessor
@@ -0,0 +1,216 @@
+"""Pluggable WSGI server backends.
+
+`ModelServer.serve` runs its app on one of these backends, selected by the
+`WSGI_BACKEND` environment variable (see `serveit.config`) or its `backend`
+argument:
+
+- `meinheld`: asynchronous server in C; serves WebSocket streaming predictions
+- `gunicorn`: pre-forked synchronous workers (no keep-alive)
+- `gunicorn-threaded`: pre-forked workers with `WSGI_THREADS` request threads each
+- `werkzeug`: threaded development server (no keep-alive)
+- `wsgiref`: standard library server, threaded if `WSGI_THREADS` > 1
+
+Each backend runs `WSGI_WORKERS` processes sharing the listening socket, and
+applies `WSGI_KEEPALIVE` and `WSGI_BACKLOG` where it supports them. Worker
+processes get a `SERVEIT_WORKER_INDEX` environment variable (read by
+`ThreadBudget`). If a backend's package isn't installed, the `werkzeug`
+backend is used instead.
+"""
+import logging
+import os
+import signal
+
+from . import config
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+FALLBACK_BACKEND = 'werkzeug'
+
+
+def _prefork(workers, run, on_worker_start=None):
+    """Run `run` in `workers` forked processes (or in this process for one worker) until interrupted."""
+    def start(index):
+        os.environ['SERVEIT_WORKER_INDEX'] = str(index)
+        if on_worker_start is not None:
+            on_worker_start(index)
+        run()
+
+    if workers <= 1:
+        start(0)
+        return
+    children = []
+    for index in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                start(index)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError:  # already exited
+                pass
+
+
+def serve_meinheld(app, host, port, workers, threads, keepalive, backlog, on_worker_start=None):
+    """Serve with meinheld, with WebSocket support."""
+    from meinheld import server, middleware
+    server.set_backlog(backlog)
+    server.set_keepalive(keepalive)
+    server.listen((host, port))
+    _prefork(workers, lambda: server.run(middleware.WebSocketMiddleware(app)), on_worker_start)
+
+
+def _serve_gunicorn(app, host, port, workers, threads, keepalive, backlog, worker_class, on_worker_start=None):
+    """Serve with gunicorn, embedded as a custom application."""
+    from gunicorn.app.base import BaseApplication
+
+    def post_fork(server, worker):
+        index = (worker.age - 1) % workers
+        os.environ['SERVEIT_WORKER_INDEX'] = str(index)
+        if on_worker_start is not None:
+            on_worker_start(index)
+
+    options = dict(
+        bind='{}:{}'.format(host, port),
+        workers=workers,
+        threads=threads,
+        worker_class=worker_class,
+        keepalive=keepalive,
+        backlog=backlog,
+        post_fork=post_fork,
+        loglevel=logging.getLevelName(logger.getEffectiveLevel()).lower(),
+    )
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    Application().run()
+
+
+def serve_gunicorn(app, host, port, workers, threads, keepalive, backlog, on_worker_start=None):
+    """Serve with gunicorn's synchronous workers."""
+    _serve_gunicorn(app, host, port, workers, 1, keepalive, backlog, 'sync', on_worker_start)
+
+
+def serve_gunicorn_threaded(app, host, port, workers, threads, keepalive, backlog, on_worker_start=None):
+    """Serve with gunicorn's threaded workers."""
+    _serve_gunicorn(app, host, port, workers, threads, keepalive, backlog, 'gthread', on_worker_start)
+
+
+def serve_werkzeug(app, host, port, workers, threads, keepalive, backlog, on_worker_start=None):
+    """Serve with werkzeug's threaded server."""
+    from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler
+
+    class Server(ThreadedWSGIServer):
+        request_queue_size = backlog
+
+    class RequestHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            logger.debug('{} "{}"'.format(self.address_string(), self.requestline))
+
+    server = Server(host, port, app, handler=RequestHandler)
+    _prefork(workers, server.serve_forever, on_worker_start)
+
+
+def serve_wsgiref(app, host, port, workers, threads, keepalive, backlog, on_worker_start=None):
+    """Serve with the standard library's WSGI server, threaded if `threads` > 1."""
+    from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+    from socketserver import ThreadingMixIn
+
+    bases = (ThreadingMixIn, WSGIServer) if threads > 1 else (WSGIServer,)
+    Server = type('Server', bases, dict(request_queue_size=backlog, daemon_threads=True))
+
+    class RequestHandler(WSGIRequestHandler):
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    server = make_server(host, port, app, server_class=Server, handler_class=RequestHandler)
+    _prefork(workers, server.serve_forever, on_worker_start)
+
+
+BACKENDS = {
+    'meinheld': serve_meinheld,
+    'gunicorn': serve_gunicorn,
+    'gunicorn-threaded': serve_gunicorn_threaded,
+    'werkzeug': serve_werkzeug,
+    'wsgiref': serve_wsgiref,
+}
+
+# packages each backend needs, to check before falling back
+REQUIREMENTS = {
+    'meinheld': 'meinheld',
+    'gunicorn': 'gunicorn',
+    'gunicorn-threaded': 'gunicorn',
+}
+
+
+def is_available(backend):
+    """Check if a backend's package is installed."""
+    import importlib
+    try:
+        if backend in REQUIREMENTS:
+            importlib.import_module(REQUIREMENTS[backend])
+    except ImportError:
+        return False
+    return True
+
+
+def get_backend(name=None):
+    """Return the name of the backend to serve with, falling back if it isn't installed."""
+    name = name or config.WSGI_BACKEND
+    if name not in BACKENDS:
+        raise ValueError('Unknown server backend {}; choose from {}'.format(name, ', '.join(sorted(BACKENDS))))
+    if not is_available(name):
+        logger.warning('Server backend {} is not installed; using {}'.format(name, FALLBACK_BACKEND))
+        name = FALLBACK_BACKEND
+    return name
+
+
+def serve(app, host=None, port=None, backend=None, workers=None, threads=None, keepalive=None, backlog=None,
+          on_worker_start=None):
+    """Serve a WSGI app on a backend, with settings defaulting to `serveit.config`.
+
+    Arguments:
+        - app (fn): WSGI app
+        - host (str): interface to listen on
+        - port (int): port to listen on
+        - backend (str): backend name (see `BACKENDS`)
+        - workers (int): number of server processes
+        - threads (int): number of request handling threads per process
+        - keepalive (int): seconds to keep idle connections open
+        - backlog (int): maximum number of pending connections
+        - on_worker_start (fn): called with the worker index in each server process
+    """
+    backend = get_backend(backend)
+    settings = dict(
+        host=host or config.WSGI_HOST,
+        port=port or config.WSGI_PORT,
+        workers=workers or config.WSGI_WORKERS,
+        threads=threads or config.WSGI_THREADS,
+        keepalive=keepalive if keepalive is not None else config.WSGI_KEEPALIVE,
+        backlog=backlog or config.WSGI_BACKLOG,
+    )
+    logger.info('Serving on http://{host}:{port} with {backend} ({workers} workers x {threads} threads)'.format(
+        backend=backend, **settings))
+    BACKENDS[backend](app, on_worker_start=on_worker_start, **settings)
@@ -0,0 +1,213 @@
+"""Offline bulk scoring through a ModelServer prediction pipeline.
+
+Input files are streamed in chunks, so files larger than memory can be scored:
+at most a few chunks per worker process are held in memory at any time.
+
+Example usage from the command line, where `my_module.server` is a configured
+`ModelServer` (the module should not call `server.serve()` on import):
+
+    serveit-score my_module:server input.npy output.jsonl --processes 4
+"""
+from collections import deque
+from itertools import islice
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+from .utils import json_numpy_loader, make_serializable
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+# server used by worker processes; inherited from the parent process on fork
+_server = None
+
+
+def iter_npy_chunks(path, chunk_size):
+    """Yield row chunks of a memory-mapped `.npy` file."""
+    array = np.load(path, mmap_mode='r')
+    for start in range(0, array.shape[0], chunk_size):
+        yield np.asarray(array[start:start + chunk_size])
+
+
+def iter_csv_chunks(path, chunk_size, delimiter=',', skip_header=False):
+    """Yield row chunks of a numeric CSV file as 2D numpy arrays."""
+    with open(path) as f:
+        if skip_header:
+            next(f, None)
+        while True:
+            lines = list(islice(f, chunk_size))
+            if not lines:
+                return
+            lines = [line for line in lines if line.strip()]
+            if lines:
+                yield np.loadtxt(lines, delimiter=delimiter, ndmin=2)
+
+
+def iter_jsonl_chunks(path, chunk_size):
+    """Yield row chunks of a JSON lines file, where each line is a single row."""
+    with open(path) as f:
+        while True:
+            lines = list(islice(f, chunk_size))
+            if not lines:
+                return
+            rows = [json.loads(line) for line in lines if line.strip()]
+            if rows:
+                yield rows
+
+
+READERS = {
+    'npy': iter_npy_chunks,
+    'csv': iter_csv_chunks,
+    'jsonl': iter_jsonl_chunks,
+}
+
+
+def infer_format(path):
+    """Infer input format from a file extension."""
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    extension = 'jsonl' if extension in ('json', 'ndjson') else extension
+    if extension not in READERS:
+        raise ValueError('Unable to infer input format of {}; please specify one of {}'.format(
+            path, sorted(READERS)))
+    return extension
+
+
+def score_chunk(server, chunk):
+    """Run a chunk of rows through the server's pipeline and return JSON lines.
+
+    Custom data loaders are run against a synthetic JSON request containing the
+    chunk. Each row of the output is written on its own line when the
+    postprocessed predictions have one entry per row; failed chunks are written
+    as one error line per row, using the same JSON body as the API.
+    """
+    n_rows = len(chunk)
+    try:
+        if server.data_loader is not json_numpy_loader:
+            with server.app.test_request_context('/predictions', method='POST', json=make_serializable(chunk)):
+                chunk = server.data_loader()
+        predictions = server.run_pipeline(chunk)
+    except Exception as e:
+        logger.error('Unable to score chunk of {:,} rows'.format(n_rows), exc_info=True)
+        error = json.dumps(dict(
+            message='Unable to score chunk',
+            details=dict(exception_type=type(e).__name__, exception_message=str(e)),
+        ))
+        return n_rows, ''.join(error + '\n' for _ in range(n_rows))
+    if isinstance(predictions, list) and len(predictions) == n_rows:
+        return n_rows, ''.join(json.dumps(prediction) + '\n' for prediction in predictions)
+    return n_rows, json.dumps(predictions) + '\n'
+
+
+def _score_chunk_worker(chunk):
+    """Score a chunk with the server inherited from the parent process."""
+    return score_chunk(_server, chunk)
+
+
+def _imap_bounded(pool, func, iterable, max_pending):
+    """Ordered `imap` that never holds more than `max_pending` submitted items."""
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def score_file(
+        server,
+        input_path,
+        output_path,
+        chunk_size=1000,
+        processes=None,
+        input_format=None,
+        **reader_kwargs):
+    """Score an input file with a ModelServer and write predictions as JSON lines.
+
+    Arguments:
+        - server (ModelServer): configured server whose data loader, preprocessor,
+            input validation, predict function and postprocessor are applied
+        - input_path (str): path to an `.npy`, `.csv` or `.jsonl` file of rows
+        - output_path (str): path of the JSON lines output file
+        - chunk_size (int): number of rows scored per `predict` call
+        - processes (int): number of worker processes; defaults to the CPU count,
+            and 1 scores in the current process
+        - input_format (str): one of `npy`, `csv` or `jsonl`; inferred from the
+            input file extension by default
+        - reader_kwargs: passed to the input reader (e.g., `skip_header` for CSV)
+
+    Returns a dict with the number of rows and chunks scored.
+    """
+    global _server
+    processes = processes or multiprocessing.cpu_count()
+    chunks = READERS[input_format or infer_format(input_path)](input_path, chunk_size, **reader_kwargs)
+    if processes > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+        logger.warning('Process pools require fork; scoring in the current process')
+        processes = 1
+
+    summary = dict(rows=0, chunks=0)
+    pool = None
+    try:
+        if processes > 1:
+            _server = server
+            pool = multiprocessing.get_context('fork').Pool(processes)
+            results = _imap_bounded(pool, _score_chunk_worker, chunks, max_pending=2 * processes)
+        else:
+            results = (score_chunk(server, chunk) for chunk in chunks)
+        with open(output_path, 'w') as output:
+            for n_rows, lines in results:
+                output.write(lines)
+                summary['rows'] += n_rows
+                summary['chunks'] += 1
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+            _server = None
+    logger.info('Scored {rows:,} rows in {chunks:,} chunks'.format(**summary))
+    return summary
+
+
+def load_server(spec):
+    """Import a ModelServer from a `module:attribute` specification."""
+    module_name, _, attribute = spec.partition(':')
+    return getattr(importlib.import_module(module_name), attribute or 'server')
+
+
+def main(argv=None):
+    """Score a file from the command line."""
+    parser = argparse.ArgumentParser(description='Score a file with a configured ModelServer.')
+    parser.add_argument('server', help='ModelServer to import, as module:attribute')
+    parser.add_argument('input', help='input .npy, .csv or .jsonl file')
+    parser.add_argument('output', help='output JSON lines file')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='rows per predict call')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--format', choices=sorted(READERS), default=None, help='input format')
+    parser.add_argument('--skip-header', action='store_true', help='skip the first line of a CSV file')
+    args = parser.parse_args(argv)
+
+    try:
+        input_format = args.format or infer_format(args.input)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.skip_header and input_format != 'csv':
+        parser.error('--skip-header only applies to CSV input, not {}'.format(input_format))
+    reader_kwargs = dict(skip_header=True) if args.skip_header else {}
+    score_file(
+        load_server(args.server),
+        args.input,
+        args.output,
+        chunk_size=args.chunk_size,
+        processes=args.processes,
+        input_format=input_format,
+        **reader_kwargs
+    )
+
+
+if __name__ == '__main__':
+    main()
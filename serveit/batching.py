@@ -0,0 +1,227 @@
+"""Adaptive batching of concurrent prediction requests under a latency target."""
+from collections import deque
+from concurrent.futures import Future
+from queue import Queue, Empty
+from threading import Lock, Thread
+from timeit import default_timer as timer
+import os
+
+import numpy as np
+
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class _Request(object):
+    """Pending prediction request."""
+
+    __slots__ = ('data', 'future', 'enqueued')
+
+    def __init__(self, data, enqueued):
+        self.data = data
+        self.future = Future()
+        self.enqueued = enqueued
+
+
+class AdaptiveBatcher(object):
+    """Prediction function that batches concurrent requests into single `predict` calls.
+
+    Requests arriving within a wait window are concatenated along their first
+    axis, predicted together, and split back into per-request predictions. The
+    batch size and wait window are tuned online: `predict` latency is measured
+    per batch size (rounded down to a power of two) and per input shape, and the
+    batch size with the highest throughput whose estimated latency meets
+    `latency_target` is chosen. When the observed p99 latency exceeds the target,
+    the batch size and wait window are halved until the next re-tune.
+
+    Requests are batched when the server handles requests concurrently (e.g.,
+    a threaded server backend). An AdaptiveBatcher is passed to `ModelServer` in
+    place of a predict function, and its decisions can be served with:
+
+        batcher = AdaptiveBatcher(clf.predict, latency_target=.05)
+        server = ModelServer(clf, batcher)
+        server.create_info_endpoint('batching', batcher.stats)
+    """
+
+    def __init__(
+            self,
+            predict,
+            latency_target=.1,
+            max_batch_size=256,
+            max_wait=.01,
+            retune_interval=20,
+            window_size=1000,
+            smoothing=.2):
+        """Initialize adaptive batcher.
+
+        Arguments:
+            - predict (fn): takes a numpy array with samples along the first axis and
+                returns predictions with one entry per sample
+            - latency_target (float): target p99 request latency in seconds
+            - max_batch_size (int): maximum number of samples per `predict` call
+            - max_wait (float): maximum seconds to wait for a batch to fill
+            - retune_interval (int): number of batches between re-tunes
+            - window_size (int): number of recent requests used for latency percentiles
+            - smoothing (float): weight of new observations in moving averages
+        """
+        self.predict = predict
+        self.latency_target = latency_target
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.retune_interval = retune_interval
+        self.smoothing = smoothing
+        self.batch_size = 1
+        self.wait_window = 0.
+        self._lock = Lock()
+        self._pid = None
+        self._latencies = deque(maxlen=window_size)
+        self._profile = {}  # (sample shape, batch size bucket) -> smoothed predict latency
+        self._shape = None
+        self._interarrival = None  # smoothed seconds between requests
+        self._request_size = None  # smoothed samples per request
+        self._last_arrival = None
+        self._counts = dict(requests=0, batches=0, samples=0)
+        self._carry = None
+
+    def __repr__(self):
+        """String representation."""
+        return '<AdaptiveBatcher: {}>'.format(type(self.predict).__name__)
+
+    def _start(self):
+        """Start the batching thread; called again if the process has been forked."""
+        self._pid = os.getpid()
+        self._queue = Queue()
+        self._carry = None
+        worker = Thread(target=self._work, name='serveit-batcher')
+        worker.daemon = True
+        worker.start()
+
+    def __call__(self, data):
+        """Queue data for the next batch and wait for its predictions."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._start()
+        data = np.asarray(data)
+        request = _Request(data, timer())
+        self._record_arrival(request.enqueued, len(data))
+        self._queue.put(request)
+        return request.future.result()
+
+    def _smooth(self, average, value):
+        """Update an exponential moving average."""
+        return value if average is None else average + self.smoothing * (value - average)
+
+    def _record_arrival(self, now, n_samples):
+        """Update the smoothed request interarrival time and size."""
+        with self._lock:
+            if self._last_arrival is not None:
+                self._interarrival = self._smooth(self._interarrival, now - self._last_arrival)
+            self._request_size = self._smooth(self._request_size, n_samples)
+            self._last_arrival = now
+
+    def _next_batch(self):
+        """Collect requests with matching sample shapes until the batch is full or the window closes."""
+        first = self._carry or self._queue.get()
+        self._carry = None
+        batch, n_samples = [first], len(first.data)
+        deadline = first.enqueued + self.wait_window
+        while n_samples < self.batch_size:
+            try:
+                request = self._queue.get(timeout=max(deadline - timer(), 0))
+            except Empty:
+                break
+            if (request.data.shape[1:] != first.data.shape[1:] or request.data.dtype != first.data.dtype or
+                    n_samples + len(request.data) > self.batch_size):
+                self._carry = request
+                break
+            batch.append(request)
+            n_samples += len(request.data)
+        return batch, n_samples
+
+    def _work(self):
+        """Run batches until the process exits."""
+        while True:
+            batch, n_samples = self._next_batch()
+            start = timer()
+            try:
+                data = batch[0].data if len(batch) == 1 else np.concatenate([request.data for request in batch])
+                predictions = self.predict(data)
+                if len(predictions) != n_samples:
+                    raise ValueError('Expected {} predictions, got {}'.format(n_samples, len(predictions)))
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            latency = timer() - start
+            offset = 0
+            for request in batch:
+                request.future.set_result(predictions[offset:offset + len(request.data)])
+                offset += len(request.data)
+            self._record_batch(data.shape[1:], n_samples, len(batch), latency, [request.enqueued for request in batch])
+
+    def _record_batch(self, shape, n_samples, n_requests, latency, enqueued):
+        """Update the latency profile, and re-tune every `retune_interval` batches."""
+        now = timer()
+        key = (shape, 1 << (max(n_samples, 1).bit_length() - 1))
+        with self._lock:
+            self._profile[key] = self._smooth(self._profile.get(key), latency)
+            self._latencies.extend(now - t for t in enqueued)
+            self._shape = shape
+            self._counts['requests'] += n_requests
+            self._counts['batches'] += 1
+            self._counts['samples'] += n_samples
+            if self._counts['batches'] % self.retune_interval == 0:
+                self._retune()
+
+    def _retune(self):
+        """Choose the batch size and wait window for the current sample shape and load."""
+        p99 = np.percentile(self._latencies, 99)
+        if p99 > self.latency_target:
+            # back off quickly while the target is violated, and judge the new settings afresh
+            self.batch_size = max(1, self.batch_size // 2)
+            self.wait_window /= 2
+            self._latencies.clear()
+            return
+
+        # a request may wait for the batch in progress and then its own batch
+        profile = sorted((size, latency) for (shape, size), latency in self._profile.items() if shape == self._shape)
+        feasible = [(size, latency) for size, latency in profile if 2 * latency <= self.latency_target]
+        if feasible:
+            size, latency = max(feasible, key=lambda item: item[0] / max(item[1], 1e-9))
+        else:
+            size, latency = 1, 0.
+        if feasible and size == profile[-1][0] and p99 < self.latency_target / 2:
+            size *= 2  # explore larger batches while there is headroom
+        batch_size = min(size, self.max_batch_size)
+
+        # wait long enough to fill the batch at the current arrival rate, within the latency
+        # slack; don't wait at all if another request is unlikely to arrive in time
+        self.batch_size = batch_size
+        self.wait_window = 0.
+        if batch_size > 1 and self._interarrival is not None:
+            wait = min(self.max_wait, max(self.latency_target - 2 * latency, 0) / 2)
+            if self._interarrival < wait:
+                fill_time = (batch_size / max(self._request_size, 1) - 1) * self._interarrival
+                self.wait_window = min(wait, max(fill_time, 0))
+
+    def stats(self):
+        """Return the current batching decisions and the measurements behind them."""
+        with self._lock:
+            latencies = np.array(self._latencies) * 1e3
+            profile = [
+                dict(batch_size=size, latency_ms=latency * 1e3, throughput=size / max(latency, 1e-9))
+                for (shape, size), latency in sorted(self._profile.items()) if shape == self._shape
+            ]
+            return dict(
+                batch_size=self.batch_size,
+                wait_window_ms=self.wait_window * 1e3,
+                latency_target_ms=self.latency_target * 1e3,
+                latency_p50_ms=float(np.percentile(latencies, 50)) if len(latencies) else None,
+                latency_p99_ms=float(np.percentile(latencies, 99)) if len(latencies) else None,
+                request_rate=1 / self._interarrival if self._interarrival else None,
+                sample_shape=list(self._shape) if self._shape is not None else None,
+                profile=profile,
+                counts=dict(self._counts),
+            )
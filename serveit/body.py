@@ -0,0 +1,240 @@
+"""Incremental parsing of request bodies into numpy arrays, with size limits.
+
+`StreamingLoader` is a data loader that reads the request body in chunks and
+writes values straight into a preallocated array, instead of reading the whole
+body, decoding it into Python lists and converting those to numpy. Peak memory
+per request stays close to the size of the final array:
+
+    server = ModelServer(clf, clf.predict, data_loader=StreamingLoader(dtype=np.float32),
+                         max_content_length=16 * 1024 * 1024)
+
+Bodies are either JSON arrays of numbers (of any number of dimensions) or
+binary tensors (`application/x-tensor`): a 4 byte big-endian header length, a
+JSON header `{"dtype": ..., "shape": [...]}` and the array's raw C-ordered bytes,
+as encoded by `serveit.websocket.encode_tensor_message`. Bodies larger than
+`max_content_length` are rejected with 413 responses, before they are read if
+their length is declared.
+"""
+import json
+import re
+
+import numpy as np
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+TENSOR_CONTENT_TYPE = 'application/x-tensor'
+CHUNK_SIZE = 64 * 1024
+BRACKETS = re.compile(br'([\[\]])')
+
+
+def _too_large(max_content_length):
+    """Return the error raised for bodies over the size limit."""
+    return RequestEntityTooLarge('Request body exceeds the limit of {:,} bytes'.format(max_content_length))
+
+
+class _JSONArrayParser(object):
+    """Incremental parser of a JSON array of numbers into a flat buffer and shape."""
+
+    def __init__(self, dtype, content_length=None):
+        """Initialize parser for a body of `content_length` bytes, if known."""
+        self.dtype = dtype
+        self.content_length = content_length
+        self.buffer = None
+        self.size = 0
+        self.depth = 0
+        self.ndim = None
+        self.counts = []  # number of elements in each open array
+        self.shape = []  # length of the arrays at each depth, once one has closed
+        self.finished = False
+        self._carry = b''
+
+    def feed(self, chunk):
+        """Parse a chunk, holding back a trailing partial number until the next chunk."""
+        data = self._carry + chunk
+        if self.buffer is None:
+            self._allocate(data)
+        end = max(data.rfind(b','), data.rfind(b'['), data.rfind(b']')) + 1
+        self._carry = data[end:]
+        if end:
+            self._parse(data[:end])
+
+    def _allocate(self, data):
+        """Allocate the buffer for the number of values expected from the body's first chunk."""
+        capacity = data.count(b',') + 1
+        if self.content_length and len(data) < self.content_length:
+            capacity = int(capacity * 1.05 * self.content_length / len(data)) + 1
+        self.buffer = np.empty(capacity, dtype=self.dtype)
+
+    def close(self):
+        """Parse the remaining data, and return the parsed array."""
+        if self.buffer is None:
+            self._allocate(self._carry)
+        self._parse(self._carry)
+        if not self.finished:
+            raise ValueError('Expected a JSON array of numbers')
+        return self.buffer[:self.size].reshape(self.shape)
+
+    def _parse(self, data):
+        """Parse complete tokens: values between brackets, and the brackets themselves."""
+        for token in BRACKETS.split(data):
+            if token == b'[':
+                self._open()
+            elif token == b']':
+                self._close()
+            else:
+                self._values(token)
+
+    def _open(self):
+        """Start a nested array."""
+        if self.finished or (self.ndim is not None and self.depth >= self.ndim):
+            raise ValueError('Expected a JSON array of numbers with consistent dimensions')
+        if self.depth:
+            self.counts[self.depth - 1] += 1
+        self.depth += 1
+        if len(self.counts) < self.depth:
+            self.counts.append(0)
+            self.shape.append(None)
+        self.counts[self.depth - 1] = 0
+
+    def _close(self):
+        """End the current array, checking its length against the arrays at the same depth."""
+        if not self.depth:
+            raise ValueError('Unexpected closing bracket')
+        if self.ndim is None:
+            self.ndim = self.depth
+        level = self.depth - 1
+        if self.shape[level] is None:
+            self.shape[level] = self.counts[level]
+        elif self.shape[level] != self.counts[level]:
+            raise ValueError('Expected arrays of length {} at depth {}, got {}'.format(
+                self.shape[level], self.depth, self.counts[level]))
+        self.depth -= 1
+        self.finished = not self.depth
+
+    def _values(self, token):
+        """Parse comma-separated numbers into the buffer."""
+        token = token.strip().strip(b',').strip()
+        if not token:
+            return
+        if self.finished or not self.depth:
+            raise ValueError('Expected a JSON array of numbers')
+        if self.ndim is None:
+            self.ndim = self.depth
+        elif self.depth != self.ndim:
+            raise ValueError('Expected a JSON array of numbers with consistent dimensions')
+        values = np.array(token.split(b',')).astype(self.dtype)
+        end = self.size + len(values)
+        if end > len(self.buffer):
+            self.buffer = np.resize(self.buffer, max(end, int(1.5 * len(self.buffer))))
+        self.buffer[self.size:end] = values
+        self.size = end
+        self.counts[self.depth - 1] += len(values)
+
+
+class StreamingLoader(object):
+    """Data loader parsing request bodies incrementally into numpy arrays."""
+
+    def __init__(self, dtype=np.float64, max_content_length=None, chunk_size=CHUNK_SIZE):
+        """Initialize loader.
+
+        Arguments:
+            - dtype (numpy.dtype): type of arrays parsed from JSON bodies
+            - max_content_length (int): maximum body size in bytes; defaults to the
+                Flask app's `MAX_CONTENT_LENGTH` (see `ModelServer`'s `max_content_length`)
+            - chunk_size (int): number of bytes read from the body at a time
+        """
+        self.dtype = np.dtype(dtype)
+        self.max_content_length = max_content_length
+        self.chunk_size = chunk_size
+
+    def __repr__(self):
+        """String representation."""
+        return '<StreamingLoader: {}>'.format(self.dtype)
+
+    def __call__(self):
+        """Load the current Flask request's body."""
+        from flask import current_app, request
+
+        max_content_length = self.max_content_length or current_app.config.get('MAX_CONTENT_LENGTH')
+        return self.load(request.stream, request.mimetype, request.content_length, max_content_length)
+
+    def load(self, stream, content_type, content_length=None, max_content_length=None):
+        """Parse a body from a file-like stream.
+
+        Arguments:
+            - stream (file): request body
+            - content_type (str): body media type; binary tensors are `application/x-tensor`,
+                and everything else is parsed as a JSON array
+            - content_length (int): declared body size, if known
+            - max_content_length (int): maximum body size in bytes
+        """
+        if max_content_length and content_length and content_length > max_content_length:
+            raise _too_large(max_content_length)
+        limits = [size for size in (content_length, max_content_length) if size]
+        limit = min(limits) if limits else None
+        if content_type == TENSOR_CONTENT_TYPE:
+            return self._load_tensor(stream, limit, max_content_length)
+        return self._load_json(stream, limit, max_content_length, content_length)
+
+    def _chunks(self, stream, limit, max_content_length):
+        """Yield body chunks, stopping at `limit` bytes, and failing if the body is too large."""
+        read = 0
+        while limit is None or read < limit:
+            chunk = stream.read(self.chunk_size if limit is None else min(self.chunk_size, limit - read))
+            if not chunk:
+                return
+            read += len(chunk)
+            yield chunk
+        if max_content_length and limit == max_content_length and stream.read(1):
+            raise _too_large(max_content_length)
+
+    def _load_json(self, stream, limit, max_content_length, content_length):
+        """Parse a JSON array of numbers."""
+        parser = _JSONArrayParser(self.dtype, content_length)
+        for chunk in self._chunks(stream, limit, max_content_length):
+            parser.feed(chunk)
+        return parser.close()
+
+    def _load_tensor(self, stream, limit, max_content_length):
+        """Read a binary tensor directly into a preallocated array."""
+        from .websocket import HEADER_LENGTH
+
+        prefix = stream.read(HEADER_LENGTH.size)
+        if len(prefix) < HEADER_LENGTH.size:
+            raise ValueError('Body ends within the tensor header')
+        (header_length,) = HEADER_LENGTH.unpack(prefix)
+        if limit is not None and HEADER_LENGTH.size + header_length > limit:
+            raise ValueError('Body ends within the tensor header')
+        header = json.loads(stream.read(header_length).decode('utf-8'))
+        dtype = np.dtype(header['dtype'])
+        shape = tuple(int(length) for length in header['shape'])
+        if any(length < 0 for length in shape):
+            raise ValueError('Invalid tensor shape {}'.format(shape))
+        # check the size declared by the header before allocating it
+        nbytes = dtype.itemsize
+        for length in shape:
+            nbytes *= length
+        size = HEADER_LENGTH.size + header_length + nbytes
+        if max_content_length and size > max_content_length:
+            raise _too_large(max_content_length)
+        if limit is not None and size > limit:
+            raise ValueError('Body ends within the tensor data ({:,} of {:,} bytes)'.format(limit, size))
+        array = np.empty(shape, dtype=dtype)
+
+        view = memoryview(array.reshape(-1).view(np.uint8)) if array.nbytes else b''
+        offset = 0
+        while offset < array.nbytes:
+            if hasattr(stream, 'readinto'):
+                read = stream.readinto(view[offset:offset + self.chunk_size])
+            else:
+                chunk = stream.read(min(self.chunk_size, array.nbytes - offset))
+                read = len(chunk)
+                view[offset:offset + read] = chunk
+            if not read:
+                raise ValueError('Body ends within the tensor data ({:,} of {:,} bytes)'.format(
+                    HEADER_LENGTH.size + header_length + offset, size))
+            offset += read
+        return array
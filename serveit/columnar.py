@@ -0,0 +1,95 @@
+"""Columnar JSON input with named features.
+
+Besides row-major lists of lists, `/predictions` accepts a JSON object of
+columns keyed by feature name once the server knows its feature names:
+
+    {"sepal length (cm)": [5.1, 4.9], "sepal width (cm)": [3.5, 3.0], ...}
+
+Feature names are registered with `ModelServer.register_features(names)`, or
+with `ModelServer.create_info_endpoint('features', names)`, which also documents
+them at `/info/features`. Only the default JSON data loader's output is parsed
+as columns; objects returned by custom data loaders are passed on unchanged. Columns are ordered by the
+registered names, not by their order in the body, so clients don't depend on
+the column order, and each is written straight into its (contiguous) column of
+a preallocated Fortran-ordered array instead of converting a list of row lists
+(see `benchmarks/columnar.py`). Requests with missing or extra features are
+rejected with 400 responses listing them.
+"""
+import numpy as np
+
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class ColumnarInputError(ValueError):
+    """Raised when columnar input doesn't match the registered features."""
+
+    def __init__(self, message, missing=(), extra=()):
+        """Initialize exception with the missing and extra feature names."""
+        self.missing = list(missing)
+        self.extra = list(extra)
+        super(ColumnarInputError, self).__init__(message)
+
+    @property
+    def details(self):
+        """Missing and extra feature names, for error responses."""
+        return dict(missing_features=self.missing, extra_features=self.extra)
+
+
+class ColumnarFormat(object):
+    """Converts columns keyed by feature name into a 2D array ordered by feature."""
+
+    def __init__(self, feature_names, dtype=np.float64):
+        """Initialize columnar format.
+
+        Arguments:
+            - feature_names (list): feature names, in the model's column order
+            - dtype (np.dtype): array data type
+        """
+        self.feature_names = [str(name) for name in feature_names]
+        if len(set(self.feature_names)) != len(self.feature_names):
+            raise ValueError('Feature names must be unique')
+        self.dtype = np.dtype(dtype)
+        self._names = frozenset(self.feature_names)
+
+    def __repr__(self):
+        """String representation."""
+        return '<ColumnarFormat: {} features>'.format(len(self.feature_names))
+
+    def check(self, columns):
+        """Raise `ColumnarInputError` if columns are missing or extra."""
+        if len(columns) == len(self.feature_names) and self._names.issuperset(columns):
+            return
+        missing = [name for name in self.feature_names if name not in columns]
+        extra = sorted(name for name in columns if name not in self._names)
+        problems = []
+        if missing:
+            problems.append('{} missing'.format(len(missing)))
+        if extra:
+            problems.append('{} unknown'.format(len(extra)))
+        raise ColumnarInputError('Columnar input does not match the {} registered features ({})'.format(
+            len(self.feature_names), ', '.join(problems)), missing, extra)
+
+    def __call__(self, columns):
+        """Convert a dict of equal length columns to an array with one column per feature."""
+        self.check(columns)
+        first = columns[self.feature_names[0]]
+        try:
+            n_rows = len(first)
+        except TypeError:
+            raise ColumnarInputError('Feature {!r} should be a list of values'.format(self.feature_names[0]))
+        data = np.empty((n_rows, len(self.feature_names)), dtype=self.dtype, order='F')
+        for i, name in enumerate(self.feature_names):
+            column = columns[name]
+            try:
+                length = len(column)
+            except TypeError:
+                length = None
+            if length != n_rows:
+                raise ColumnarInputError('Feature {!r} should be a list of {} values'.format(name, n_rows))
+            try:
+                data[:, i] = column
+            except (TypeError, ValueError) as e:
+                raise ColumnarInputError('Feature {!r} has invalid values: {}'.format(name, e))
+        return data
@@ -3,3 +3,10 @@ from os import getenv
 
 WSGI_HOST = getenv('WSGI_HOST', '127.0.0.1')
 WSGI_PORT = int(getenv('WSGI_PORT', 5000))
+
+# server backend (see `serveit.backends`) and its tuning
+WSGI_BACKEND = getenv('WSGI_BACKEND', 'meinheld')
+WSGI_WORKERS = int(getenv('WSGI_WORKERS', 1))  # server processes
+WSGI_THREADS = int(getenv('WSGI_THREADS', 1))  # request handling threads per process
+WSGI_KEEPALIVE = int(getenv('WSGI_KEEPALIVE', 2))  # seconds to keep idle connections open
+WSGI_BACKLOG = int(getenv('WSGI_BACKLOG', 2048))  # maximum number of pending connections
@@ -0,0 +1,112 @@
+"""Raw WSGI fast path for JSON prediction requests.
+
+JSON `POST` requests to `/predictions` are parsed and run through the server's
+prediction pipeline directly, and the pre-encoded response is written without
+Flask routing, Flask-RESTful dispatch or response representations. Responses
+and error bodies are the same as the Flask app's; all other requests (e.g.,
+`/info/*`, 404s, non-JSON bodies, chunked bodies without a Content-Length,
+custom data loaders) fall back to the Flask app.
+"""
+from io import BytesIO
+from json import dumps, loads
+
+from werkzeug.wsgi import ClosingIterator
+
+from .tracing import no_span
+from .utils import json_numpy_loader
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+JSON_HEADERS = [('Content-Type', 'application/json')]
+
+
+def is_json(content_type):
+    """Check if a Content-Type header is a JSON media type, as Flask does."""
+    mimetype = content_type.split(';', 1)[0].strip().lower()
+    return mimetype == 'application/json' or (mimetype.startswith('application/') and mimetype.endswith('+json'))
+
+
+def content_length(environ):
+    """Return a request's Content-Length, or None if it isn't declared (e.g., a chunked body)."""
+    try:
+        return int(environ.get('CONTENT_LENGTH') or '')
+    except ValueError:
+        return None
+
+
+def read_body(environ, length):
+    """Read a request body of a known length."""
+    return environ['wsgi.input'].read(length) if length > 0 else b''
+
+
+class FastPredictions(object):
+    """WSGI application serving JSON predictions without Flask dispatch."""
+
+    def __init__(self, server, app=None, path='/predictions'):
+        """Initialize fast path.
+
+        Arguments:
+            - server (ModelServer): server whose prediction pipeline serves requests
+            - app (fn): WSGI app serving all other requests; defaults to the server's Flask app
+            - path (str): prediction endpoint path
+        """
+        self.server = server
+        self.app = app or server.app
+        self.path = path
+
+    def __call__(self, environ, start_response):
+        """Serve JSON prediction requests, and pass other requests to the Flask app."""
+        if (environ.get('PATH_INFO') != self.path or environ.get('REQUEST_METHOD') != 'POST' or
+                self.server.data_loader is not json_numpy_loader or
+                not is_json(environ.get('CONTENT_TYPE', ''))):
+            return self.app(environ, start_response)
+
+        length = content_length(environ)
+        if length is None:
+            return self.app(environ, start_response)  # let Flask read the body, unconsumed
+        max_content_length = self.server.app.config.get('MAX_CONTENT_LENGTH')
+        if max_content_length and length > max_content_length:
+            return self.app(environ, start_response)  # let Flask reject the body
+        tracer = self.server.tracer
+        if tracer is None:
+            return self._predict(environ, start_response, length, no_span)
+        # continue the caller's trace, if any
+        with tracer.trace('POST ' + self.path, environ.get('HTTP_TRACEPARENT')) as request_span:
+            response = self._predict(environ, start_response, length, tracer.span)
+            request_span.set_attribute('fast_path', True)
+            return response
+
+    def _predict(self, environ, start_response, length, span):
+        """Load a JSON body and serve its predictions, or fall back to the Flask app."""
+        with span('load'):
+            body = read_body(environ, length)
+            try:
+                data = loads(body.decode('utf-8'))
+            except ValueError:
+                data = None
+        environ['wsgi.input'] = BytesIO(body)
+        environ['CONTENT_LENGTH'] = str(len(body))
+        if data is None:
+            # let Flask produce its own error response for bodies it can't load
+            return self.app(environ, start_response)
+
+        app = self.server.app
+        mirrored = []
+        # error responses are built with `jsonify`, which reads the request in older Flask versions
+        with app.request_context(environ):
+            result = self.server.respond(data, mirror=lambda *args: mirrored.append(args))
+            if hasattr(result, 'status_code'):  # error response
+                return result(environ, start_response)
+            with span('serialize'):
+                settings = dict(app.config.get('RESTFUL_JSON', {}))
+                if app.debug:
+                    settings.setdefault('indent', 4)
+                    settings.setdefault('sort_keys', False)
+                encoded = (dumps(result, **settings) + '\n').encode('utf-8')
+
+        start_response('200 OK', JSON_HEADERS + [('Content-Length', str(len(encoded)))])
+        if mirrored:
+            shadow, data, prediction, latency = mirrored[0]
+            return ClosingIterator([encoded], lambda: shadow.submit(data, prediction, latency))
+        return [encoded]
@@ -0,0 +1,211 @@
+"""Parallel execution of multi-model pipelines as a graph of named nodes.
+
+A `PipelineGraph` replaces hand-written wrappers that call several models one
+after another. Each node is a function of the outputs of the nodes it depends
+on (or of the graph input), and nodes whose dependencies are met run
+concurrently on a thread pool:
+
+    graph = PipelineGraph()
+    graph.add('features', extractor.predict)
+    graph.add('label', label_head.predict, inputs=['features'])
+    graph.add('score', score_head.predict, inputs=['features'])
+    server = ModelServer(extractor, graph)
+    server.create_info_endpoint('graph', graph.stats)
+
+Frameworks that release the GIL during compute (NumPy BLAS, PyTorch,
+TensorFlow) run independent branches in parallel. Intermediate values are
+passed by reference; arrays consumed by more than one node are passed as
+read-only views, so a node can't modify another node's input in place.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Lock
+from timeit import default_timer as timer
+import multiprocessing
+import os
+
+import numpy as np
+
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class PipelineGraph(object):
+    """Prediction function that runs a graph of model nodes, in parallel where possible."""
+
+    def __init__(self, outputs=None, max_workers=None, input_name='input', window_size=1000):
+        """Initialize pipeline graph.
+
+        Arguments:
+            - outputs (str or list): name of the node whose output is returned, or a
+                list of names to return a dict of outputs; defaults to the nodes no
+                other node depends on (a single value if there is only one)
+            - max_workers (int): number of threads running nodes concurrently;
+                defaults to the CPU count
+            - input_name (str): name by which nodes refer to the graph input
+            - window_size (int): number of recent runs used for timing percentiles
+        """
+        self.outputs = outputs
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self.input_name = input_name
+        self.window_size = window_size
+        self.nodes = {}  # name -> (fn, input names), in insertion (topological) order
+        self._consumers = {input_name: []}
+        self._timings = {}
+        self._latencies = deque(maxlen=window_size)
+        self._lock = Lock()
+        self._pid = None
+
+    def __repr__(self):
+        """String representation."""
+        return '<PipelineGraph: {}>'.format(', '.join(self.nodes))
+
+    def add(self, name, fn, inputs=None):
+        """Add a node, and return the graph.
+
+        Arguments:
+            - name (str): node name
+            - fn (fn): takes the outputs of `inputs`, as positional arguments in order
+            - inputs (list): names of the nodes (or the graph input) `fn` is applied to;
+                defaults to the graph input. Nodes must be added after their inputs,
+                so the graph can't contain cycles
+        """
+        if name in self._consumers:
+            raise ValueError('Duplicate node name: {}'.format(name))
+        inputs = list(inputs) if inputs is not None else [self.input_name]
+        for input_name in inputs:
+            if input_name not in self._consumers:
+                raise ValueError('Node {} depends on unknown node {}'.format(name, input_name))
+        for input_name in inputs:
+            self._consumers[input_name].append(name)
+        self._consumers[name] = []
+        self.nodes[name] = (fn, inputs)
+        self._timings[name] = deque(maxlen=self.window_size)
+        return self
+
+    def _output_names(self):
+        """Return the names of the nodes whose outputs are returned."""
+        if self.outputs is None:
+            return [name for name in self.nodes if not self._consumers[name]]
+        return [self.outputs] if isinstance(self.outputs, str) else list(self.outputs)
+
+    def _required(self, outputs):
+        """Return the nodes needed to compute `outputs`, in topological order."""
+        required = set()
+        pending = list(outputs)
+        while pending:
+            name = pending.pop()
+            if name in required or name == self.input_name:
+                continue
+            if name not in self.nodes:
+                raise ValueError('Unknown output node: {}'.format(name))
+            required.add(name)
+            pending.extend(self.nodes[name][1])
+        return [name for name in self.nodes if name in required]
+
+    def _executor(self):
+        """Return the thread pool, creating it again if the process has been forked."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(self.max_workers)
+                    self._pid = os.getpid()
+        return self._pool
+
+    def _share(self, value, consumers):
+        """Pass arrays consumed by several nodes as read-only views (without copying)."""
+        if consumers > 1 and isinstance(value, np.ndarray) and value.flags.writeable:
+            value = value.view()
+            value.flags.writeable = False
+        return value
+
+    def _run_node(self, name, args):
+        """Run a node, and return its output and latency."""
+        start = timer()
+        try:
+            return self.nodes[name][0](*args), timer() - start
+        except Exception:
+            logger.error('Pipeline node {} failed'.format(name))
+            raise
+
+    def run(self, data, outputs=None):
+        """Run the nodes needed for `outputs` on data, and return a dict of their outputs.
+
+        A node is started as soon as all of its inputs are available. When only one
+        node is ready and no other node is running, it runs in the calling thread.
+        """
+        start = timer()
+        outputs = self._output_names() if outputs is None else outputs
+        required = self._required(outputs)
+        required_set = set(required)
+        consumers = {
+            name: len([consumer for consumer in self._consumers[name] if consumer in required_set])
+            for name in [self.input_name] + required
+        }
+        values = {self.input_name: self._share(data, consumers[self.input_name])}
+        # the graph input is available from the start, so nodes only wait for other nodes
+        waiting = {name: len(set(self.nodes[name][1]) - {self.input_name}) for name in required}
+        ready = [name for name in required if not waiting[name]]
+        running = {}
+        timings = {}
+
+        def complete(name, value, latency):
+            """Store a node's output and queue the nodes it unblocks."""
+            values[name] = self._share(value, consumers[name])
+            timings[name] = latency
+            for consumer in set(self._consumers[name]):
+                if consumer in waiting:
+                    waiting[consumer] -= 1
+                    if not waiting[consumer]:
+                        ready.append(consumer)
+
+        try:
+            while ready or running:
+                if len(ready) == 1 and not running:
+                    name = ready.pop()
+                    complete(name, *self._run_node(name, [values[i] for i in self.nodes[name][1]]))
+                    continue
+                while ready:
+                    name = ready.pop()
+                    args = [values[i] for i in self.nodes[name][1]]
+                    running[self._executor().submit(self._run_node, name, args)] = name
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    complete(running.pop(future), *future.result())
+        finally:
+            for future in running:
+                future.cancel()
+
+        with self._lock:
+            for name, latency in timings.items():
+                self._timings[name].append(latency)
+            self._latencies.append(timer() - start)
+        return {name: values[name] for name in outputs}
+
+    def __call__(self, data):
+        """Run the graph on data, returning the output node's value (or a dict of outputs)."""
+        outputs = self.run(data)
+        if len(outputs) == 1 and (self.outputs is None or isinstance(self.outputs, str)):
+            return next(iter(outputs.values()))
+        return outputs
+
+    def stats(self):
+        """Return per-node and end-to-end latencies, in milliseconds."""
+        def summary(latencies):
+            latencies = np.array(latencies) * 1e3
+            if not len(latencies):
+                return dict(count=0, mean_ms=None, p50_ms=None, p99_ms=None)
+            return dict(
+                count=len(latencies),
+                mean_ms=float(latencies.mean()),
+                p50_ms=float(np.percentile(latencies, 50)),
+                p99_ms=float(np.percentile(latencies, 99)),
+            )
+
+        with self._lock:
+            nodes = {}
+            for name, (fn, inputs) in self.nodes.items():
+                nodes[name] = summary(self._timings[name])
+                nodes[name]['inputs'] = inputs
+            return dict(nodes=nodes, total=summary(self._latencies))
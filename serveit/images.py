@@ -0,0 +1,195 @@
+"""Batch predictions for many images sent in a single request.
+
+Images are sent either as `multipart/form-data` parts (one file per part), or
+as an `application/x-image-batch` body of length-prefixed images, each a
+4 byte big-endian byte count followed by the encoded image. The body is parsed
+as it is read, each image is handed to a thread pool for decoding as soon as
+its last byte arrives (exactly as `utils.get_bytes_to_image_callback` decodes
+single images, converted to RGB), and the decoded images are written into a
+single preallocated (N, H, W, C) batch for one `predict` call:
+
+    server = ModelServer(model, adapter, postprocessor=topk_labels(labels, k=3))
+    server.create_image_batch_endpoint(image_dims=(224, 224))
+
+The response is a list with one entry per image, in request order: the
+image's `name` and either its `prediction`, or an `error` with the same
+`message` and `details` as an HTTP error response if it couldn't be decoded.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import multiprocessing
+import os
+import struct
+
+import numpy as np
+
+from .log_utils import get_logger
+from .utils import load_image
+
+logger = get_logger(__name__)
+
+LENGTH_PREFIXED_CONTENT_TYPE = 'application/x-image-batch'
+LENGTH_PREFIX = struct.Struct('>I')
+CHUNK_SIZE = 64 * 1024
+
+
+class TooManyImages(ValueError):
+    """Raised when a request contains more images than allowed."""
+
+
+def _read_exactly(stream, size):
+    """Read `size` bytes from a stream, or fewer if it ends first."""
+    parts, remaining = [], size
+    while remaining:
+        chunk = stream.read(min(remaining, CHUNK_SIZE))
+        if not chunk:
+            break
+        parts.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(parts)
+
+
+def iter_length_prefixed(stream):
+    """Yield (name, bytes) for each image of a length-prefixed body, reading `stream` incrementally."""
+    index = 0
+    while True:
+        prefix = _read_exactly(stream, LENGTH_PREFIX.size)
+        if not prefix:
+            return
+        if len(prefix) < LENGTH_PREFIX.size:
+            raise ValueError('Body ends within a length prefix')
+        (length,) = LENGTH_PREFIX.unpack(prefix)
+        data = _read_exactly(stream, length)
+        if len(data) < length:
+            raise ValueError('Body ends within image {} ({} of {} bytes)'.format(index, len(data), length))
+        yield str(index), data
+        index += 1
+
+
+def iter_multipart(stream, boundary, chunk_size=CHUNK_SIZE):
+    """Yield (name, bytes) for each part of a multipart body, reading `stream` incrementally.
+
+    Parts are named by their file name, or their field name if they have none.
+    """
+    from werkzeug.sansio.multipart import MultipartDecoder, Data, Epilogue, Field, File, NeedData
+
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    name, parts = None, []
+    while True:
+        chunk = stream.read(chunk_size)
+        decoder.receive_data(chunk or None)
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, (File, Field)):
+                name = getattr(event, 'filename', None) or event.name
+            elif isinstance(event, Data):
+                parts.append(event.data)
+                if not event.more_data:
+                    yield name, b''.join(parts)
+                    parts = []
+            event = decoder.next_event()
+        if isinstance(event, Epilogue):
+            return
+        if not chunk:
+            raise ValueError('Multipart body ends before its closing boundary')
+
+
+def _load_image(data, image_dims):
+    """Decode an encoded image as `get_bytes_to_image_callback` does, with RGB channels for the batch."""
+    img = load_image(data, image_dims)
+    return img if img.mode == 'RGB' else img.convert('RGB')
+
+
+def _write_row(batch, row, img):
+    """Write an image's pixels into a row of a batch, converting them to the batch's type in place."""
+    batch[row] = np.asarray(img)
+
+
+class ImageBatchPredictions(object):
+    """Serves predictions for a batch of images from a single request body."""
+
+    def __init__(self, server, image_dims=(224, 224), dtype=np.float32, max_images=256, max_workers=None):
+        """Initialize image batch predictions.
+
+        Arguments:
+            - server (ModelServer): server whose pipeline (validation, monitoring,
+                prediction, shadow mirroring and postprocessing) is applied to the batch
+            - image_dims (tuple): (width, height) images are resized to
+            - dtype (numpy.dtype): type of the batch array
+            - max_images (int): maximum number of images per request
+            - max_workers (int): number of image decoding threads; defaults to the CPU count
+        """
+        self.server = server
+        self.image_dims = tuple(image_dims)
+        self.dtype = dtype
+        self.max_images = max_images
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self._lock = Lock()
+        self._pid = None
+
+    def __repr__(self):
+        """String representation."""
+        return '<ImageBatchPredictions: {}x{}>'.format(*self.image_dims)
+
+    def _executor(self):
+        """Return the decoding thread pool, creating it again if the process has been forked."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(self.max_workers)
+                    self._pid = os.getpid()
+        return self._pool
+
+    def iter_images(self, stream, content_type, boundary=None):
+        """Yield (name, bytes) for each image of a request body."""
+        if content_type == 'multipart/form-data':
+            if not boundary:
+                raise ValueError('Multipart body has no boundary')
+            return iter_multipart(stream, boundary)
+        if content_type == LENGTH_PREFIXED_CONTENT_TYPE:
+            return iter_length_prefixed(stream)
+        raise ValueError('Unsupported content type {}; send multipart/form-data or {}'.format(
+            content_type, LENGTH_PREFIXED_CONTENT_TYPE))
+
+    def decode(self, images):
+        """Decode images in parallel as they are read, into a single (N, H, W, C) batch.
+
+        Images are decoded to compact 8-bit pixels as they arrive; once the body
+        has been read, the decoding threads write them into a preallocated batch
+        of `dtype`, so each image is only held once at full precision.
+
+        Returns the images' names, the batch of images that could be decoded (in
+        request order), and each image's decoding exception (None if decoded).
+        """
+        pool = self._executor()
+        names, futures = [], []
+        for name, data in images:
+            if len(names) == self.max_images:
+                raise TooManyImages('Requests may contain at most {} images'.format(self.max_images))
+            names.append(name)
+            futures.append(pool.submit(_load_image, data, self.image_dims))
+        pixels, errors = [], []
+        for future in futures:
+            try:
+                pixels.append(future.result())
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        batch = np.empty((len(pixels), self.image_dims[1], self.image_dims[0], 3), dtype=self.dtype)
+        writes = [pool.submit(_write_row, batch, row, img) for row, img in enumerate(pixels)]
+        for write in writes:
+            write.result()
+        return names, batch, errors
+
+    @staticmethod
+    def results(names, errors, predictions):
+        """Return per-image results: a prediction for each decoded image, or its decoding error."""
+        predictions = iter(predictions)
+        results = []
+        for name, error in zip(names, errors):
+            if error is None:
+                results.append(dict(name=name, prediction=next(predictions)))
+            else:
+                results.append(dict(name=name, error=dict(message='Could not decode image', details=dict(
+                    exception_type=type(error).__name__, exception_message=str(error)))))
+        return results
@@ -0,0 +1,407 @@
+"""Online input feature statistics and drift detection.
+
+A `FeatureMonitor` observes every validated input batch and keeps per-feature
+counts, means, variances, ranges and histogram sketches, and compares them to
+a `ReferenceProfile` captured from training data:
+
+    reference = ReferenceProfile.from_data(X_train, feature_names=feature_names)
+    reference.save('reference.json')  # at training time
+
+    monitor = FeatureMonitor(ReferenceProfile.load('reference.json'))
+    server = ModelServer(clf, clf.predict, monitor=monitor)  # serves /info/drift
+
+Observing a batch only copies its rows into a preallocated block; statistics are
+updated with vectorized operations once per block, so the cost per request is a
+memory copy. Histogram bins are the reference's quantiles, and drift is scored
+per feature with the population stability index (PSI) and the shift of the
+mean in reference standard deviations.
+
+Statistics from several worker processes are merged (moments with Chan et al.'s
+parallel update, histograms by adding counts) when `shared_dir` is set: each
+worker's background thread writes its state there every `share_interval`
+seconds (off the request path), and reports cover all workers whose state has
+been written or refreshed within `stale_after` seconds.
+"""
+from threading import Lock, Thread
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class ReferenceProfile(object):
+    """Feature distributions of the training data that live inputs are compared with."""
+
+    def __init__(self, edges, proportions, mean, std, feature_names=None):
+        """Initialize reference profile.
+
+        Arguments:
+            - edges (list): for each feature, the interior histogram bin edges
+            - proportions (list): for each feature, the fraction of training values in
+                each bin (one more bin than edges, for values beyond the outer edges)
+            - mean (list): per-feature training mean
+            - std (list): per-feature training standard deviation
+            - feature_names (list): feature names; defaults to column indices
+        """
+        self.edges = [np.asarray(feature_edges, dtype=np.float64) for feature_edges in edges]
+        self.proportions = [np.asarray(feature_proportions, dtype=np.float64) for feature_proportions in proportions]
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.std = np.asarray(std, dtype=np.float64)
+        self.feature_names = list(feature_names) if feature_names is not None else [
+            str(i) for i in range(len(self.mean))]
+
+    def __repr__(self):
+        """String representation."""
+        return '<ReferenceProfile: {} features>'.format(len(self.mean))
+
+    @property
+    def n_features(self):
+        """Number of features."""
+        return len(self.mean)
+
+    @classmethod
+    def from_data(cls, data, bins=20, feature_names=None):
+        """Capture a profile from training data, binning each feature at its quantiles.
+
+        Arguments:
+            - data (numpy.ndarray): (samples, features) training inputs
+            - bins (int): number of quantile bins per feature
+            - feature_names (list): feature names
+        """
+        data = np.asarray(data, dtype=np.float64)
+        data = data.reshape(len(data), -1)
+        edges, proportions = [], []
+        for column in data.T:
+            column = column[~np.isnan(column)]
+            feature_edges = np.unique(np.percentile(column, np.linspace(0, 100, bins + 1)[1:-1]))
+            counts = np.bincount(np.searchsorted(feature_edges, column, side='right'), minlength=len(feature_edges) + 1)
+            edges.append(feature_edges)
+            proportions.append(counts / max(len(column), 1))
+        return cls(edges, proportions, np.nanmean(data, axis=0), np.nanstd(data, axis=0), feature_names)
+
+    def to_dict(self):
+        """Return the profile as JSON-serializable data."""
+        return dict(
+            feature_names=self.feature_names,
+            mean=self.mean.tolist(),
+            std=self.std.tolist(),
+            edges=[feature_edges.tolist() for feature_edges in self.edges],
+            proportions=[feature_proportions.tolist() for feature_proportions in self.proportions],
+        )
+
+    @classmethod
+    def from_dict(cls, data):
+        """Load a profile from `to_dict` output."""
+        return cls(data['edges'], data['proportions'], data['mean'], data['std'], data.get('feature_names'))
+
+    def save(self, path):
+        """Save the profile as JSON."""
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        """Load a profile saved with `save`."""
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+class FeatureStats(object):
+    """Mergeable per-feature moments, ranges, missing counts and histograms."""
+
+    def __init__(self, n_features, edges=None):
+        """Initialize empty statistics, with histograms over `edges` if given."""
+        self.count = np.zeros(n_features, dtype=np.int64)
+        self.missing = np.zeros(n_features, dtype=np.int64)
+        self.mean = np.zeros(n_features)
+        self.m2 = np.zeros(n_features)  # sum of squared deviations from the mean
+        self.min = np.full(n_features, np.inf)
+        self.max = np.full(n_features, -np.inf)
+        self.edges = edges
+        self.histograms = [np.zeros(len(feature_edges) + 1, dtype=np.int64) for feature_edges in edges or []]
+
+    def _merge_moments(self, count, mean, m2):
+        """Merge another set of moments (Chan et al.'s parallel algorithm)."""
+        total = self.count + count
+        weight = count / np.maximum(total, 1)
+        delta = mean - self.mean
+        self.mean += delta * weight
+        self.m2 += m2 + delta ** 2 * self.count * weight
+        self.count = total
+
+    def update(self, block):
+        """Update the statistics with a (rows, features) block of values."""
+        missing = np.isnan(block)
+        if missing.any():
+            # ignore missing values: zero their deviations, and exclude them from the ranges
+            self.missing += missing.sum(axis=0)
+            count = len(block) - missing.sum(axis=0)
+            mean = np.where(missing, 0., block).sum(axis=0) / np.maximum(count, 1)
+            m2 = (np.where(missing, 0., block - mean) ** 2).sum(axis=0)
+            np.minimum(self.min, np.where(missing, np.inf, block).min(axis=0), out=self.min)
+            np.maximum(self.max, np.where(missing, -np.inf, block).max(axis=0), out=self.max)
+        else:
+            count = len(block)
+            mean = block.mean(axis=0)
+            m2 = ((block - mean) ** 2).sum(axis=0)
+            np.minimum(self.min, block.min(axis=0), out=self.min)
+            np.maximum(self.max, block.max(axis=0), out=self.max)
+        self._merge_moments(count, mean, m2)
+        for feature_edges, histogram, column in zip(self.edges or [], self.histograms, block.T):
+            # NaNs sort past the last edge; remove them from the last bin
+            bins = np.bincount(np.searchsorted(feature_edges, column, side='right'), minlength=len(histogram))
+            bins[-1] -= np.count_nonzero(np.isnan(column))
+            histogram += bins
+
+    def merge(self, other):
+        """Merge statistics computed from other data (e.g., by another worker)."""
+        self._merge_moments(other.count, other.mean, other.m2)
+        self.missing += other.missing
+        np.minimum(self.min, other.min, out=self.min)
+        np.maximum(self.max, other.max, out=self.max)
+        for histogram, other_histogram in zip(self.histograms, other.histograms):
+            histogram += other_histogram
+        return self
+
+    def quantiles(self, feature, qs):
+        """Estimate quantiles of a feature by interpolating within its histogram bins."""
+        histogram = self.histograms[feature]
+        total = histogram.sum()
+        if not total:
+            return [None] * len(qs)
+        lower = min(self.min[feature], self.edges[feature][0]) if len(self.edges[feature]) else self.min[feature]
+        upper = max(self.max[feature], self.edges[feature][-1]) if len(self.edges[feature]) else self.max[feature]
+        bounds = np.concatenate([[lower], self.edges[feature], [upper]])
+        cumulative = np.concatenate([[0], np.cumsum(histogram)]) / total
+        return [float(np.interp(q, cumulative, bounds)) for q in qs]
+
+    def to_dict(self):
+        """Return the statistics as JSON-serializable data."""
+        return dict(
+            count=self.count.tolist(), missing=self.missing.tolist(), mean=self.mean.tolist(),
+            m2=self.m2.tolist(), min=self.min.tolist(), max=self.max.tolist(),
+            histograms=[histogram.tolist() for histogram in self.histograms],
+        )
+
+    @classmethod
+    def from_dict(cls, data, edges=None):
+        """Load statistics from `to_dict` output."""
+        stats = cls(len(data['count']), edges)
+        stats.count = np.asarray(data['count'], dtype=np.int64)
+        stats.missing = np.asarray(data['missing'], dtype=np.int64)
+        stats.mean = np.asarray(data['mean'], dtype=np.float64)
+        stats.m2 = np.asarray(data['m2'], dtype=np.float64)
+        stats.min = np.asarray(data['min'], dtype=np.float64)
+        stats.max = np.asarray(data['max'], dtype=np.float64)
+        stats.histograms = [np.asarray(histogram, dtype=np.int64) for histogram in data['histograms']]
+        return stats
+
+
+def population_stability_index(expected, actual, epsilon=1e-4):
+    """Return the PSI between two sets of bin proportions."""
+    expected = np.maximum(np.asarray(expected, dtype=np.float64), epsilon)
+    actual = np.maximum(np.asarray(actual, dtype=np.float64), epsilon)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+class FeatureMonitor(object):
+    """Online monitor of input feature statistics and their drift from a reference profile."""
+
+    def __init__(
+            self,
+            reference=None,
+            block_size=1024,
+            psi_threshold=.2,
+            mean_shift_threshold=3.,
+            quantiles=(.05, .5, .95),
+            shared_dir=None,
+            share_interval=1.,
+            stale_after=60.):
+        """Initialize feature monitor.
+
+        Arguments:
+            - reference (ReferenceProfile): training data profile; without one, only
+                moments and ranges are tracked
+            - block_size (int): rows collected before statistics are updated
+            - psi_threshold (float): PSI above which a feature is reported as drifted
+            - mean_shift_threshold (float): shift of the mean, in reference standard
+                deviations, above which a feature is reported as drifted
+            - quantiles (tuple): quantiles estimated from the histograms
+            - shared_dir (str): directory in which workers share their statistics, so
+                reports merge all workers' statistics
+            - share_interval (float): seconds between writes of a worker's statistics
+                to `shared_dir`
+            - stale_after (float): seconds after which the statistics of a worker that
+                stopped writing them (e.g., one that exited) are dropped from reports
+        """
+        self.reference = reference
+        self.block_size = block_size
+        self.psi_threshold = psi_threshold
+        self.mean_shift_threshold = mean_shift_threshold
+        self.quantiles = quantiles
+        self.shared_dir = shared_dir
+        self.share_interval = share_interval
+        self.stale_after = stale_after
+        self.skipped = 0
+        self._lock = Lock()
+        self._share_lock = Lock()
+        self._pid = None
+        self._n_features = reference.n_features if reference is not None else None
+
+    def __repr__(self):
+        """String representation."""
+        return '<FeatureMonitor: {} features>'.format(self._n_features)
+
+    def _reset(self, n_features):
+        """Start empty statistics in this process; called again if the process has been forked."""
+        self._pid = os.getpid()
+        self._n_features = n_features
+        self._stats = FeatureStats(n_features, self.reference.edges if self.reference is not None else None)
+        self._block = np.empty((self.block_size, n_features), dtype=np.float64)
+        self._rows = 0
+        self._changed = False
+        if self.shared_dir is not None:
+            sharer = Thread(target=self._share_periodically, name='serveit-monitor')
+            sharer.daemon = True
+            sharer.start()
+
+    def observe(self, data):
+        """Record a batch of inputs, with samples along the first axis.
+
+        Rows are copied into the current block, and statistics are updated once the
+        block is full. Inputs that aren't numeric, or don't have the expected number
+        of features, are counted as skipped.
+        """
+        data = np.asarray(data)
+        if data.ndim != 2 or data.dtype.kind not in 'biuf' or (
+                self._n_features is not None and data.shape[1] != self._n_features):
+            with self._lock:
+                self.skipped += 1
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset(data.shape[1])
+            start, rows = 0, len(data)
+            while start < rows:
+                end = min(rows, start + self.block_size - self._rows)
+                self._block[self._rows:self._rows + end - start] = data[start:end]
+                self._rows += end - start
+                start = end
+                if self._rows == self.block_size:
+                    self._flush()
+
+    def _flush(self):
+        """Update statistics with the rows collected so far."""
+        if self._rows:
+            self._stats.update(self._block[:self._rows])
+            self._rows = 0
+            self._changed = True
+
+    def _path(self, pid):
+        """Path of a worker's shared statistics."""
+        return os.path.join(self.shared_dir, 'worker-{}.json'.format(pid))
+
+    def share(self):
+        """Write this worker's statistics to `shared_dir` now (e.g., before the worker exits).
+
+        Unchanged statistics are not written again, but their file is touched so
+        that it doesn't go stale.
+        """
+        path = self._path(os.getpid())
+        with self._share_lock:
+            with self._lock:
+                if self._pid != os.getpid():
+                    return
+                self._flush()
+                state = self._stats.to_dict() if self._changed or not os.path.exists(path) else None
+                self._changed = False
+            if state is None:
+                os.utime(path, None)
+                return
+            with open(path + '.tmp', 'w') as f:
+                json.dump(state, f)
+            os.rename(path + '.tmp', path)
+
+    def _share_periodically(self):
+        """Share statistics every `share_interval` seconds."""
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.share_interval)
+            try:
+                self.share()
+            except Exception:
+                logger.warning('Unable to share feature statistics', exc_info=True)
+
+    def stats(self):
+        """Return statistics of all observed inputs, merged across workers if shared."""
+        edges = self.reference.edges if self.reference is not None else None
+        with self._lock:
+            if self._pid != os.getpid():
+                if self._n_features is None:
+                    return None
+                self._reset(self._n_features)
+            self._flush()
+            stats = FeatureStats(self._n_features, edges).merge(self._stats)
+        if self.shared_dir is not None:
+            own = self._path(os.getpid())
+            for path in glob.glob(os.path.join(self.shared_dir, 'worker-*.json')):
+                if path == own:
+                    continue
+                try:
+                    if time.time() - os.path.getmtime(path) > self.stale_after:
+                        logger.info('Dropping stale worker feature statistics {}'.format(path))
+                        os.remove(path)
+                        continue
+                    with open(path) as f:
+                        stats.merge(FeatureStats.from_dict(json.load(f), edges))
+                except (IOError, OSError, ValueError):
+                    logger.warning('Unable to read worker feature statistics from {}'.format(path), exc_info=True)
+        return stats
+
+    def report(self):
+        """Return per-feature statistics and drift scores."""
+        stats = self.stats()
+        if stats is None:
+            return dict(count=0, skipped=self.skipped, features=[], drifted=[])
+        names = self.reference.feature_names if self.reference is not None else [
+            str(i) for i in range(len(stats.count))]
+        features = []
+        for i, name in enumerate(names):
+            count = int(stats.count[i])
+            feature = dict(
+                name=name,
+                count=count,
+                missing=int(stats.missing[i]),
+                mean=float(stats.mean[i]) if count else None,
+                std=float(np.sqrt(stats.m2[i] / count)) if count else None,
+                min=float(stats.min[i]) if count else None,
+                max=float(stats.max[i]) if count else None,
+            )
+            if self.reference is not None:
+                feature['quantiles'] = dict(zip(
+                    ['p{:g}'.format(100 * q) for q in self.quantiles], stats.quantiles(i, self.quantiles)))
+                reference_std = self.reference.std[i]
+                feature['reference'] = dict(mean=float(self.reference.mean[i]), std=float(reference_std))
+                if count:
+                    histogram = stats.histograms[i]
+                    feature['psi'] = population_stability_index(
+                        self.reference.proportions[i], histogram / max(histogram.sum(), 1))
+                    # undefined (None) if a constant reference feature has shifted, which counts as drift
+                    shift = abs(feature['mean'] - self.reference.mean[i])
+                    feature['mean_shift'] = float(shift / reference_std) if reference_std > 0 else (
+                        0. if shift == 0 else None)
+                    feature['drift'] = bool(feature['psi'] > self.psi_threshold or feature['mean_shift'] is None or
+                                            feature['mean_shift'] > self.mean_shift_threshold)
+            features.append(feature)
+        return dict(
+            count=int(stats.count.max()) if len(stats.count) else 0,
+            skipped=self.skipped,
+            features=features,
+            drifted=[feature['name'] for feature in features if feature.get('drift')],
+        )
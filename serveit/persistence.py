@@ -0,0 +1,95 @@
+"""Save fitted models once and load them memory-mapped.
+
+Large arrays in a saved artifact are memory-mapped read-only when loaded, so
+server processes on the same host share a single page cache copy of the model
+and start without retraining or downloading it.
+"""
+import json
+import os
+import sys
+
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+METADATA_FILE = 'serveit.json'
+JOBLIB_FILE = 'model.joblib'
+TORCH_FILE = 'model.pt'
+KERAS_ARCHITECTURE_FILE = 'architecture.json'
+KERAS_WEIGHTS_FILE = 'weights_{:04d}.npy'
+
+
+def _is_torch_module(model):
+    """Check if model is a PyTorch module without importing PyTorch."""
+    if 'torch' not in sys.modules:
+        return False
+    import torch
+    return isinstance(model, torch.nn.Module)
+
+
+def _is_keras_model(model):
+    """Check if model looks like a Keras model."""
+    return all(hasattr(model, attr) for attr in ('to_json', 'get_weights', 'set_weights'))
+
+
+def save_model(model, path):
+    """Save a fitted model to an artifact directory.
+
+    Keras models are saved as a JSON architecture plus one `.npy` file per weight
+    array, PyTorch modules with `torch.save`, and any other (e.g., Scikit-Learn)
+    model with uncompressed joblib so its numpy arrays can be memory-mapped.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    if _is_torch_module(model):
+        import torch
+        artifact_format = 'torch'
+        torch.save(model, os.path.join(path, TORCH_FILE))
+    elif _is_keras_model(model):
+        import numpy as np
+        artifact_format = 'keras'
+        with open(os.path.join(path, KERAS_ARCHITECTURE_FILE), 'w') as f:
+            f.write(model.to_json())
+        weights = model.get_weights()
+        for i, weight in enumerate(weights):
+            np.save(os.path.join(path, KERAS_WEIGHTS_FILE.format(i)), weight)
+    else:
+        import joblib
+        artifact_format = 'joblib'
+        joblib.dump(model, os.path.join(path, JOBLIB_FILE))
+    with open(os.path.join(path, METADATA_FILE), 'w') as f:
+        json.dump(dict(format=artifact_format, model_type=type(model).__name__), f)
+    logger.info('Saved {} model to {}'.format(artifact_format, path))
+
+
+def load_model(path, mmap_mode='r'):
+    """Load a model saved with `save_model`.
+
+    Arguments:
+        - path (str): artifact directory
+        - mmap_mode (str): numpy memory-map mode for the model's arrays; the default
+            ('r') maps them read-only, and None reads them into process memory
+
+    Note that Keras copies weights into its own variables, so Keras artifacts skip
+    training or downloads but do not share memory across processes.
+    """
+    with open(os.path.join(path, METADATA_FILE)) as f:
+        artifact_format = json.load(f)['format']
+    if artifact_format == 'joblib':
+        import joblib
+        model = joblib.load(os.path.join(path, JOBLIB_FILE), mmap_mode=mmap_mode)
+    elif artifact_format == 'torch':
+        import torch
+        model = torch.load(os.path.join(path, TORCH_FILE), mmap=mmap_mode is not None, weights_only=False)
+        model.eval()
+    elif artifact_format == 'keras':
+        import numpy as np
+        from keras.models import model_from_json
+        with open(os.path.join(path, KERAS_ARCHITECTURE_FILE)) as f:
+            model = model_from_json(f.read())
+        weight_files = sorted(name for name in os.listdir(path) if name.startswith('weights_'))
+        model.set_weights([np.load(os.path.join(path, name), mmap_mode=mmap_mode) for name in weight_files])
+    else:
+        raise ValueError('Unknown model artifact format: {}'.format(artifact_format))
+    logger.info('Loaded {} model from {}'.format(artifact_format, path))
+    return model
@@ -0,0 +1,131 @@
+"""Thread-pool inference with one model replica per worker thread."""
+from concurrent.futures import Future
+from queue import Queue
+from threading import Event, Lock, Thread
+import multiprocessing
+import os
+
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class ReplicaPool(object):
+    """Prediction function that runs requests on a pool of model replicas.
+
+    Each worker thread creates its own replica with `replica_factory` and is the
+    only thread to ever use it, so models and framework sessions that are not
+    thread safe (e.g., Keras/TensorFlow) can serve requests in parallel. Requests
+    are queued and picked up by whichever replica is idle first. Frameworks that
+    release the GIL during compute (NumPy BLAS, PyTorch) then scale with cores
+    within a single process.
+
+    A ReplicaPool is passed to `ModelServer` in place of a predict function:
+
+        pool = ReplicaPool(lambda: build_model().predict, size=4)
+        server = ModelServer(model, pool)
+    """
+
+    def __init__(self, replica_factory, size=None, timeout=None):
+        """Initialize replica pool.
+
+        Arguments:
+            - replica_factory (fn): takes no arguments and returns a predict function
+                for a new model replica; called once in each worker thread
+            - size (int): number of replicas and worker threads; defaults to the CPU count
+            - timeout (float): seconds to wait for a prediction before raising
+                `concurrent.futures.TimeoutError`; waits indefinitely by default
+        """
+        self.replica_factory = replica_factory
+        self.size = size or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self._lock = Lock()
+        self._pid = None
+        self._busy = 0
+        self._requests = [0] * self.size
+
+    def __repr__(self):
+        """String representation."""
+        return '<ReplicaPool: {} replicas>'.format(self.size)
+
+    def start(self):
+        """Create replicas and start worker threads, raising any replica factory error.
+
+        Called automatically on first use, and again after the process is forked.
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._jobs = Queue()
+            ready = [Event() for _ in range(self.size)]
+            errors = [None] * self.size
+            for i in range(self.size):
+                worker = Thread(target=self._work, args=(i, ready[i], errors), name='serveit-replica-{}'.format(i))
+                worker.daemon = True
+                worker.start()
+            for event in ready:
+                event.wait()
+            if any(errors):
+                self._shutdown()
+                raise next(error for error in errors if error)
+            self._pid = os.getpid()
+        logger.info('Started {} model replicas'.format(self.size))
+
+    def _work(self, index, ready, errors):
+        """Create a replica and run queued predictions on it."""
+        try:
+            predict = self.replica_factory()
+        except Exception as e:
+            logger.error('Unable to create model replica', exc_info=True)
+            errors[index] = e
+            return
+        finally:
+            ready.set()
+        jobs = self._jobs
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            data, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            with self._lock:
+                self._busy += 1
+                self._requests[index] += 1
+            try:
+                future.set_result(predict(data))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._busy -= 1
+
+    def __call__(self, data):
+        """Predict on the next idle replica and wait for the result."""
+        if self._pid != os.getpid():
+            self.start()
+        future = Future()
+        self._jobs.put((data, future))
+        return future.result(self.timeout)
+
+    def _shutdown(self):
+        """Signal all worker threads to exit once queued predictions are done."""
+        for _ in range(self.size):
+            self._jobs.put(None)
+
+    def shutdown(self):
+        """Stop worker threads; the pool restarts on next use."""
+        with self._lock:
+            if self._pid == os.getpid():
+                self._shutdown()
+            self._pid = None
+
+    def stats(self):
+        """Return replica utilization."""
+        with self._lock:
+            return dict(
+                size=self.size,
+                busy=self._busy,
+                queue_size=self._jobs.qsize() if self._pid == os.getpid() else 0,
+                requests_per_replica=list(self._requests),
+            )
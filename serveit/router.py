@@ -0,0 +1,365 @@
+"""Load-aware routing of requests across ModelServer backends.
+
+`Router` is a WSGI application that fronts several servers (processes on one
+host, or other hosts) and forwards each request to the healthy backend with
+the fewest outstanding requests, over pooled keep-alive connections:
+
+    router = Router(['127.0.0.1:5001', '127.0.0.1:5002', '10.0.0.2:5000'])
+    router.serve(port=5000)
+
+Backends are health checked in the background and ejected from routing after
+failed checks or connection errors, and rejoin once a check succeeds. Requests
+are only retried on another backend if they couldn't be sent; requests whose
+backend times out get 504 responses, and other failures 502 responses. With a
+`hash_key`, requests with the same key are routed to the same backend
+(consistent hashing), so per-backend prediction caches stay warm.
+"""
+from bisect import bisect
+from http.client import HTTPConnection, HTTPException, RemoteDisconnected
+from queue import LifoQueue, Empty, Full
+from threading import Event, Lock, Thread
+import hashlib
+import json
+import os
+import socket
+
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+# headers that apply to a single connection and are not forwarded
+HOP_BY_HOP_HEADERS = frozenset((
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailers', 'transfer-encoding', 'upgrade',
+))
+
+CONNECTION_ERRORS = (socket.error, HTTPException)
+
+
+class BackendUnavailable(IOError):
+    """Raised when a request can't be sent to a backend, so it may be sent to another."""
+
+
+def header_key(name='X-Routing-Key'):
+    """Return a hash key function that reads a request header."""
+    environ_key = 'HTTP_' + name.upper().replace('-', '_')
+
+    def hash_key(environ, body):
+        """Return the request's routing header, if any."""
+        return environ.get(environ_key)
+    return hash_key
+
+
+def body_key(environ, body):
+    """Hash key function that routes identical request bodies to the same backend."""
+    return body or None
+
+
+def _hash(value):
+    """Return a stable integer hash of a string or bytes value."""
+    if not isinstance(value, bytes):
+        value = str(value).encode('utf-8')
+    return int(hashlib.md5(value).hexdigest()[:16], 16)
+
+
+class Backend(object):
+    """Server behind the router, with a pool of keep-alive connections."""
+
+    def __init__(self, address, pool_size=8, timeout=10.):
+        """Initialize backend.
+
+        Arguments:
+            - address (str): 'host:port', optionally prefixed with 'http://'
+            - pool_size (int): maximum number of idle connections kept open
+            - timeout (float): socket timeout in seconds
+        """
+        address = address.split('://', 1)[-1].rstrip('/')
+        host, _, port = address.rpartition(':')
+        self.address = address
+        self.host = host
+        self.port = int(port)
+        self.timeout = timeout
+        self.healthy = True
+        self.outstanding = 0
+        self.counts = dict(requests=0, errors=0, connections=0, ejections=0)
+        self._pool = LifoQueue(pool_size)
+        self._lock = Lock()
+
+    def __repr__(self):
+        """String representation."""
+        return '<Backend: {}>'.format(self.address)
+
+    def _connect(self):
+        """Open a new connection."""
+        with self._lock:
+            self.counts['connections'] += 1
+        return HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _send(self, connection, method, path, body, headers):
+        """Send a request on a connection; raises `BackendUnavailable` if it can't be sent."""
+        try:
+            connection.request(method, path, body, headers or {})
+        except CONNECTION_ERRORS as e:
+            raise BackendUnavailable('Unable to send request to {}: {}'.format(self.address, e))
+
+    def request(self, method, path, body=None, headers=None):
+        """Send a request and return the response status, headers and body.
+
+        Raises `BackendUnavailable` if the request couldn't be sent, and
+        `socket.timeout` if the response takes longer than the timeout. Sent
+        requests are not sent again, except when a reused idle connection turns
+        out to have been closed by the backend before it read the request: that
+        request is retried once on a new connection.
+        """
+        try:
+            connection, reused = self._pool.get_nowait(), True
+        except Empty:
+            connection, reused = self._connect(), False
+        try:
+            try:
+                self._send(connection, method, path, body, headers)
+                response = connection.getresponse()
+            except (BackendUnavailable, RemoteDisconnected):
+                connection.close()
+                if not reused:
+                    raise
+                connection = self._connect()
+                self._send(connection, method, path, body, headers)
+                response = connection.getresponse()
+            data = response.read()
+        except Exception:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            try:
+                self._pool.put_nowait(connection)
+            except Full:
+                connection.close()
+        return response.status, response.reason, response.getheaders(), data
+
+    def close(self):
+        """Close idle connections."""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except Empty:
+                return
+
+
+class Router(object):
+    """WSGI application routing requests across ModelServer backends."""
+
+    def __init__(
+            self,
+            backends,
+            hash_key=None,
+            virtual_nodes=100,
+            pool_size=8,
+            timeout=10.,
+            health_path='/info/model',
+            health_interval=1.,
+            stats_path='/info/router'):
+        """Initialize router.
+
+        Arguments:
+            - backends (list): backend addresses, as 'host:port' strings
+            - hash_key (fn): takes the WSGI environ and request body and returns a key
+                for consistent hashing (e.g., `header_key()` or `body_key`), or None to
+                route that request to the least loaded backend; by default, all
+                requests are routed by least outstanding requests
+            - virtual_nodes (int): points per backend on the consistent hashing ring
+            - pool_size (int): maximum number of idle keep-alive connections per backend
+            - timeout (float): backend socket timeout in seconds; requests whose responses
+                take longer get 504 responses, and are neither retried nor eject the backend
+            - health_path (str): path requested with GET to check a backend's health
+            - health_interval (float): seconds between health checks, or None to
+                disable background checks
+            - stats_path (str): path at which the router serves its own stats
+        """
+        self.backends = [Backend(address, pool_size, timeout) for address in backends]
+        if not self.backends:
+            raise ValueError('Router requires at least one backend')
+        self.hash_key = hash_key
+        self.health_path = health_path
+        self.health_interval = health_interval
+        self.stats_path = stats_path
+        self._ring = sorted(
+            (_hash('{}#{}'.format(backend.address, i)), backend)
+            for backend in self.backends for i in range(virtual_nodes)
+        )
+        self._ring_hashes = [point for point, _ in self._ring]
+        self._lock = Lock()
+        self._next = 0
+        self._pid = None
+        self._stopped = Event()
+
+    def __repr__(self):
+        """String representation."""
+        return '<Router: {} backends>'.format(len(self.backends))
+
+    def _start(self):
+        """Start the health check thread; called again if the process has been forked."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            if self.health_interval is not None:
+                worker = Thread(target=self._check_health_forever, name='serveit-router-health')
+                worker.daemon = True
+                worker.start()
+
+    def _check_health_forever(self):
+        """Check backends every `health_interval` seconds until stopped."""
+        while not self._stopped.wait(self.health_interval):
+            self.check_health()
+
+    def check_health(self):
+        """Check every backend, ejecting failures and restoring recovered backends."""
+        for backend in self.backends:
+            try:
+                status = backend.request('GET', self.health_path)[0]
+                healthy = status == 200
+            except Exception:
+                healthy = False
+            if healthy and not backend.healthy:
+                logger.info('Backend {} is healthy again'.format(backend.address))
+            self._set_health(backend, healthy)
+
+    def _set_health(self, backend, healthy):
+        """Mark a backend as healthy or eject it from routing."""
+        with self._lock:
+            if backend.healthy and not healthy:
+                backend.counts['ejections'] += 1
+                logger.warning('Ejecting unhealthy backend {}'.format(backend.address))
+            backend.healthy = healthy
+        if not healthy:
+            backend.close()
+
+    def stop(self):
+        """Stop health checks and close idle connections."""
+        self._stopped.set()
+        for backend in self.backends:
+            backend.close()
+
+    def choose(self, key=None, exclude=()):
+        """Return the backend for a request, and count it as outstanding.
+
+        Requests with a key go to the first healthy backend clockwise from the
+        key's hash on the ring; other requests go to the healthy backend with the
+        fewest outstanding requests, rotating between ties. Returns None if no
+        backend is healthy.
+        """
+        with self._lock:
+            candidates = [backend for backend in self.backends if backend.healthy and backend not in exclude]
+            if not candidates:
+                return None
+            if key is not None:
+                start = bisect(self._ring_hashes, _hash(key))
+                for i in range(len(self._ring)):
+                    backend = self._ring[(start + i) % len(self._ring)][1]
+                    if backend in candidates:
+                        break
+            else:
+                self._next = (self._next + 1) % len(candidates)
+                candidates = candidates[self._next:] + candidates[:self._next]
+                backend = min(candidates, key=lambda backend: backend.outstanding)
+            backend.outstanding += 1
+            backend.counts['requests'] += 1
+            return backend
+
+    def _release(self, backend, failed=False):
+        """Count a request as complete."""
+        with self._lock:
+            backend.outstanding -= 1
+            if failed:
+                backend.counts['errors'] += 1
+
+    def __call__(self, environ, start_response):
+        """Forward a request to a backend and relay its response."""
+        if self._pid != os.getpid():
+            self._start()
+        if environ.get('PATH_INFO') == self.stats_path:
+            return self._json_response(start_response, '200 OK', self.stats())
+
+        length = environ.get('CONTENT_LENGTH')
+        if length:
+            body = environ['wsgi.input'].read(int(length))
+        elif environ.get('wsgi.input_terminated'):
+            body = environ['wsgi.input'].read() or None  # e.g., a chunked body, decoded by the server
+        elif 'chunked' in environ.get('HTTP_TRANSFER_ENCODING', '').lower():
+            return self._json_response(
+                start_response, '411 LENGTH REQUIRED', dict(message='Chunked request bodies are not supported'))
+        else:
+            body = None
+        path = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+        if environ.get('QUERY_STRING'):
+            path += '?' + environ['QUERY_STRING']
+        headers = {
+            key[5:].replace('_', '-').title(): value for key, value in environ.items()
+            if key.startswith('HTTP_') and key[5:].replace('_', '-').lower() not in HOP_BY_HOP_HEADERS
+        }
+        if environ.get('CONTENT_TYPE'):
+            headers['Content-Type'] = environ['CONTENT_TYPE']
+        key = self.hash_key(environ, body) if self.hash_key is not None else None
+
+        # retry on another backend if the request can't be sent; the connection error ejects the backend
+        tried = []
+        while True:
+            backend = self.choose(key, exclude=tried)
+            if backend is None:
+                return self._json_response(
+                    start_response, '503 SERVICE UNAVAILABLE', dict(message='No healthy backends available'))
+            failed = True
+            try:
+                status, reason, response_headers, data = backend.request(
+                    environ['REQUEST_METHOD'], path, body, headers)
+                failed = False
+            except socket.timeout:
+                # the backend may still be predicting: keep it, and don't replay the request elsewhere
+                logger.error('Backend {} timed out'.format(backend.address))
+                return self._json_response(
+                    start_response, '504 GATEWAY TIMEOUT', dict(message='Backend timed out'))
+            except BackendUnavailable:
+                logger.error('Unable to reach backend {}'.format(backend.address), exc_info=True)
+                self._set_health(backend, False)
+                tried.append(backend)
+                continue
+            except CONNECTION_ERRORS:
+                # the backend may have received the request, so it isn't sent again
+                logger.error('Request to backend {} failed'.format(backend.address), exc_info=True)
+                self._set_health(backend, False)
+                return self._json_response(
+                    start_response, '502 BAD GATEWAY', dict(message='Backend request failed'))
+            finally:
+                self._release(backend, failed)
+            break
+
+        response_headers = [
+            (name, value) for name, value in response_headers if name.lower() not in HOP_BY_HOP_HEADERS
+        ]
+        start_response('{} {}'.format(status, reason), response_headers)
+        return [data]
+
+    @staticmethod
+    def _json_response(start_response, status, body):
+        """Respond with a JSON body."""
+        data = (json.dumps(body) + '\n').encode('utf-8')
+        start_response(status, [('Content-Type', 'application/json'), ('Content-Length', str(len(data)))])
+        return [data]
+
+    def stats(self):
+        """Return per-backend health and load."""
+        with self._lock:
+            return dict(backends=[
+                dict(address=backend.address, healthy=backend.healthy, outstanding=backend.outstanding,
+                     **backend.counts)
+                for backend in self.backends
+            ])
+
+    def serve(self, host='127.0.0.1', port=5000):
+        """Serve the router with a threaded server, so slow backends don't block other requests."""
+        from werkzeug.serving import run_simple
+        self._start()
+        run_simple(host, port, self, threaded=True)
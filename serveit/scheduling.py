@@ -0,0 +1,228 @@
+"""Priority classes and weighted fair scheduling of prediction requests.
+
+Interactive single-row requests and large bulk batches share `/predictions`;
+run first come, first served, one large batch stalls every request behind it.
+A `PriorityScheduler` sits in front of `predict`: each request is assigned a
+priority class, from a request header or by its number of rows, and large
+requests are split into slices of at most `slice_size` rows. Slices are
+queued per class and run by weighted fair queuing (self-clocked: each slice
+is tagged with its class's virtual finish time, rows / weight after the later
+of the class's previous slice and the slice in service, and the lowest tag
+runs next). A class with weight 8 thus gets eight times the rows of a class
+with weight 1 while both are backlogged, and interactive requests only wait
+for the slice in service rather than for whole bulk batches.
+
+A PriorityScheduler is passed to `ModelServer` in place of a predict
+function, and its per-class queue times can be served with:
+
+    scheduler = PriorityScheduler(clf.predict, classes={'interactive': 8, 'bulk': 1})
+    server = ModelServer(clf, scheduler)
+    server.create_info_endpoint('scheduling', scheduler.stats)
+
+Priority headers are read from Flask request contexts; requests served by the
+WSGI fast path (see `serveit.fastpath`) are classified by size.
+"""
+from collections import deque
+from concurrent.futures import Future
+from threading import Condition, Lock, Thread
+from timeit import default_timer as timer
+import os
+
+from flask import has_request_context, request
+import numpy as np
+
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class _Request(object):
+    """Pending prediction request, predicted in one or more slices."""
+
+    __slots__ = ('data', 'priority', 'future', 'enqueued', 'started', 'results', 'remaining')
+
+    def __init__(self, data, priority, n_slices, enqueued):
+        self.data = data
+        self.priority = priority
+        self.future = Future()
+        self.enqueued = enqueued
+        self.started = None
+        self.results = [None] * n_slices
+        self.remaining = n_slices
+
+
+class PriorityScheduler(object):
+    """Prediction function that schedules requests by priority class with weighted fair queuing."""
+
+    def __init__(
+            self,
+            predict,
+            classes=None,
+            header='X-Priority',
+            max_interactive_rows=100,
+            slice_size=1000,
+            workers=1,
+            window_size=1000):
+        """Initialize priority scheduler.
+
+        Arguments:
+            - predict (fn): takes a numpy array with samples along the first axis and
+                returns predictions with one entry per sample
+            - classes (dict): priority class names and their weights; defaults to
+                {'interactive': 8, 'bulk': 1}
+            - header (str): request header naming the priority class; requests without
+                it (or with an unknown class) are classified by size
+            - max_interactive_rows (int): requests with up to this many rows are classified
+                as the highest weighted class, and larger requests as the lowest
+            - slice_size (int): maximum number of rows per `predict` call; larger
+                requests are split into slices that interleave with other classes
+            - workers (int): number of threads calling `predict`
+            - window_size (int): number of recent requests per class used for percentiles
+        """
+        self.predict = predict
+        self.classes = dict(classes or {'interactive': 8, 'bulk': 1})
+        if not self.classes or min(self.classes.values()) <= 0:
+            raise ValueError('Priority classes must have positive weights')
+        self.header = header
+        self.max_interactive_rows = max_interactive_rows
+        self.slice_size = slice_size
+        self.workers = workers
+        ranked = sorted(self.classes, key=lambda name: (self.classes[name], name))
+        self.interactive_class, self.bulk_class = ranked[-1], ranked[0]
+        self._lock = Lock()
+        self._pid = None
+        self._queue_times = {name: deque(maxlen=window_size) for name in self.classes}
+        self._latencies = {name: deque(maxlen=window_size) for name in self.classes}
+        self._counts = {name: dict(requests=0, slices=0, rows=0) for name in self.classes}
+
+    def __repr__(self):
+        """String representation."""
+        return '<PriorityScheduler: {}>'.format(type(self.predict).__name__)
+
+    def _start(self):
+        """Start the worker threads; called again if the process has been forked."""
+        self._pid = os.getpid()
+        self._condition = Condition(Lock())
+        self._queues = {name: deque() for name in self.classes}  # (virtual finish tag, request, slice index)
+        self._finish_tags = dict.fromkeys(self.classes, 0.)
+        self._virtual_time = 0.
+        for i in range(self.workers):
+            worker = Thread(target=self._work, name='serveit-scheduler-{}'.format(i))
+            worker.daemon = True
+            worker.start()
+
+    def classify(self, data):
+        """Return the priority class of a request: its header's class if valid, otherwise by size."""
+        if self.header and has_request_context():
+            priority = request.headers.get(self.header)
+            if priority in self.classes:
+                return priority
+            if priority is not None:
+                logger.debug('Unknown priority class {!r}; classifying by size'.format(priority))
+        return self.interactive_class if len(data) <= self.max_interactive_rows else self.bulk_class
+
+    def __call__(self, data):
+        """Queue data in its priority class and wait for its predictions."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._start()
+        data = np.asarray(data)
+        priority = self.classify(data)
+        n_slices = max(1, -(-len(data) // self.slice_size))
+        pending = _Request(data, priority, n_slices, timer())
+        weight = float(self.classes[priority])
+        with self._condition:
+            queue = self._queues[priority]
+            finish = max(self._virtual_time, self._finish_tags[priority])
+            for index in range(n_slices):
+                finish += max(len(self._slice(data, index)), 1) / weight
+                queue.append((finish, pending, index))
+            self._finish_tags[priority] = finish
+            self._condition.notify(n_slices)
+        return pending.future.result()
+
+    def _slice(self, data, index):
+        """Return a slice of a request's data."""
+        if len(data) <= self.slice_size:
+            return data
+        return data[index * self.slice_size:(index + 1) * self.slice_size]
+
+    def _next_slice(self):
+        """Wait for the queued slice with the lowest virtual finish tag."""
+        with self._condition:
+            while True:
+                heads = [queue[0] for queue in self._queues.values() if queue]
+                if heads:
+                    break
+                self._condition.wait()
+            finish, pending, index = min(heads, key=lambda head: head[0])
+            self._queues[pending.priority].popleft()
+            self._virtual_time = finish
+            if pending.started is None:
+                pending.started = timer()
+            return pending, index
+
+    def _work(self):
+        """Run queued slices until the process exits."""
+        while True:
+            pending, index = self._next_slice()
+            if pending.future.done():  # an earlier slice failed
+                continue
+            data = self._slice(pending.data, index)
+            try:
+                predictions = self.predict(data)
+                if len(predictions) != len(data):
+                    raise ValueError('Expected {} predictions, got {}'.format(len(data), len(predictions)))
+            except Exception as e:
+                with self._lock:
+                    if not pending.future.done():  # other slices of the request may fail concurrently
+                        pending.future.set_exception(e)
+                continue
+            with self._lock:
+                pending.results[index] = predictions
+                pending.remaining -= 1
+                done = pending.remaining == 0
+                counts = self._counts[pending.priority]
+                counts['slices'] += 1
+                counts['rows'] += len(data)
+                if done:
+                    now = timer()
+                    counts['requests'] += 1
+                    self._queue_times[pending.priority].append(pending.started - pending.enqueued)
+                    self._latencies[pending.priority].append(now - pending.enqueued)
+            if done:
+                pending.future.set_result(self._join(pending.results))
+
+    @staticmethod
+    def _join(results):
+        """Join the predictions of a request's slices."""
+        if len(results) == 1:
+            return results[0]
+        if all(isinstance(result, np.ndarray) for result in results):
+            return np.concatenate(results)
+        return [prediction for result in results for prediction in result]
+
+    def stats(self):
+        """Return per-class weights, counts, queue lengths, and queue time and latency percentiles."""
+        def percentiles(values):
+            values = np.array(values) * 1e3
+            if not len(values):
+                return dict(p50_ms=None, p99_ms=None)
+            return dict(p50_ms=float(np.percentile(values, 50)), p99_ms=float(np.percentile(values, 99)))
+
+        queued = {}
+        if self._pid == os.getpid():
+            with self._condition:
+                queued = {name: len(queue) for name, queue in self._queues.items()}
+        with self._lock:
+            return {
+                name: dict(
+                    weight=weight,
+                    queued_slices=queued.get(name, 0),
+                    queue_time=percentiles(self._queue_times[name]),
+                    latency=percentiles(self._latencies[name]),
+                    **self._counts[name]
+                )
+                for name, weight in self.classes.items()
+            }
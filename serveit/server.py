@@ -1,8 +1,13 @@
 """Base class for serving predictions."""
-from flask import Flask, jsonify
+from timeit import default_timer as timer
+
+from flask import Flask, after_this_request, jsonify, request
 from flask_restful import Resource, Api
+from werkzeug.exceptions import RequestEntityTooLarge
 import numpy as np
 
+from .columnar import ColumnarInputError
+from .tracing import NOOP_SPAN, no_span
 from .utils import make_serializable, json_numpy_loader
 from .log_utils import get_logger
 
@@ -29,6 +34,58 @@ def make_response(message, status_code, details=None):
     return response
 
 
+def apply_callbacks(callbacks, data, span=None, stage=None):
+    """Apply a callback, or each callback of an iterable in order, to data.
+
+    If a `span` function is given (e.g., `Tracer.span`), each callback of an
+    iterable runs in a span named after the stage and the callback.
+    """
+    if hasattr(callbacks, '__iter__'):
+        for callback in callbacks:
+            if span is None:
+                data = callback(data)
+            else:
+                with span('{}:{}'.format(stage, getattr(callback, '__name__', type(callback).__name__))):
+                    data = callback(data)
+        return data
+    return callbacks(data)
+
+
+class InputValidationError(ValueError):
+    """Raised when data fails the user defined input validation callback."""
+
+    def __init__(self, reason):
+        """Initialize exception with the reason returned by the validation callback."""
+        self.reason = reason
+        super(InputValidationError, self).__init__(
+            'Input validation failed with reason: {}'.format(reason))
+
+
+def _is_feature_names(data):
+    """Return True if info data is a list of unique feature names."""
+    if not isinstance(data, (list, tuple, np.ndarray)) or not all(isinstance(name, str) for name in data):
+        return False
+    return len(set(data)) == len(data)
+
+
+def _traced(tracer, name, respond):
+    """Call `respond` in a trace continuing the caller's, if any, when tracing is enabled."""
+    if tracer is None:
+        return respond()
+    with tracer.trace(name, request.headers.get('traceparent')) as request_span:
+        response = respond()
+        request_span.set_attribute('status_code', getattr(response, 'status_code', 200))
+        return response
+
+
+def mirror_after_response(shadow, data, prediction, latency):
+    """Submit a prediction to a shadow model once the current response has been sent."""
+    @after_this_request
+    def register_mirror(response):
+        response.call_on_close(lambda: shadow.submit(data, prediction, latency))
+        return response
+
+
 class ModelServer(object):
     """Easy deploy class."""
 
@@ -40,7 +97,13 @@ class ModelServer(object):
             data_loader=json_numpy_loader,
             preprocessor=lambda x: x,
             postprocessor=make_serializable,
-            to_numpy=True):
+            to_numpy=True,
+            shadow=None,
+            thread_budget=None,
+            fast_path=False,
+            max_content_length=None,
+            monitor=None,
+            tracer=None):
         """Initialize class with prediction function.
 
         Arguments:
@@ -51,116 +114,302 @@ class ModelServer(object):
             - data_loader (fn): reads flask request and returns data preprocessed to be
                 used in the `predict` method
             - postprocessor (fn): transforms the predictions from the `predict` method
+            - shadow (ShadowModel): optional candidate model that is sent a copy of
+                each preprocessed input after the primary response has been sent
+            - thread_budget (ThreadBudget): optional CPU thread budget, applied on
+                initialization to limit BLAS, OpenMP and framework thread pools
+            - fast_path (bool): serve JSON requests to `/predictions` from a raw WSGI
+                handler that bypasses Flask dispatch (see `serveit.fastpath`)
+            - max_content_length (int): maximum request body size in bytes; larger
+                requests get 413 responses, before their bodies are read if their
+                length is declared (see also `serveit.body.StreamingLoader`)
+            - monitor (FeatureMonitor): optional monitor of input feature statistics and
+                drift, observing each input that passes validation
+            - tracer (Tracer): optional tracer recording spans of sampled prediction
+                requests and their stages (see `serveit.tracing`)
         """
         self.model = model
         self.predict = predict
+        self.shadow = shadow
+        self.thread_budget = thread_budget
+        self.fast_path = fast_path
+        self.monitor = monitor
+        self.tracer = tracer
+        if thread_budget is not None:
+            thread_budget.apply()
+        self.input_validation = input_validation
         self.data_loader = data_loader
         self.preprocessor = preprocessor
         self.postprocessor = postprocessor
+        self.to_numpy = to_numpy
+        self.columnar = None  # set by registering feature names (see `serveit.columnar`)
         self.app = Flask('{}_{}'.format(self.__class__.__name__, type(predict).__name__))
+        self.app.config['MAX_CONTENT_LENGTH'] = max_content_length
         self.api = Api(self.app, catch_all_404s=True)
-        self._create_prediction_endpoint(
-            data_loader=data_loader,
-            input_validation=input_validation,
-            preprocessor=preprocessor,
-            postprocessor=postprocessor,
-            to_numpy=to_numpy,
-        )
+        self._create_prediction_endpoint(data_loader=data_loader)
         logger.info('Model predictions registered to endpoint /predictions (available via POST)')
         self.app.logger.setLevel(logger.level)  # TODO: separate configuration for API loglevel
         self._create_model_info_endpoint()
+        if shadow is not None:
+            self.create_info_endpoint('shadow', shadow.stats)
+        if thread_budget is not None:
+            self.create_info_endpoint('threads', lambda: thread_budget.settings)
+        if monitor is not None:
+            self.create_info_endpoint('drift', monitor.report)
+        if tracer is not None:
+            self.create_info_endpoint('tracing', tracer.stats)
+
+    @classmethod
+    def from_artifact(cls, path, predict='predict', mmap_mode='r', **kwargs):
+        """Initialize a server with a model saved by `ModelServer.save_model`.
+
+        Arguments:
+            - path (str): model artifact directory
+            - predict (str): name of the model's prediction method, or None to use
+                the model itself as the prediction function (e.g., PyTorch modules)
+            - mmap_mode (str): memory-map mode for the model's arrays; read-only
+                mappings are shared by all processes serving the same artifact
+            - kwargs: passed to `ModelServer`
+        """
+        from .persistence import load_model
+        model = load_model(path, mmap_mode=mmap_mode)
+        return cls(model, model if predict is None else getattr(model, predict), **kwargs)
+
+    def save_model(self, path):
+        """Save the served model to an artifact directory."""
+        from .persistence import save_model
+        save_model(self.model, path)
 
     def __repr__(self):
         """String representation."""
         return '<PredictionsServer: {}>'.format(type(self.predict).__name__)
 
-    def _create_prediction_endpoint(
-            self,
-            to_numpy=True,
-            data_loader=json_numpy_loader,
-            preprocessor=lambda x: x,
-            input_validation=lambda data: (True, None),
-            postprocessor=lambda x: x,
-            make_serializable_post=True):
+    def _create_prediction_endpoint(self, data_loader=json_numpy_loader):
         """Create an endpoint to serve predictions.
 
         Arguments:
-            - input_validation (fn): takes a numpy array as input;
-                returns True if validation passes and False otherwise
             - data_loader (fn): reads flask request and returns data preprocessed to be
                 used in the `predict` method
-            - postprocessor (fn): transforms the predictions from the `predict` method
         """
-        # copy instance variables to local scope for resource class
-        predict = self.predict
+        tracer = self.tracer
+        span = tracer.span if tracer is not None else no_span  # spans of stages of sampled requests
         logger = self.app.logger
+        server = self
+
+        def respond(data, mirror=mirror_after_response):
+            """Run loaded data through the pipeline; return predictions or an error response."""
+            try:
+                data = server.preprocess(data, columnar=data_loader is json_numpy_loader)
+            except InputValidationError as e:
+                # if validation fails, log the reason code, log the data, and send a 400 response
+                logger.error(str(e))
+                logger.debug('Data: {}'.format(data))
+                return make_response(str(e), 400)
+            except ColumnarInputError as e:
+                logger.error(str(e))
+                return make_response(str(e), 400, e.details)
+            except Exception as e:
+                return exception_log_and_respond(e, logger, 'Could not preprocess data', 400)
+
+            try:
+                prediction = server.predict_and_mirror(data, mirror)
+            except Exception as e:
+                # log exception and return the message in a 500 response
+                logger.debug('Data: {}'.format(data))
+                return exception_log_and_respond(e, logger, 'Unable to make prediction', 500)
+            logger.debug(prediction)
+            try:
+                return server.postprocess(prediction)
+            except Exception as e:
+                return exception_log_and_respond(e, logger, 'Postprocessing failed', 500)
+
+        def load_and_respond():
+            """Load data from the API request and respond with predictions or an error."""
+            try:
+                with span('load'):
+                    data = data_loader()
+            except RequestEntityTooLarge as e:
+                return exception_log_and_respond(e, logger, 'Request body too large', 413)
+            except Exception as e:
+                return exception_log_and_respond(e, logger, 'Unable to fetch data', 400)
+            return respond(data)
 
         # create restful resource
         class Predictions(Resource):
             @staticmethod
             def post():
-                # read data from API request
-                try:
-                    data = data_loader()
-                except Exception as e:
-                    return exception_log_and_respond(e, logger, 'Unable to fetch data', 400)
+                return _traced(tracer, 'POST /predictions', load_and_respond)
 
-                try:
-                    if hasattr(preprocessor, '__iter__'):
-                        for preprocessor_step in preprocessor:
-                            data = preprocessor_step(data)
-                    else:
-                        data = preprocessor(data)  # preprocess data
-                    data = np.array(data) if to_numpy else data  # convert to numpy
-                except Exception as e:
-                    return exception_log_and_respond(e, logger, 'Could not preprocess data', 400)
+        # map resource to endpoint
+        self.api.add_resource(Predictions, '/predictions')
+
+        # expose the pipeline to alternative front ends (e.g., the WSGI fast path), which
+        # must call it within an app context and may provide their own shadow `mirror`
+        self.respond = respond
+
+    def create_image_batch_endpoint(self, path='/predictions/images', **kwargs):
+        """Create an endpoint serving predictions for many images per request.
+
+        Images are sent as multipart form data or a length-prefixed binary body,
+        decoded in parallel into a single batch, and predicted with one `predict`
+        call (see `serveit.images`). The server's data loader and preprocessor are
+        not used; the batch is validated, monitored, traced, mirrored to the shadow
+        model and postprocessed like other predictions.
+
+        Arguments:
+            - path (str): endpoint path
+            - kwargs: passed to `ImageBatchPredictions` (e.g., `image_dims`)
+        """
+        from .images import ImageBatchPredictions, TooManyImages
+
+        images = ImageBatchPredictions(self, **kwargs)
+        server = self
+        tracer = self.tracer
+        span = tracer.span if tracer is not None else no_span
+        logger = self.app.logger
 
-                # sanity check using user defined callback (default is no check)
-                validation_pass, validation_reason = input_validation(data)
-                if not validation_pass:
-                    # if validation fails, log the reason code, log the data, and send a 400 response
-                    validation_message = 'Input validation failed with reason: {}'.format(validation_reason)
-                    logger.error(validation_message)
-                    logger.debug('Data: {}'.format(data))
-                    return make_response(validation_message, 400)
+        def respond():
+            """Decode the request's images and respond with their predictions or an error."""
+            # read and decode images as the request body streams in
+            try:
+                with span('decode'):
+                    names, batch, errors = images.decode(images.iter_images(
+                        request.stream, request.mimetype, request.mimetype_params.get('boundary')))
+            except TooManyImages as e:
+                return exception_log_and_respond(e, logger, 'Too many images', 413)
+            except RequestEntityTooLarge as e:
+                return exception_log_and_respond(e, logger, 'Request body too large', 413)
+            except Exception as e:
+                return exception_log_and_respond(e, logger, 'Unable to fetch data', 400)
+            if not names:
+                return make_response('Request contains no images', 400)
 
+            predictions = []
+            if len(batch):
                 try:
-                    prediction = predict(data)
+                    server.validate(batch)
+                except InputValidationError as e:
+                    logger.error(str(e))
+                    return make_response(str(e), 400)
+                try:
+                    prediction = server.predict_and_mirror(batch, mirror_after_response)
                 except Exception as e:
-                    # log exception and return the message in a 500 response
-                    logger.debug('Data: {}'.format(data))
                     return exception_log_and_respond(e, logger, 'Unable to make prediction', 500)
-                logger.debug(prediction)
                 try:
-                    # preprocess data
-                    if hasattr(postprocessor, '__iter__'):
-                        for postprocessor_step in postprocessor:
-                            prediction = postprocessor_step(prediction)
-                    else:
-                        prediction = postprocessor(prediction)
-
-                    # cast to serializable types
-                    if make_serializable_post:
-                        return make_serializable(prediction)
-                    else:
-                        return prediction
-
+                    predictions = server.postprocess(prediction)
+                    if len(predictions) != len(batch):
+                        raise ValueError('Expected {} predictions, got {}'.format(len(batch), len(predictions)))
                 except Exception as e:
                     return exception_log_and_respond(e, logger, 'Postprocessing failed', 500)
+            return images.results(names, errors, predictions)
 
-        # map resource to endpoint
-        self.api.add_resource(Predictions, '/predictions')
+        class ImageBatch(Resource):
+            @staticmethod
+            def post():
+                return _traced(tracer, 'POST ' + path, respond)
+
+        self.api.add_resource(ImageBatch, path)
+        logger.info('Model image batch predictions registered to endpoint {} (available via POST)'.format(path))
+        return images
+
+    def _span(self, name):
+        """Return a span of a pipeline stage; a no-op unless the current request is sampled."""
+        return self.tracer.span(name) if self.tracer is not None else NOOP_SPAN
+
+    def preprocess(self, data, columnar=None):
+        """Preprocess and validate loaded data, and observe it with the monitor.
+
+        This is the pipeline's first stage, shared by every prediction endpoint and
+        front end. Raises `ColumnarInputError` if columnar input doesn't match the
+        registered features, and `InputValidationError` if validation fails.
+
+        Arguments:
+            - data: loaded data
+            - columnar (bool): convert dicts of columns keyed by registered feature
+                names; defaults to whether the server uses the default JSON data loader
+        """
+        if columnar is None:
+            columnar = self.data_loader is json_numpy_loader
+        step_span = self.tracer.span if self.tracer is not None else None
+        with self._span('preprocess'):
+            if columnar and self.columnar is not None and isinstance(data, dict):
+                data = self.columnar(data)
+            data = apply_callbacks(self.preprocessor, data, step_span, 'preprocess')
+            data = np.asarray(data) if self.to_numpy else data  # convert to numpy without copying arrays
+        return self.validate(data)
+
+    def validate(self, data):
+        """Validate preprocessed data, and observe it with the monitor.
+
+        Raises `InputValidationError` if validation fails; returns the data otherwise.
+        """
+        # sanity check using user defined callback (default is no check)
+        with self._span('validate') as validate_span:
+            validation_pass, validation_reason = self.input_validation(data)
+            validate_span.set_attribute('passed', bool(validation_pass))
+        if not validation_pass:
+            raise InputValidationError(validation_reason)
+        if self.monitor is not None:
+            self.monitor.observe(data)
+        return data
+
+    def predict_and_mirror(self, data, mirror=None):
+        """Predict preprocessed data, and mirror it to the shadow model, if any.
+
+        Arguments:
+            - data: preprocessed data
+            - mirror (fn): takes the shadow model, data, prediction and latency and
+                submits them to the shadow model; by default they're submitted at once
+        """
+        with self._span('predict'):
+            if self.shadow is None:
+                return self.predict(data)
+            start = timer()
+            prediction = self.predict(data)
+            latency = timer() - start
+        if mirror is None:
+            self.shadow.submit(data, prediction, latency)
+        else:
+            mirror(self.shadow, data, prediction, latency)
+        return prediction
+
+    def postprocess(self, prediction):
+        """Postprocess predictions and cast them to serializable types."""
+        step_span = self.tracer.span if self.tracer is not None else None
+        with self._span('postprocess'):
+            return make_serializable(apply_callbacks(self.postprocessor, prediction, step_span, 'postprocess'))
+
+    def run_pipeline(self, data):
+        """Run loaded data through preprocessing, validation, prediction and postprocessing."""
+        return self.postprocess(self.predict_and_mirror(self.preprocess(data)))
 
     def create_info_endpoint(self, name, data):
-        """Create an endpoint to serve info GET requests."""
-        # make sure data is serializable
-        data = make_serializable(data)
+        """Create an endpoint to serve info GET requests.
 
-        # create generic restful resource to serve static JSON data
-        class InfoBase(Resource):
-            @staticmethod
-            def get():
-                return data
+        If `data` is callable it is called on each request, and its (serialized)
+        return value is served; otherwise `data` is served as static JSON.
+        Static `features` that are a list of unique names are also registered as
+        the feature names of columnar input (see `register_features`).
+        """
+        if name == 'features' and _is_feature_names(data):
+            self.register_features(data)
+        if callable(data):
+            get_data = data
+
+            # create generic restful resource to serve dynamic JSON data
+            class InfoBase(Resource):
+                @staticmethod
+                def get():
+                    return make_serializable(get_data())
+        else:
+            # make sure data is serializable
+            data = make_serializable(data)
+
+            # create generic restful resource to serve static JSON data
+            class InfoBase(Resource):
+                @staticmethod
+                def get():
+                    return data
 
         def info_factory(name):
             """Return an Info derivative resource."""
@@ -174,6 +423,18 @@ class ModelServer(object):
         logger.info('Regestered informational resource to {} (available via GET)'.format(path))
         logger.debug('Endpoint {} will now serve the following static data:\n{}'.format(path, data))
 
+    def register_features(self, feature_names):
+        """Accept columnar JSON input keyed by these feature names (see `serveit.columnar`).
+
+        Columnar input is only parsed by the default JSON data loader; objects
+        returned by custom data loaders are passed to the pipeline unchanged.
+
+        Arguments:
+            - feature_names (list): unique feature names, in the model's column order
+        """
+        from .columnar import ColumnarFormat
+        self.columnar = ColumnarFormat(feature_names)
+
     def _create_model_info_endpoint(self, path='/info/model'):
         """Create an endpoint to serve info GET requests."""
         model = self.model
@@ -193,13 +454,39 @@ class ModelServer(object):
         self.app.logger.info('Regestered informational resource to {} (available via GET)'.format(path))
         self.app.logger.debug('Endpoint {} will now serve the following static data:\n{}'.format(path, model_details))
 
-    def serve(self, host='127.0.0.1', port=5000):
-        """Serve predictions as an API endpoint."""
-        from meinheld import server, middleware
-        # self.app.run(host=host, port=port)
-        server.listen((host, port))
-        server.run(middleware.WebSocketMiddleware(self.app))
+    def serve(self, host=None, port=None, backend=None, **kwargs):
+        """Serve predictions as an API endpoint.
+
+        The server backend and its settings default to the `WSGI_*` environment
+        variables (see `serveit.config` and `serveit.backends`). Streaming
+        predictions are also served over WebSocket connections to
+        `/ws/predictions` with the meinheld backend (see `serveit.websocket`).
+
+        Arguments:
+            - host (str): interface to listen on
+            - port (int): port to listen on
+            - backend (str): server backend name, e.g. 'meinheld' or 'gunicorn'
+            - kwargs: backend settings (`workers`, `threads`, `keepalive`, `backlog`)
+        """
+        from .backends import serve
+        thread_budget = self.thread_budget
+
+        def on_worker_start(index):
+            # each worker process applies its own share of the thread budget
+            if thread_budget is not None:
+                thread_budget.apply(index)
+
+        serve(self.get_wsgi_app(), host=host, port=port, backend=backend, on_worker_start=on_worker_start, **kwargs)
 
     def get_app(self):
         """Return the underlying Flask app."""
         return self.app
+
+    def get_wsgi_app(self):
+        """Return the WSGI app to serve: the Flask app, behind the fast path if enabled and streaming predictions."""
+        from .websocket import StreamingPredictions
+        app = self.app
+        if self.fast_path:
+            from .fastpath import FastPredictions
+            app = FastPredictions(self, app)
+        return StreamingPredictions(self, app=app)
@@ -0,0 +1,153 @@
+"""Mirror live traffic to a candidate (shadow) model."""
+from collections import deque
+from queue import Queue, Full
+from threading import Lock, Thread
+from timeit import default_timer as timer
+import os
+
+import numpy as np
+
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+def default_agreement(primary, shadow):
+    """Return the fraction of rows on which two sets of predictions agree.
+
+    Floating point predictions are compared with `np.isclose`; all other types
+    must match exactly.
+    """
+    primary, shadow = np.asarray(primary), np.asarray(shadow)
+    if primary.shape != shadow.shape:
+        return 0.
+    if primary.size == 0:
+        return 1.
+    if np.issubdtype(primary.dtype, np.number) and np.issubdtype(shadow.dtype, np.number):
+        matches = np.isclose(primary, shadow)
+    else:
+        matches = primary == shadow
+    if matches.ndim > 1:
+        matches = matches.reshape(matches.shape[0], -1).all(axis=1)
+    return float(np.mean(matches))
+
+
+def _percentiles(values):
+    """Summarize a window of latencies in milliseconds."""
+    if not values:
+        return dict(p50=None, p99=None, mean=None)
+    values = np.array(values) * 1e3
+    p50, p99 = np.percentile(values, [50, 99])
+    return dict(p50=float(p50), p99=float(p99), mean=float(values.mean()))
+
+
+class ShadowModel(object):
+    """Candidate model that receives a copy of live prediction traffic.
+
+    Preprocessed inputs are mirrored to the shadow model on a bounded queue that
+    is drained by background threads; when the queue is full the input is dropped
+    rather than applying back pressure to the primary model.
+    """
+
+    def __init__(
+            self,
+            model,
+            predict,
+            max_workers=1,
+            max_queue_size=100,
+            agreement=default_agreement,
+            window_size=1000):
+        """Initialize shadow model.
+
+        Arguments:
+            - model: candidate model object
+            - predict (fn): candidate prediction function; called with the same
+                preprocessed input as the primary `predict` function
+            - max_workers (int): number of background threads running the shadow model
+            - max_queue_size (int): number of pending inputs beyond which mirrored
+                requests are dropped
+            - agreement (fn): takes primary and shadow predictions and returns the
+                fraction (0 to 1) on which they agree
+            - window_size (int): number of recent requests summarized by latency
+                and agreement statistics
+        """
+        self.model = model
+        self.predict = predict
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.agreement = agreement
+        self._lock = Lock()
+        self._primary_latencies = deque(maxlen=window_size)
+        self._shadow_latencies = deque(maxlen=window_size)
+        self._agreements = deque(maxlen=window_size)
+        self._counts = dict(mirrored=0, dropped=0, completed=0, failed=0)
+        self._pid = None
+
+    def __repr__(self):
+        """String representation."""
+        return '<ShadowModel: {}>'.format(type(self.predict).__name__)
+
+    def _start(self):
+        """Start background workers; called again if the process has been forked."""
+        self._pid = os.getpid()
+        self._queue = Queue(maxsize=self.max_queue_size)
+        for i in range(self.max_workers):
+            worker = Thread(target=self._work, name='serveit-shadow-{}'.format(i))
+            worker.daemon = True
+            worker.start()
+
+    def submit(self, data, prediction, latency=None):
+        """Queue an input and its primary prediction for shadow evaluation.
+
+        Returns False if the input was dropped because the queue is full.
+        """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._start()
+        try:
+            self._queue.put_nowait((data, prediction, latency))
+        except Full:
+            with self._lock:
+                self._counts['dropped'] += 1
+            return False
+        with self._lock:
+            self._counts['mirrored'] += 1
+        return True
+
+    def _work(self):
+        """Run shadow predictions from the queue until the process exits."""
+        queue = self._queue
+        while True:
+            data, prediction, latency = queue.get()
+            start = timer()
+            try:
+                shadow_prediction = self.predict(data)
+                shadow_latency = timer() - start
+                agreement = self.agreement(prediction, shadow_prediction)
+            except Exception:
+                logger.warning('Shadow prediction failed', exc_info=True)
+                with self._lock:
+                    self._counts['failed'] += 1
+                continue
+            with self._lock:
+                self._counts['completed'] += 1
+                self._shadow_latencies.append(shadow_latency)
+                if latency is not None:
+                    self._primary_latencies.append(latency)
+                self._agreements.append(agreement)
+
+    def stats(self):
+        """Return request counts, latency and agreement statistics."""
+        with self._lock:
+            counts = dict(self._counts)
+            primary_latencies = list(self._primary_latencies)
+            shadow_latencies = list(self._shadow_latencies)
+            agreements = list(self._agreements)
+        return dict(
+            counts=counts,
+            queue_size=self._queue.qsize() if self._pid == os.getpid() else 0,
+            primary_latency_ms=_percentiles(primary_latencies),
+            shadow_latency_ms=_percentiles(shadow_latencies),
+            agreement=float(np.mean(agreements)) if agreements else None,
+        )
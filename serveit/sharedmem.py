@@ -0,0 +1,275 @@
+"""Inference in dedicated processes, fed through a shared-memory ring buffer.
+
+HTTP parsing, JSON decoding and `predict` compete for one GIL when they run in
+the same process. A `SharedMemoryPredictor` moves `predict` to a few dedicated
+inference processes, so any number of request handling (I/O) processes can
+share them. Each request borrows a slot of a shared-memory ring buffer: the
+I/O process copies its input array into the slot, an inference process runs
+`predict` on a zero-copy view of the slot, and writes the predictions back
+into the same slot.
+
+The predictor is passed to `ModelServer` in place of a predict function, and
+must be started before the I/O processes are forked (e.g., with gunicorn's
+`--preload`), so that they share its buffer and inference processes:
+
+    predictor = SharedMemoryPredictor(lambda: load_model('model/').predict, workers=2)
+    server = ModelServer(model, predictor.start())
+
+The model is only loaded by `predict_factory`, in each inference process.
+
+A slot abandoned by a caller that timed out is returned to the free list when
+its late predictions arrive, and callers waiting on an inference process that
+exited (e.g., killed by the OOM killer) get an `InferenceError` instead of
+waiting forever.
+"""
+from multiprocessing.connection import wait
+from queue import Empty
+from threading import Lock
+from timeit import default_timer as timer
+import atexit
+import multiprocessing
+import os
+import pickle
+import struct
+
+import numpy as np
+
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+HEADER_SIZE = 4096  # bytes reserved at the start of each slot for the response header
+HEADER_LENGTH = struct.Struct('>I')
+LIVENESS_INTERVAL = .5  # seconds between checks that inference processes are alive while waiting
+UNASSIGNED = -1
+
+
+class InferenceError(RuntimeError):
+    """Raised when `predict` fails in an inference process."""
+
+
+def _array_view(buffer, offset, dtype, shape):
+    """Return an array viewing shared memory."""
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=buffer, offset=offset)
+
+
+def _write_payload(buffer, offset, capacity, value):
+    """Write an array (or a pickled object) into a slot; return its description."""
+    array = np.asarray(value) if not isinstance(value, np.ndarray) else value
+    if array.dtype.hasobject:
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > capacity:
+            raise ValueError('Data of {:,} bytes exceeds the slot size of {:,} bytes'.format(len(data), capacity))
+        buffer[offset:offset + len(data)] = data
+        return ('pickle', len(data))
+    if array.nbytes > capacity:
+        raise ValueError('Array of {:,} bytes exceeds the slot size of {:,} bytes'.format(array.nbytes, capacity))
+    np.copyto(_array_view(buffer, offset, array.dtype, array.shape), array)
+    return ('array', array.dtype.str, array.shape)
+
+
+def _read_payload(buffer, offset, description, copy):
+    """Read an array (or a pickled object) described by `_write_payload` from a slot."""
+    if description[0] == 'pickle':
+        return pickle.loads(bytes(buffer[offset:offset + description[1]]))
+    array = _array_view(buffer, offset, description[1], description[2])
+    return array.copy() if copy else array
+
+
+def _write_header(buffer, offset, response):
+    """Write a response header into a slot, truncating error messages to fit the header."""
+    header = pickle.dumps(response, protocol=pickle.HIGHEST_PROTOCOL)
+    limit = HEADER_SIZE - HEADER_LENGTH.size
+    if len(header) > limit and response[0] == 'error':
+        status, exception_type, message = response
+        overflow = len(header) - limit + len(' [truncated]')
+        message = message.encode('utf-8')[:max(len(message.encode('utf-8')) - overflow, 0)]
+        response = (status, exception_type[:256], message.decode('utf-8', 'ignore') + ' [truncated]')
+        header = pickle.dumps(response, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(header) > limit:
+        raise ValueError('Response header of {:,} bytes exceeds {:,} bytes'.format(len(header), limit))
+    buffer[offset:offset + HEADER_LENGTH.size + len(header)] = HEADER_LENGTH.pack(len(header)) + header
+
+
+def _work(predict_factory, index, name, slot_size, requests, ready, free, slot_lock, assigned, abandoned):
+    """Run predictions for requests written into shared memory slots."""
+    from multiprocessing import shared_memory
+
+    memory = shared_memory.SharedMemory(name=name)
+    buffer = memory.buf
+    predict = predict_factory()
+    capacity = slot_size - HEADER_SIZE
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        slot, description = request
+        assigned[slot] = index
+        offset = slot * slot_size
+        try:
+            data = _read_payload(buffer, offset + HEADER_SIZE, description, copy=False)
+            prediction = predict(data)
+            del data  # release the view of the slot
+            response = ('ok', _write_payload(buffer, offset + HEADER_SIZE, capacity, prediction))
+        except Exception as e:
+            logger.error('Unable to make prediction', exc_info=True)
+            response = ('error', type(e).__name__, str(e))
+        try:
+            _write_header(buffer, offset, response)
+        except Exception as e:
+            logger.error('Unable to write response', exc_info=True)
+            _write_header(buffer, offset, ('error', type(e).__name__, str(e)))
+        with slot_lock:
+            if abandoned[slot]:
+                # the caller timed out, so nobody reads the response; reclaim the slot
+                abandoned[slot] = 0
+                free.put(slot)
+            else:
+                ready[slot].release()
+    del buffer
+    memory.close()
+
+
+class SharedMemoryPredictor(object):
+    """Prediction function that runs `predict` in dedicated inference processes."""
+
+    def __init__(self, predict_factory, workers=1, slots=None, slot_size=4 * 1024 * 1024, timeout=None,
+                 start_method=None):
+        """Initialize shared memory predictor.
+
+        Arguments:
+            - predict_factory (fn): takes no arguments and returns a predict function;
+                called once in each inference process
+            - workers (int): number of inference processes
+            - slots (int): number of ring buffer slots, i.e., concurrent requests;
+                defaults to four per CPU
+            - slot_size (int): bytes per slot; inputs and predictions (and pickled
+                non-numeric predictions) must fit in a slot, less a 4 KB header
+            - timeout (float): seconds to wait for a free slot and for predictions
+                before raising `InferenceError`; waits indefinitely by default, unless
+                the inference process running the prediction exits
+            - start_method (str): multiprocessing start method for inference processes;
+                `predict_factory` must be picklable unless it is 'fork'
+        """
+        if slot_size <= HEADER_SIZE:
+            raise ValueError('Slots must be larger than the {} byte header'.format(HEADER_SIZE))
+        self.predict_factory = predict_factory
+        self.workers = workers
+        self.slots = slots or 4 * multiprocessing.cpu_count()
+        self.slot_size = slot_size
+        self.timeout = timeout
+        self.start_method = start_method
+        self._lock = Lock()
+        self._owner = None
+        self._memory = None
+
+    def __repr__(self):
+        """String representation."""
+        return '<SharedMemoryPredictor: {} workers, {} slots>'.format(self.workers, self.slots)
+
+    def start(self):
+        """Allocate the ring buffer and start inference processes; returns the predictor.
+
+        Call before forking I/O processes, which then share them.
+        """
+        from multiprocessing import shared_memory
+
+        with self._lock:
+            if self._memory is not None:
+                return self
+            context = multiprocessing.get_context(self.start_method)
+            self._memory = shared_memory.SharedMemory(create=True, size=self.slots * self.slot_size)
+            self._free = context.Queue()
+            for slot in range(self.slots):
+                self._free.put(slot)
+            self._requests = context.Queue()
+            self._ready = [context.Semaphore(0) for _ in range(self.slots)]
+            self._slot_lock = context.Lock()
+            self._assigned = context.Array('i', [UNASSIGNED] * self.slots, lock=False)  # slot -> worker
+            self._abandoned = context.Array('b', self.slots, lock=False)
+            self._processes = []
+            for i in range(self.workers):
+                process = context.Process(
+                    target=_work,
+                    args=(self.predict_factory, i, self._memory.name, self.slot_size, self._requests, self._ready,
+                          self._free, self._slot_lock, self._assigned, self._abandoned),
+                    name='serveit-inference-{}'.format(i),
+                )
+                process.daemon = True
+                process.start()
+                self._processes.append(process)
+            self._owner = os.getpid()
+            atexit.register(self.shutdown)
+        logger.info('Started {} inference processes with {} shared memory slots of {:,} bytes'.format(
+            self.workers, self.slots, self.slot_size))
+        return self
+
+    def __call__(self, data):
+        """Predict in an inference process, and wait for the predictions."""
+        if self._memory is None:
+            self.start()
+        try:
+            slot = self._free.get(timeout=self.timeout)
+        except Empty:
+            raise InferenceError('No free shared memory slot within {} seconds'.format(self.timeout))
+        buffer = self._memory.buf
+        offset = slot * self.slot_size
+        try:
+            description = _write_payload(buffer, offset + HEADER_SIZE, self.slot_size - HEADER_SIZE, data)
+        except Exception:
+            self._free.put(slot)
+            raise
+        self._assigned[slot] = UNASSIGNED
+        self._requests.put((slot, description))
+        self._wait(slot)
+        try:
+            (header_length,) = HEADER_LENGTH.unpack_from(buffer, offset)
+            start = offset + HEADER_LENGTH.size
+            response = pickle.loads(bytes(buffer[start:start + header_length]))
+            if response[0] == 'error':
+                raise InferenceError('{}: {}'.format(*response[1:]))
+            return _read_payload(buffer, offset + HEADER_SIZE, response[1], copy=True)
+        finally:
+            self._free.put(slot)
+
+    def _exited(self, slot):
+        """Return whether the inference process running a slot's request (or every one, if queued) exited."""
+        worker = self._assigned[slot]
+        processes = self._processes if worker == UNASSIGNED else [self._processes[worker]]
+        return len(wait([process.sentinel for process in processes], timeout=0)) == len(processes)
+
+    def _wait(self, slot):
+        """Wait for a slot's predictions; abandon the slot and raise `InferenceError` if they don't arrive."""
+        deadline = timer() + self.timeout if self.timeout is not None else None
+        while True:
+            interval = LIVENESS_INTERVAL if deadline is None else min(LIVENESS_INTERVAL, deadline - timer())
+            if self._ready[slot].acquire(timeout=max(interval, 0)):
+                return
+            if self._exited(slot):
+                message = 'Inference process exited before returning predictions'
+            elif deadline is not None and timer() >= deadline:
+                message = 'No predictions within {} seconds'.format(self.timeout)
+            else:
+                continue
+            with self._slot_lock:
+                if self._ready[slot].acquire(False):  # the predictions arrived after all
+                    return
+                # the slot may still be written to, so it's reclaimed when its predictions arrive
+                self._abandoned[slot] = 1
+            logger.error('Abandoning shared memory slot {}: {}'.format(slot, message))
+            raise InferenceError(message)
+
+    def shutdown(self):
+        """Stop inference processes and free the shared memory; only in the process that started them."""
+        with self._lock:
+            if self._memory is None or self._owner != os.getpid():
+                return
+            for _ in self._processes:
+                self._requests.put(None)
+            for process in self._processes:
+                process.join(5)
+                if process.is_alive():
+                    process.terminate()
+            self._memory.close()
+            self._memory.unlink()
+            self._memory = None
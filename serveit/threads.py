@@ -0,0 +1,131 @@
+"""Divide CPU cores between workers to prevent thread oversubscription."""
+import multiprocessing
+import os
+import sys
+
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+# environment variables read by BLAS, OpenMP and framework thread pools at load time
+THREAD_ENV_VARS = (
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+    'TF_NUM_INTRAOP_THREADS',
+)
+
+
+def available_cpus():
+    """Return the IDs of the CPUs this process may run on."""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:  # not supported on this platform
+        return list(range(multiprocessing.cpu_count()))
+
+
+class ThreadBudget(object):
+    """Budget of compute threads for one of several workers sharing a host.
+
+    The available CPUs are divided evenly between `workers` server processes,
+    and each worker's share is divided between its `executors` (e.g., replicas of
+    a `ReplicaPool` or concurrent batches), which each get one intra-op thread per
+    CPU. Limits are applied to OpenBLAS/MKL/OpenMP, TensorFlow and PyTorch.
+    """
+
+    def __init__(self, workers=1, executors=1, cpus=None, pin=False, worker_index=None):
+        """Initialize thread budget.
+
+        Arguments:
+            - workers (int): number of server worker processes sharing the CPUs
+            - executors (int): number of concurrent prediction executors per worker
+            - cpus (list): IDs of the CPUs to divide; defaults to all available CPUs
+            - pin (bool): pin each worker to its own set of CPUs
+            - worker_index (int): index of this worker, from 0 to `workers` - 1;
+                read from the `SERVEIT_WORKER_INDEX` environment variable by default
+        """
+        self.workers = workers
+        self.executors = executors
+        self.cpus = list(cpus) if cpus is not None else available_cpus()
+        self.pin = pin
+        self.worker_index = worker_index
+        self.settings = {}
+
+    def __repr__(self):
+        """String representation."""
+        return '<ThreadBudget: {} CPUs, {} workers x {} executors>'.format(
+            len(self.cpus), self.workers, self.executors)
+
+    @property
+    def threads_per_executor(self):
+        """Number of compute threads for each executor."""
+        return max(1, len(self.cpus) // (self.workers * self.executors))
+
+    def worker_cpus(self, worker_index):
+        """Return the CPU set for a worker, wrapping around if there are more workers than CPUs."""
+        cpus_per_worker = max(1, len(self.cpus) // self.workers)
+        start = (worker_index * cpus_per_worker) % len(self.cpus)
+        return self.cpus[start:start + cpus_per_worker]
+
+    def apply(self, worker_index=None):
+        """Apply thread limits (and CPU pinning) to the current process.
+
+        Environment variables limit libraries that are loaded later; libraries
+        that are already loaded are limited through threadpoolctl (if installed),
+        PyTorch and TensorFlow APIs. Returns the effective settings.
+        """
+        if worker_index is None:
+            worker_index = self.worker_index
+        if worker_index is None:
+            worker_index = int(os.environ.get('SERVEIT_WORKER_INDEX', 0))
+        threads = self.threads_per_executor
+        settings = dict(
+            cpus_available=len(self.cpus),
+            workers=self.workers,
+            executors=self.executors,
+            worker_index=worker_index,
+            threads_per_executor=threads,
+        )
+
+        for name in THREAD_ENV_VARS:
+            os.environ[name] = str(threads)
+        settings['environment'] = {name: os.environ[name] for name in THREAD_ENV_VARS}
+
+        if self.pin and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, self.worker_cpus(worker_index))
+        settings['cpu_affinity'] = available_cpus()
+
+        try:
+            from threadpoolctl import threadpool_info, threadpool_limits
+            threadpool_limits(limits=threads)
+            settings['threadpools'] = [
+                dict(library=pool['internal_api'], num_threads=pool['num_threads'])
+                for pool in threadpool_info()
+            ]
+        except ImportError:
+            logger.debug('threadpoolctl not installed; relying on environment variables')
+
+        if 'torch' in sys.modules:
+            import torch
+            torch.set_num_threads(threads)
+            settings['torch_num_threads'] = torch.get_num_threads()
+
+        if 'tensorflow' in sys.modules:
+            import tensorflow as tf
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(threads)
+                tf.config.threading.set_inter_op_parallelism_threads(self.executors)
+            except (AttributeError, RuntimeError) as e:
+                # TensorFlow 1.x, or runtime already initialized: configure sessions instead
+                logger.warning('Unable to limit TensorFlow threads ({}); pass a ConfigProto with '
+                               'intra_op_parallelism_threads={} to new sessions'.format(e, threads))
+            else:
+                settings['tensorflow_intra_op_threads'] = tf.config.threading.get_intra_op_parallelism_threads()
+                settings['tensorflow_inter_op_threads'] = tf.config.threading.get_inter_op_parallelism_threads()
+
+        self.settings = settings
+        logger.info('Applied thread budget: {} threads per executor on CPUs {}'.format(
+            threads, settings['cpu_affinity']))
+        return settings
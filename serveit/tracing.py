@@ -0,0 +1,369 @@
+"""Lightweight span tracing of prediction requests, with W3C trace context propagation.
+
+A `Tracer` passed to `ModelServer` records a span for each sampled request to
+`/predictions`, with child spans for each stage (loading, preprocessing,
+validation, prediction and postprocessing) and for each step of chained
+preprocessor and postprocessor callbacks:
+
+    tracer = Tracer(FileExporter('spans.jsonl'), sample_rate=.01)
+    server = ModelServer(clf, clf.predict, tracer=tracer)
+
+Incoming `traceparent` headers (https://www.w3.org/TR/trace-context/) make the
+request span a child of the caller's span (e.g., a gateway), and their sampled
+flag decides whether the request is traced; other requests are sampled at
+`sample_rate`. Code running in a request (e.g., a data loader fetching from a
+downstream service) propagates the trace with `current_traceparent()`:
+
+    requests.get(url, headers={'traceparent': current_traceparent()})
+
+Finished spans are buffered in memory and exported in batches by a background
+thread, to a JSON lines file (`FileExporter`), to a local collector over HTTP
+(`CollectorExporter`), or to any callable taking a list of span dicts. When a
+request isn't sampled, stages share a no-op span and nothing is recorded.
+"""
+from collections import deque
+from random import getrandbits, random
+from threading import Condition, Lock, Thread, local
+from timeit import default_timer as timer
+import atexit
+import json
+import os
+import re
+import time
+
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+TRACEPARENT = re.compile(r'^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+SAMPLED = 0x01
+
+# the span in progress in each thread (and an unsampled incoming traceparent to propagate)
+_local = local()
+
+
+def parse_traceparent(header):
+    """Parse a `traceparent` header into (trace id, parent span id, flags); None if invalid."""
+    match = TRACEPARENT.match(header.strip().lower()) if header else None
+    if match is None:
+        return None
+    version, trace_id, parent_id, flags = match.groups()
+    if version == 'ff' or trace_id == '0' * 32 or parent_id == '0' * 16:
+        return None
+    return trace_id, parent_id, int(flags, 16)
+
+
+def format_traceparent(trace_id, span_id, sampled=True):
+    """Format a version 00 `traceparent` header."""
+    return '00-{}-{}-{:02x}'.format(trace_id, span_id, SAMPLED if sampled else 0)
+
+
+def current_span():
+    """Return the span in progress in this thread, if the request is sampled."""
+    return getattr(_local, 'span', None)
+
+
+def current_traceparent():
+    """Return the `traceparent` header to send to downstream services from this thread, if any."""
+    span = getattr(_local, 'span', None)
+    if span is not None:
+        return span.traceparent
+    return getattr(_local, 'traceparent', None)
+
+
+class _NoopSpan(object):
+    """Span of an unsampled request; records nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set_attribute(self, key, value):
+        """Ignore attribute."""
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def no_span(name, **attributes):
+    """Return the no-op span; stands in for `Tracer.span` when tracing is disabled."""
+    return NOOP_SPAN
+
+
+class _UnsampledTrace(object):
+    """Context of an unsampled request whose `traceparent` is still propagated downstream."""
+
+    __slots__ = ('traceparent', '_previous')
+
+    def __init__(self, traceparent):
+        self.traceparent = traceparent
+
+    def __enter__(self):
+        self._previous = getattr(_local, 'traceparent', None)
+        _local.traceparent = self.traceparent
+        return NOOP_SPAN
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.traceparent = self._previous
+        return False
+
+
+class Span(object):
+    """Timed operation in a trace; a context manager that makes itself the current span."""
+
+    __slots__ = ('tracer', 'name', 'trace_id', 'span_id', 'parent_id', 'attributes', 'status',
+                 'start_time', '_start', 'duration', '_previous')
+
+    def __init__(self, tracer, name, trace_id, parent_id=None, attributes=None):
+        """Initialize span.
+
+        Arguments:
+            - tracer (Tracer): tracer that exports the span when it ends
+            - name (str): operation name
+            - trace_id (str): 32 hex digit trace id
+            - parent_id (str): 16 hex digit id of the parent span, if any
+            - attributes (dict): span attributes
+        """
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = '{:016x}'.format(getrandbits(64) or 1)
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.status = 'ok'
+        self.start_time = None
+        self.duration = None
+
+    def __repr__(self):
+        """String representation."""
+        return '<Span: {} {}>'.format(self.name, self.span_id)
+
+    @property
+    def traceparent(self):
+        """`traceparent` header making this span the parent of downstream spans."""
+        return format_traceparent(self.trace_id, self.span_id)
+
+    def set_attribute(self, key, value):
+        """Set a span attribute."""
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self._previous = getattr(_local, 'span', None)
+        _local.span = self
+        self.start_time = time.time()
+        self._start = timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = timer() - self._start
+        if exc_type is not None:
+            self.status = 'error'
+            self.attributes['exception_type'] = exc_type.__name__
+            self.attributes['exception_message'] = str(exc_value)
+        _local.span = self._previous
+        self.tracer._finish(self)
+        return False
+
+    def to_dict(self):
+        """Return a serializable description of the span."""
+        return dict(
+            trace_id=self.trace_id,
+            span_id=self.span_id,
+            parent_id=self.parent_id,
+            name=self.name,
+            service=self.tracer.service_name,
+            start_time=self.start_time,
+            duration_ms=self.duration * 1e3,
+            status=self.status,
+            attributes=self.attributes,
+        )
+
+
+class FileExporter(object):
+    """Span exporter appending spans to a JSON lines file."""
+
+    def __init__(self, path):
+        """Initialize exporter to write to `path`."""
+        self.path = path
+        self._lock = Lock()
+
+    def __repr__(self):
+        """String representation."""
+        return '<FileExporter: {}>'.format(self.path)
+
+    def __call__(self, spans):
+        """Append spans, one JSON object per line."""
+        lines = ''.join(json.dumps(span, default=str) + '\n' for span in spans)
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(lines)
+
+
+class CollectorExporter(object):
+    """Span exporter posting batches of spans as JSON to a local collector."""
+
+    def __init__(self, host='127.0.0.1', port=4318, path='/spans', timeout=5.):
+        """Initialize exporter.
+
+        Arguments:
+            - host (str): collector host
+            - port (int): collector port
+            - path (str): path that batches are posted to, as `{"spans": [...]}`
+            - timeout (float): seconds to wait for the collector
+        """
+        self.host = host
+        self.port = port
+        self.path = path
+        self.timeout = timeout
+
+    def __repr__(self):
+        """String representation."""
+        return '<CollectorExporter: {}:{}{}>'.format(self.host, self.port, self.path)
+
+    def __call__(self, spans):
+        """Post spans to the collector; raises IOError on failure."""
+        from http.client import HTTPConnection
+        connection = HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            body = json.dumps(dict(spans=spans), default=str)
+            connection.request('POST', self.path, body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 300:
+                raise IOError('Collector responded with status {}'.format(response.status))
+        finally:
+            connection.close()
+
+
+class Tracer(object):
+    """Records spans of sampled requests, and exports them in batches from a background thread."""
+
+    def __init__(
+            self,
+            exporter=None,
+            sample_rate=1.,
+            max_spans=10000,
+            batch_size=512,
+            flush_interval=1.,
+            service_name='serveit'):
+        """Initialize tracer.
+
+        Arguments:
+            - exporter (fn): takes a list of span dicts; e.g., a `FileExporter` or
+                `CollectorExporter`. Spans are only buffered if None (see `flush`)
+            - sample_rate (float): fraction of requests without a sampling decision
+                (a `traceparent` header) that are traced
+            - max_spans (int): number of buffered spans beyond which the oldest are dropped
+            - batch_size (int): number of buffered spans that triggers an export
+            - flush_interval (float): maximum seconds between exports
+            - service_name (str): service name recorded with each span
+        """
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.max_spans = max_spans
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.service_name = service_name
+        self._condition = Condition(Lock())
+        self._export_lock = Lock()
+        self._spans = deque()
+        self._pid = None
+        self._counts = dict(traces=0, spans=0, exported=0, dropped=0, export_errors=0)
+        if exporter is not None:
+            atexit.register(self.flush)
+
+    def __repr__(self):
+        """String representation."""
+        return '<Tracer: {!r}, sample rate {}>'.format(self.exporter, self.sample_rate)
+
+    def trace(self, name, traceparent=None, **attributes):
+        """Return a span for a request, continuing the caller's trace from its `traceparent` header.
+
+        Within a span in progress (e.g., a request handled by a nested app), returns a
+        child span. Returns a no-op span if the request isn't sampled.
+        """
+        current = getattr(_local, 'span', None)
+        if current is not None:
+            return Span(self, name, current.trace_id, current.span_id, attributes)
+        parent = parse_traceparent(traceparent) if traceparent else None
+        if parent is not None:
+            if not parent[2] & SAMPLED:
+                return _UnsampledTrace(traceparent)
+            trace_id, parent_id = parent[0], parent[1]
+        elif self.sample_rate > 0 and random() < self.sample_rate:
+            trace_id, parent_id = '{:032x}'.format(getrandbits(128) or 1), None
+        else:
+            return NOOP_SPAN
+        with self._condition:
+            self._counts['traces'] += 1
+        return Span(self, name, trace_id, parent_id, attributes)
+
+    def span(self, name, **attributes):
+        """Return a child of the current span, or a no-op span if the request isn't sampled."""
+        current = getattr(_local, 'span', None)
+        if current is None:
+            return NOOP_SPAN
+        return Span(self, name, current.trace_id, current.span_id, attributes)
+
+    def _start(self):
+        """Start the export thread; called again if the process has been forked."""
+        self._pid = os.getpid()
+        self._spans.clear()
+        worker = Thread(target=self._work, name='serveit-tracer')
+        worker.daemon = True
+        worker.start()
+
+    def _finish(self, span):
+        """Buffer a finished span for export."""
+        with self._condition:
+            if self.exporter is not None and self._pid != os.getpid():
+                self._start()
+            if len(self._spans) >= self.max_spans:
+                self._spans.popleft()
+                self._counts['dropped'] += 1
+            self._spans.append(span)
+            self._counts['spans'] += 1
+            if len(self._spans) >= self.batch_size:
+                self._condition.notify()
+
+    def _work(self):
+        """Export buffered spans every `flush_interval` seconds, or as soon as a batch is full."""
+        while True:
+            with self._condition:
+                if len(self._spans) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+            self.flush()
+
+    def drain(self):
+        """Remove and return buffered spans as dicts."""
+        with self._condition:
+            spans, self._spans = self._spans, deque()
+        return [span.to_dict() for span in spans]
+
+    def flush(self):
+        """Export buffered spans now; without an exporter, spans stay buffered for `drain`."""
+        if self.exporter is None:
+            return
+        with self._export_lock:
+            spans = self.drain()
+            if not spans:
+                return
+            try:
+                self.exporter(spans)
+            except Exception:
+                logger.warning('Unable to export {} spans'.format(len(spans)), exc_info=True)
+                with self._condition:
+                    self._counts['export_errors'] += 1
+                    self._counts['dropped'] += len(spans)
+                return
+            with self._condition:
+                self._counts['exported'] += len(spans)
+
+    def stats(self):
+        """Return counts of traces and spans recorded, exported and dropped."""
+        with self._condition:
+            return dict(sample_rate=self.sample_rate, buffered=len(self._spans), **self._counts)
@@ -50,21 +50,36 @@ def json_numpy_loader():
     return data
 
 
-def get_bytes_to_image_callback(image_dims=(224, 224)):
-    """Return a callback to process image bytes for ImageNet."""
-    from keras.preprocessing import image
-    import numpy as np
+def load_image(data_bytes, image_dims=(224, 224)):
+    """Decode image bytes to a PIL image resized to `image_dims` (width, height).
+
+    Shared by `get_bytes_to_image_callback` and image batch predictions
+    (`serveit.images`), so an image is decoded the same way by both.
+    """
     from PIL import Image
     from io import BytesIO
 
+    try:
+        img = Image.open(BytesIO(data_bytes))  # open image
+    except OSError:
+        raise ValueError('Please provide a raw image')
+    return img.resize(image_dims, Image.LANCZOS)  # model requires 224x224 pixels
+
+
+def get_bytes_to_image_callback(image_dims=(224, 224)):
+    """Return a callback to process image bytes for ImageNet.
+
+    Only needs Pillow and NumPy, so it can be used with any framework (it no
+    longer imports Keras to convert images to arrays).
+    """
+    import numpy as np
+
     def preprocess_image_bytes(data_bytes):
         """Process image bytes for ImageNet."""
-        try:
-            img = Image.open(BytesIO(data_bytes))  # open image
-        except OSError as e:
-            raise ValueError('Please provide a raw image')
-        img = img.resize(image_dims, Image.ANTIALIAS)  # model requires 224x224 pixels
-        x = image.img_to_array(img)  # convert image to numpy array
+        img = load_image(data_bytes, image_dims)
+        x = np.asarray(img, dtype=np.float32)  # convert image to numpy array, as keras' `img_to_array`
+        if x.ndim == 2:
+            x = x[:, :, np.newaxis]  # grayscale images get a channel axis
         x = np.expand_dims(x, axis=0)  # model expects dim 0 to be iterable across images
         return x
     return preprocess_image_bytes
@@ -0,0 +1,322 @@
+"""Streaming predictions over persistent WebSocket connections.
+
+Clients keep a connection open and send many prediction messages, each with
+an `id` that is echoed in its response. Messages are either JSON text frames,
+`{"id": ..., "data": [...]}`, or binary tensor frames made of a 4 byte
+big-endian header length, a JSON header `{"id": ..., "dtype": ..., "shape": [...]}`
+and the array's raw C-ordered bytes (see `encode_tensor_message`).
+
+Each message's data takes the place of the server's data loader output and
+goes through the same pipeline as `/predictions` requests (preprocessing,
+validation, monitoring, shadow mirroring and postprocessing). Messages arriving close
+together are batched into a single `predict` call when their arrays are
+compatible, and batches are predicted concurrently in a thread pool, so
+responses are sent as each batch completes and may arrive out of order.
+Responses are JSON objects with the message `id`, a `status` code, and either
+a `prediction` or the same `message` and `details` as an HTTP error response.
+
+The connection is only ever read and written from the context that handles
+it (with meinheld, the connection's greenlet and a sender greenlet spawned
+next to it): prediction threads hand responses back through a pipe.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from queue import Queue, Empty
+from threading import Lock, Thread
+from timeit import default_timer as timer
+import json
+import multiprocessing
+import os
+import select
+import struct
+
+import numpy as np
+
+from .columnar import ColumnarInputError
+from .server import InputValidationError
+from .log_utils import get_logger
+
+logger = get_logger(__name__)
+
+HEADER_LENGTH = struct.Struct('>I')
+
+
+def encode_tensor_message(message_id, array):
+    """Encode a numpy array as a binary tensor message."""
+    array = np.ascontiguousarray(array)
+    header = json.dumps(dict(id=message_id, dtype=array.dtype.str, shape=array.shape)).encode('utf-8')
+    return HEADER_LENGTH.pack(len(header)) + header + array.tobytes()
+
+
+def decode_message(message):
+    """Decode a JSON text or binary tensor message into its id and data."""
+    if isinstance(message, bytes):
+        (header_length,) = HEADER_LENGTH.unpack_from(message)
+        offset = HEADER_LENGTH.size + header_length
+        header = json.loads(message[HEADER_LENGTH.size:offset].decode('utf-8'))
+        data = np.frombuffer(message, dtype=np.dtype(header['dtype']), offset=offset).reshape(header['shape'])
+        return header.get('id'), data
+    body = json.loads(message)
+    return body.get('id'), body['data']
+
+
+def _error(message_id, message, status_code, exception=None):
+    """Make an error response body, mirroring HTTP error responses."""
+    body = dict(id=message_id, status=status_code, message=message)
+    if exception is not None:
+        body['details'] = dict(exception_type=type(exception).__name__, exception_message=str(exception))
+    return body
+
+
+def _spawn_thread(func, *args):
+    """Run a function in a daemon thread."""
+    thread = Thread(target=func, args=args, name='serveit-websocket')
+    thread.daemon = True
+    thread.start()
+
+
+def _wait_readable(fd):
+    """Block the current thread until a file descriptor is readable."""
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        poller.register(fd, select.POLLIN)
+        poller.poll()
+    else:
+        select.select([fd], [], [])
+
+
+def _meinheld_concurrency():
+    """Return functions that spawn and block greenlets on meinheld's event loop."""
+    from meinheld import server
+    return (lambda func, *args: server.spawn(func, args)), (lambda fd: server.trampoline(fd, read=True))
+
+
+class _Signal(object):
+    """Pipe that threads write to in order to wake up a (possibly green) reader."""
+
+    def __init__(self):
+        self._read, self._write = os.pipe()
+
+    def fileno(self):
+        """File descriptor to wait on."""
+        return self._read
+
+    def set(self):
+        """Wake up the reader."""
+        os.write(self._write, b'.')
+
+    def clear(self):
+        """Consume pending wake ups."""
+        os.read(self._read, 4096)
+
+    def close(self):
+        """Close the pipe."""
+        os.close(self._read)
+        os.close(self._write)
+
+
+class StreamingPredictions(object):
+    """WSGI application serving streaming predictions over WebSocket connections.
+
+    WebSocket requests to `path` are handled here; all other requests are passed
+    to `app` (by default the ModelServer's Flask app). The WebSocket object is
+    read from `environ['wsgi.websocket']` (as set by meinheld's
+    `WebSocketMiddleware`), and needs a `send` method and a `receive` (or
+    meinheld's `wait`) method returning None once the connection is closed.
+
+    The connection's context receives messages, and a sender spawned next to it
+    (a greenlet with meinheld, a thread otherwise) sends responses. A batching
+    thread groups messages, and groups are predicted in a shared thread pool.
+    """
+
+    def __init__(self, server, path='/ws/predictions', max_batch_size=64, max_delay=.002, app=None, workers=None):
+        """Initialize streaming application.
+
+        Arguments:
+            - server (ModelServer): server whose pipeline callbacks serve predictions
+            - app (fn): WSGI app serving all other requests; defaults to the server's Flask app
+            - path (str): WebSocket endpoint path
+            - max_batch_size (int): maximum number of messages per `predict` call
+            - max_delay (float): seconds to wait for more messages after the first
+                message of a batch arrives
+            - workers (int): number of prediction threads shared by all connections;
+                defaults to the CPU count
+        """
+        self.server = server
+        self.app = app or server.app
+        self.path = path
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.workers = workers or multiprocessing.cpu_count()
+        self._lock = Lock()
+        self._pid = None
+
+    def __call__(self, environ, start_response):
+        """Handle WebSocket connections, and pass other requests to the Flask app."""
+        websocket = environ.get('wsgi.websocket')
+        if websocket is None or environ.get('PATH_INFO') != self.path:
+            return self.app(environ, start_response)
+        if 'meinheld.client' in environ:
+            spawn, wait_readable = _meinheld_concurrency()
+            self.handle(websocket, spawn, wait_readable)
+        else:
+            self.handle(websocket)
+        return []
+
+    def _executor(self):
+        """Return the prediction thread pool, creating it again if the process has been forked."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(self.workers)
+                    self._pid = os.getpid()
+        return self._pool
+
+    def handle(self, websocket, spawn=_spawn_thread, wait_readable=_wait_readable):
+        """Serve predictions for messages received on a connection until it closes.
+
+        Arguments:
+            - websocket: connection to receive messages from and send responses to
+            - spawn (fn): runs a function with arguments concurrently with the caller
+                in the connection's context (e.g., in a new greenlet)
+            - wait_readable (fn): blocks the calling context until a file descriptor
+                is readable, letting other greenlets run
+        """
+        receive = getattr(websocket, 'receive', None) or websocket.wait
+        messages = Queue()
+        responses = deque()
+        ready, done = _Signal(), _Signal()
+        worker = Thread(target=self._process, args=(messages, responses, ready), name='serveit-websocket')
+        worker.daemon = True
+        worker.start()
+        spawn(self._send_responses, websocket, responses, ready, done, wait_readable)
+        try:
+            while True:
+                message = receive()
+                if message is None:
+                    break
+                messages.put(message)
+        finally:
+            messages.put(None)
+            wait_readable(done.fileno())  # the sender exits once all messages are answered
+            ready.close()
+            done.close()
+
+    def _send_responses(self, websocket, responses, ready, done, wait_readable):
+        """Send responses handed back by prediction threads, until the last one."""
+        connected = True
+        try:
+            while True:
+                wait_readable(ready.fileno())
+                ready.clear()
+                while responses:
+                    body = responses.popleft()
+                    if body is None:
+                        return
+                    if not connected:
+                        continue
+                    try:
+                        websocket.send(json.dumps(body))
+                    except Exception:
+                        logger.warning('Unable to send response; dropping the rest', exc_info=True)
+                        connected = False
+        finally:
+            done.set()
+
+    def _process(self, messages, responses, ready):
+        """Collect messages that arrive close together, and predict each batch's groups concurrently."""
+        def respond(body):
+            responses.append(body)
+            ready.set()
+
+        pending = set()
+        closed = False
+        try:
+            while not closed:
+                message = messages.get()
+                if message is None:
+                    break
+                batch = [message]
+                deadline = timer() + self.max_delay
+                while len(batch) < self.max_batch_size:
+                    try:
+                        message = messages.get(timeout=max(deadline - timer(), 0))
+                    except Empty:
+                        break
+                    if message is None:
+                        closed = True
+                        break
+                    batch.append(message)
+                pending = {future for future in pending if not future.done()}
+                for group in self._group(batch, respond):
+                    pending.add(self._executor().submit(self._predict_group, group, respond))
+            wait(pending)
+        except Exception:
+            logger.error('Unable to process messages', exc_info=True)
+        finally:
+            respond(None)
+
+    def _group(self, batch, respond):
+        """Decode and preprocess messages; return groups of (id, data) that can be predicted together."""
+        server = self.server
+        groups = {}
+        for message in batch:
+            message_id = None
+            try:
+                message_id, data = decode_message(message)
+            except Exception as e:
+                respond(_error(message_id, 'Unable to fetch data', 400, e))
+                continue
+            try:
+                data = server.preprocess(data)
+            except InputValidationError as e:
+                respond(_error(message_id, str(e), 400))
+                continue
+            except ColumnarInputError as e:
+                body = _error(message_id, str(e), 400)
+                body['details'] = e.details
+                respond(body)
+                continue
+            except Exception as e:
+                respond(_error(message_id, 'Could not preprocess data', 400, e))
+                continue
+            if isinstance(data, np.ndarray) and data.ndim > 0:
+                key = (data.shape[1:], data.dtype.str)
+            else:
+                key = id(data)  # not batchable
+            groups.setdefault(key, []).append((message_id, data))
+        return list(groups.values())
+
+    def _predict_group(self, group, respond):
+        """Predict a group of messages together, or separately if that fails, and hand back responses."""
+        server = self.server
+        if len(group) > 1:
+            message_ids, arrays = zip(*group)
+            n_samples = sum(len(array) for array in arrays)
+            try:
+                prediction = server.predict_and_mirror(np.concatenate(arrays))
+                if len(prediction) != n_samples:
+                    raise ValueError('Expected {} predictions, got {}'.format(n_samples, len(prediction)))
+            except Exception:
+                # isolate the failing message(s) by predicting each message separately
+                logger.warning('Batched prediction failed; retrying messages separately', exc_info=True)
+            else:
+                offsets = np.cumsum([0] + [len(array) for array in arrays])
+                for message_id, start, end in zip(message_ids, offsets[:-1], offsets[1:]):
+                    respond(self._response(message_id, prediction[start:end]))
+                return
+        for message_id, data in group:
+            try:
+                prediction = server.predict_and_mirror(data)
+            except Exception as e:
+                logger.error('Unable to make prediction', exc_info=True)
+                respond(_error(message_id, 'Unable to make prediction', 500, e))
+                continue
+            respond(self._response(message_id, prediction))
+
+    def _response(self, message_id, prediction):
+        """Postprocess a message's predictions into its response body."""
+        try:
+            return dict(id=message_id, status=200, prediction=self.server.postprocess(prediction))
+        except Exception as e:
+            return _error(message_id, 'Postprocessing failed', 500, e)
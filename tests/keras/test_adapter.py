@@ -0,0 +1,80 @@
+"""Test the Keras inference adapter."""
+import json
+import threading
+import unittest
+import numpy as np
+
+from serveit.adapters.keras import KerasModelAdapter
+from serveit.server import ModelServer
+
+
+def get_model(input_dim, outputs=1):
+    """Create and compile a small dense model."""
+    from keras.models import Sequential
+    from keras.layers import Dense, Dropout
+    model = Sequential()
+    model.add(Dense(16, input_dim=input_dim, activation='sigmoid'))
+    model.add(Dropout(.5))  # inactive at inference time
+    model.add(Dense(outputs))
+    model.compile(loss='mean_squared_error', optimizer='SGD')
+    return model
+
+
+class KerasModelAdapterTest(unittest.TestCase):
+    """Test KerasModelAdapter with a small dense model."""
+
+    def setUp(self):
+        """Unittest set up."""
+        self.model = get_model(5, outputs=2)
+        self.adapter = KerasModelAdapter(self.model, bucket_sizes=(1, 4, 8))
+        self.data = np.random.RandomState(0).rand(21, 5).astype(np.float32)
+
+    def test_predictions(self):
+        """Predictions should match `model.predict` for batches of any size."""
+        expected = self.model.predict(self.data)
+        for n in (1, 3, 4, 8, 9, 21):
+            prediction = self.adapter(self.data[:n])
+            self.assertEqual(prediction.shape, (n, 2))
+            np.testing.assert_allclose(prediction, expected[:n], rtol=1e-4, atol=1e-6)
+        self.adapter.verify(self.data)
+
+    def test_buckets(self):
+        """Batches should be padded to the smallest bucket that fits them."""
+        self.assertEqual([self.adapter.bucket_size(n) for n in (0, 1, 2, 4, 5, 8, 9)], [1, 1, 4, 4, 8, 8, 8])
+        self.assertEqual(self.adapter(self.data[:0]).shape, (0, 2))
+
+    def test_input_shape(self):
+        """Inputs of the wrong shape should be rejected."""
+        with self.assertRaises(ValueError):
+            self.adapter(self.data[:, :4])
+
+    def test_threads(self):
+        """Predictions should be correct from several threads at once."""
+        expected = self.model.predict(self.data)
+        errors = []
+
+        def predict(n):
+            try:
+                for _ in range(10):
+                    np.testing.assert_allclose(self.adapter(self.data[:n]), expected[:n], rtol=1e-4, atol=1e-6)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=predict, args=(n,)) for n in (1, 3, 7, 21)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_server(self):
+        """ModelServer should serve predictions through the adapter."""
+        app = ModelServer(self.model, self.adapter).app.test_client()
+        response = app.post('/predictions', data=json.dumps(self.data[:3].tolist()), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        np.testing.assert_allclose(
+            json.loads(response.get_data(as_text=True)), self.model.predict(self.data[:3]), rtol=1e-4, atol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
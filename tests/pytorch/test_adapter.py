@@ -0,0 +1,86 @@
+"""Test the PyTorch inference adapter."""
+import json
+import unittest
+import numpy as np
+import torch
+
+from serveit.adapters.pytorch import TorchModelAdapter, topk_labels, IMAGENET_MEAN, IMAGENET_STD
+from serveit.server import ModelServer
+
+
+class TorchModelAdapterTest(unittest.TestCase):
+    """Test TorchModelAdapter with small PyTorch models."""
+
+    def setUp(self):
+        """Unittest set up."""
+        torch.manual_seed(0)
+        self.conv_net = torch.nn.Sequential(
+            torch.nn.Conv2d(3, 4, 3),
+            torch.nn.ReLU(),
+            torch.nn.AdaptiveAvgPool2d(1),
+            torch.nn.Flatten(),
+            torch.nn.Linear(4, 10),
+        )
+        self.images = np.random.randint(0, 256, size=(2, 16, 16, 3)).astype(np.float32)
+
+    def _reference_prediction(self):
+        """Predict with the transpose, rescale and normalize chain used by the examples."""
+        tensor = torch.from_numpy(self.images.swapaxes(3, 1).swapaxes(2, 3).copy()) / 255
+        mean = torch.tensor(IMAGENET_MEAN).reshape(1, 3, 1, 1)
+        std = torch.tensor(IMAGENET_STD).reshape(1, 3, 1, 1)
+        return self.conv_net((tensor - mean) / std).detach()
+
+    def _image_adapter(self):
+        """Return an ImageNet-normalizing adapter for the conv net."""
+        return TorchModelAdapter(
+            self.conv_net, mean=IMAGENET_MEAN, std=IMAGENET_STD, scale=255., channels_last_input=True)
+
+    def test_image_predictions(self):
+        """Fused normalization should match the reference preprocessing chain."""
+        expected = self._reference_prediction()
+        prediction = self._image_adapter()(self.images)
+        self.assertFalse(prediction.requires_grad)
+        np.testing.assert_allclose(prediction.numpy(), expected.numpy(), rtol=1e-4, atol=1e-5)
+
+    def test_uint8_images(self):
+        """Integer pixel arrays should be normalized identically."""
+        expected = self._reference_prediction()
+        prediction = self._image_adapter()(self.images.astype(np.uint8))
+        np.testing.assert_allclose(prediction.numpy(), expected.numpy(), rtol=1e-4, atol=1e-5)
+
+    def test_channels_first_images(self):
+        """Per-channel normalization of (N, C, H, W) tensors should use the channel axis."""
+        expected = self._reference_prediction()
+        images = self.images.transpose(0, 3, 1, 2).copy()
+        adapter = TorchModelAdapter(self.conv_net, mean=IMAGENET_MEAN, std=IMAGENET_STD, scale=255.)
+        np.testing.assert_allclose(adapter(images).numpy(), expected.numpy(), rtol=1e-4, atol=1e-5)
+
+    def test_buffer_reuse(self):
+        """Input buffers should be channels-last and reused across requests."""
+        adapter = self._image_adapter()
+        first = adapter.to_tensor(self.images)
+        self.assertTrue(first.is_contiguous(memory_format=torch.channels_last))
+        self.assertEqual(first.shape, (2, 3, 16, 16))
+        second = adapter.to_tensor(self.images[::-1].copy())
+        self.assertEqual(first.data_ptr(), second.data_ptr())
+        self.assertNotEqual(adapter.to_tensor(self.images[:1]).data_ptr(), second.data_ptr())
+
+    def test_topk_labels(self):
+        """Top k labels should be ordered by descending score, per sample."""
+        labels = {i: 'label_{}'.format(i) for i in range(5)}
+        scores = torch.tensor([[.1, .5, .2, .9, 0.], [.3, .2, .1, 0., .4]])
+        self.assertEqual(topk_labels(labels, k=2)(scores), [['label_3', 'label_1'], ['label_4', 'label_0']])
+
+    def test_server(self):
+        """ModelServer should serve tabular predictions through the adapter."""
+        model = torch.nn.Linear(3, 1)
+        app = ModelServer(model, TorchModelAdapter(model)).app.test_client()
+        data = [[1., 2., 3.], [4., 5., 6.]]
+        response = app.post('/predictions', headers={'Content-Type': 'application/json'}, data=json.dumps(data))
+        self.assertEqual(response.status_code, 200)
+        expected = model(torch.tensor(data)).detach().numpy()
+        np.testing.assert_allclose(json.loads(response.get_data()), expected, rtol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
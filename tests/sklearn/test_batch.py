@@ -0,0 +1,107 @@
+"""Test offline bulk scoring with Scikit-Learn models."""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from sklearn.datasets import load_iris
+from sklearn.linear_model import LogisticRegression
+
+from serveit.batch import main, score_file, infer_format
+from serveit.server import ModelServer
+
+
+class BatchScoringTest(unittest.TestCase):
+    """Test score_file with a LogisticRegression fitted on iris data."""
+
+    def setUp(self):
+        """Unittest set up."""
+        self.data = load_iris()
+        self.model = LogisticRegression()
+        self.model.fit(self.data.data, self.data.target)
+        self.server = ModelServer(self.model, self.model.predict)
+        self.directory = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.directory, 'output.jsonl')
+
+    def tearDown(self):
+        """Unittest tear down."""
+        shutil.rmtree(self.directory)
+
+    def _read_output(self):
+        """Read one JSON value per output line."""
+        with open(self.output_path) as f:
+            return [json.loads(line) for line in f]
+
+    def _write_npy(self):
+        """Write iris features to a .npy file and return its path."""
+        path = os.path.join(self.directory, 'input.npy')
+        np.save(path, self.data.data)
+        return path
+
+    def test_infer_format(self):
+        """Input format should be inferred from the file extension."""
+        self.assertEqual(infer_format('data.npy'), 'npy')
+        self.assertEqual(infer_format('data.CSV'), 'csv')
+        self.assertEqual(infer_format('data.json'), 'jsonl')
+        with self.assertRaises(ValueError):
+            infer_format('data.parquet')
+
+    def test_score_npy(self):
+        """Scoring a .npy file in process should match model predictions in order."""
+        summary = score_file(self.server, self._write_npy(), self.output_path, chunk_size=16, processes=1)
+        self.assertEqual(summary, dict(rows=150, chunks=10))
+        self.assertEqual(self._read_output(), self.model.predict(self.data.data).tolist())
+
+    def test_score_npy_process_pool(self):
+        """Scoring across a process pool should preserve row order."""
+        summary = score_file(self.server, self._write_npy(), self.output_path, chunk_size=7, processes=3)
+        self.assertEqual(summary['rows'], 150)
+        self.assertEqual(self._read_output(), self.model.predict(self.data.data).tolist())
+
+    def test_score_csv(self):
+        """CSV files, optionally with a header, should be scored row by row."""
+        path = os.path.join(self.directory, 'input.csv')
+        np.savetxt(path, self.data.data, delimiter=',', header='a,b,c,d', comments='')
+        score_file(self.server, path, self.output_path, chunk_size=50, processes=1, skip_header=True)
+        self.assertEqual(self._read_output(), self.model.predict(self.data.data).tolist())
+
+    def test_skip_header_format(self):
+        """The command line should only accept --skip-header for CSV input."""
+        for path in (self._write_npy(), os.path.join(self.directory, 'input.jsonl')):
+            with self.assertRaises(SystemExit):
+                main(['tests.sklearn.test_batch:server', path, self.output_path, '--skip-header'])
+        with self.assertRaises(SystemExit):
+            main(['tests.sklearn.test_batch:server', 'input.parquet', self.output_path])
+
+    def test_score_jsonl(self):
+        """JSON lines files should be scored row by row."""
+        path = os.path.join(self.directory, 'input.jsonl')
+        with open(path, 'w') as f:
+            for row in self.data.data.tolist():
+                f.write(json.dumps(row) + '\n')
+        score_file(self.server, path, self.output_path, chunk_size=64, processes=2)
+        self.assertEqual(self._read_output(), self.model.predict(self.data.data).tolist())
+
+    def test_custom_data_loader(self):
+        """Custom data loaders should read the chunk from a synthetic request."""
+        def loader():
+            from flask import request
+            return np.array(request.get_json()) * 2
+
+        server = ModelServer(self.model, self.model.predict, data_loader=loader)
+        score_file(server, self._write_npy(), self.output_path, chunk_size=50, processes=1)
+        self.assertEqual(self._read_output(), self.model.predict(self.data.data * 2).tolist())
+
+    def test_validation_failure(self):
+        """Chunks failing validation should produce one error line per row."""
+        server = ModelServer(self.model, self.model.predict, lambda data: (data.shape[0] < 100, 'Too many rows'))
+        score_file(server, self._write_npy(), self.output_path, chunk_size=120, processes=1)
+        output = self._read_output()
+        self.assertEqual(len(output), 150)
+        self.assertIn('Too many rows', output[0]['details']['exception_message'])
+        self.assertEqual(output[-1], self.model.predict(self.data.data[-1:]).tolist()[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
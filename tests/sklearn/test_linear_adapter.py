@@ -0,0 +1,118 @@
+"""Test the linear model fast path with Scikit-Learn models."""
+import json
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from sklearn.datasets import load_iris, load_boston
+from sklearn.linear_model import LinearRegression, LogisticRegression, Ridge, RidgeClassifier, SGDClassifier
+from sklearn.svm import LinearSVC, SVC
+
+from serveit.adapters.linear import LinearModelAdapter, is_linear_model
+from serveit.server import ModelServer
+
+
+class LinearModelAdapterTest(unittest.TestCase):
+    """Test LinearModelAdapter against sklearn predictions."""
+
+    def setUp(self):
+        """Unittest set up."""
+        self.iris = load_iris()
+        self.boston = load_boston()
+
+    def test_classifiers(self):
+        """Class labels should be identical to sklearn's."""
+        binary_target = (self.iris.target == 2).astype(int)
+        for model, target in [
+                (LogisticRegression(), self.iris.target),
+                (LogisticRegression(solver='liblinear'), self.iris.target),
+                (LogisticRegression(), binary_target),
+                (RidgeClassifier(), self.iris.target),
+                (SGDClassifier(random_state=0), self.iris.target),
+                (LinearSVC(), binary_target)]:
+            model.fit(self.iris.data, target)
+            adapter = LinearModelAdapter(model)
+            np.testing.assert_array_equal(adapter(self.iris.data), model.predict(self.iris.data))
+            adapter.verify(self.iris.data)
+
+    def test_string_labels(self):
+        """Class labels should be taken from the model's classes."""
+        target = self.iris.target_names[self.iris.target]
+        model = LogisticRegression().fit(self.iris.data, target)
+        np.testing.assert_array_equal(LinearModelAdapter(model)(self.iris.data), model.predict(self.iris.data))
+
+    def test_regressors(self):
+        """Regression targets should agree with sklearn's within float32 precision."""
+        for model, target in [
+                (LinearRegression(), self.boston.target),
+                (Ridge(), self.boston.target),
+                (LinearRegression(), np.c_[self.boston.target, -self.boston.target])]:
+            model.fit(self.boston.data, target)
+            adapter = LinearModelAdapter(model)
+            prediction = adapter(self.boston.data)
+            self.assertEqual(prediction.shape, model.predict(self.boston.data).shape)
+            np.testing.assert_allclose(prediction, model.predict(self.boston.data), rtol=1e-4)
+            adapter.verify(self.boston.data)
+
+    def test_float64_regressor(self):
+        """A float64 kernel should match sklearn to floating point rounding."""
+        model = LinearRegression().fit(self.boston.data, self.boston.target)
+        prediction = LinearModelAdapter(model, dtype=np.float64)(self.boston.data)
+        np.testing.assert_allclose(prediction, model.predict(self.boston.data), rtol=1e-12)
+
+    def test_predict_proba(self):
+        """Probabilities should match sklearn's for multinomial, one-vs-rest and binary models."""
+        binary_target = (self.iris.target == 2).astype(int)
+        for model, target in [
+                (LogisticRegression(), self.iris.target),
+                (LogisticRegression(solver='liblinear'), self.iris.target),
+                (LogisticRegression(multi_class='multinomial'), binary_target),
+                (LogisticRegression(), binary_target)]:
+            model.fit(self.iris.data, target)
+            np.testing.assert_allclose(
+                LinearModelAdapter(model).predict_proba(self.iris.data), model.predict_proba(self.iris.data), atol=1e-5)
+
+    def test_unsupported_models(self):
+        """Non-linear models should be rejected."""
+        model = SVC(kernel='linear').fit(self.iris.data, self.iris.target)
+        self.assertFalse(is_linear_model(model))
+        with self.assertRaises(TypeError):
+            LinearModelAdapter(model)
+
+    def test_bad_input(self):
+        """Inputs with the wrong number of features should raise ValueError."""
+        adapter = LinearModelAdapter(LogisticRegression().fit(self.iris.data, self.iris.target))
+        with self.assertRaises(ValueError):
+            adapter(self.iris.data[:, :3])
+
+    def test_verify_mismatch(self):
+        """verify should raise if the adapter disagrees with the model."""
+        model = LogisticRegression().fit(self.iris.data, self.iris.target)
+        adapter = LinearModelAdapter(model)
+        adapter.coef = -adapter.coef
+        with self.assertRaises(ValueError):
+            adapter.verify(self.iris.data)
+
+    def test_threads(self):
+        """Per-thread buffers should keep concurrent predictions independent."""
+        model = LogisticRegression().fit(self.iris.data, self.iris.target)
+        adapter = LinearModelAdapter(model)
+        batches = [self.iris.data[i:i + n] for n in (1, 5, 50) for i in range(0, 100, 7)]
+        with ThreadPoolExecutor(4) as executor:
+            predictions = list(executor.map(adapter, batches))
+        for batch, prediction in zip(batches, predictions):
+            np.testing.assert_array_equal(prediction, model.predict(batch))
+
+    def test_server(self):
+        """ModelServer should serve the same responses with the adapter."""
+        model = LogisticRegression().fit(self.iris.data, self.iris.target)
+        app = ModelServer(model, LinearModelAdapter(model)).app.test_client()
+        response = app.post(
+            '/predictions',
+            headers={'Content-Type': 'application/json'},
+            data=json.dumps(self.iris.data[:10].tolist()),
+        )
+        self.assertEqual(json.loads(response.get_data()), model.predict(self.iris.data[:10]).tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
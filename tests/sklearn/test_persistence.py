@@ -0,0 +1,60 @@
+"""Test model persistence with Scikit-Learn models."""
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from sklearn.datasets import load_iris
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+
+from serveit.persistence import save_model, load_model
+from serveit.server import ModelServer
+
+
+class PersistenceTest(unittest.TestCase):
+    """Test saving and memory-mapped loading of fitted models."""
+
+    def setUp(self):
+        """Unittest set up."""
+        self.data = load_iris()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Unittest tear down."""
+        shutil.rmtree(self.directory)
+
+    def test_load_memory_mapped(self):
+        """Loaded arrays should be read-only memory maps with identical predictions."""
+        model = LogisticRegression().fit(self.data.data, self.data.target)
+        save_model(model, self.directory)
+        loaded = load_model(self.directory)
+        self.assertIsInstance(loaded.coef_, np.memmap)
+        self.assertFalse(loaded.coef_.flags.writeable)
+        np.testing.assert_array_equal(loaded.predict(self.data.data), model.predict(self.data.data))
+
+    def test_load_in_memory(self):
+        """Models should be loaded into process memory if mmap_mode is None."""
+        model = RandomForestClassifier(n_estimators=5).fit(self.data.data, self.data.target)
+        save_model(model, self.directory)
+        loaded = load_model(self.directory, mmap_mode=None)
+        self.assertNotIsInstance(loaded.estimators_[0].tree_.value, np.memmap)
+        np.testing.assert_array_equal(loaded.predict(self.data.data), model.predict(self.data.data))
+
+    def test_server_from_artifact(self):
+        """A ModelServer should serve predictions from a saved artifact."""
+        model = LogisticRegression().fit(self.data.data, self.data.target)
+        ModelServer(model, model.predict).save_model(self.directory)
+        server = ModelServer.from_artifact(self.directory)
+        app = server.app.test_client()
+        response = app.post(
+            '/predictions',
+            headers={'Content-Type': 'application/json'},
+            data=json.dumps(self.data.data[:10].tolist()),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.get_data()), model.predict(self.data.data[:10]).tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""Test thread-pool inference with Scikit-Learn model replicas."""
+import json
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from sklearn.base import clone
+from sklearn.datasets import load_iris
+from sklearn.linear_model import LogisticRegression
+
+from serveit.replicas import ReplicaPool
+from serveit.server import ModelServer
+
+
+class ReplicaPoolTest(unittest.TestCase):
+    """Test ReplicaPool with LogisticRegression replicas."""
+
+    def setUp(self):
+        """Unittest set up."""
+        self.data = load_iris()
+        self.model = LogisticRegression()
+        self.model.fit(self.data.data, self.data.target)
+        self.replica_threads = []
+
+    def replica_factory(self):
+        """Fit a model replica, recording the thread that owns it."""
+        self.replica_threads.append(threading.current_thread().name)
+        replica = clone(self.model).fit(self.data.data, self.data.target)
+        return replica.predict
+
+    def test_replica_per_thread(self):
+        """Each worker thread should create and own a single replica."""
+        pool = ReplicaPool(self.replica_factory, size=3)
+        pool.start()
+        self.assertEqual(sorted(self.replica_threads), ['serveit-replica-{}'.format(i) for i in range(3)])
+        pool.shutdown()
+
+    def test_concurrent_predictions(self):
+        """Concurrent requests should be spread across replicas with correct results."""
+        pool = ReplicaPool(self.replica_factory, size=4)
+        batches = [self.data.data[i:i + 10] for i in range(0, 150, 10)] * 4
+        with ThreadPoolExecutor(8) as executor:
+            predictions = list(executor.map(pool, batches))
+        for batch, prediction in zip(batches, predictions):
+            np.testing.assert_array_equal(prediction, self.model.predict(batch))
+        stats = pool.stats()
+        self.assertEqual(sum(stats['requests_per_replica']), len(batches))
+        self.assertEqual(stats['busy'], 0)
+        pool.shutdown()
+
+    def test_prediction_error(self):
+        """Prediction errors should be raised in the calling thread."""
+        pool = ReplicaPool(self.replica_factory, size=2)
+        with self.assertRaises(ValueError):
+            pool(np.zeros((2, 2)))
+        pool.shutdown()
+
+    def test_factory_error(self):
+        """Replica factory errors should be raised on start."""
+        def broken_factory():
+            raise RuntimeError('Unable to load model')
+
+        with self.assertRaises(RuntimeError):
+            ReplicaPool(broken_factory, size=2).start()
+
+    def test_server(self):
+        """A ModelServer should serve predictions from a replica pool."""
+        pool = ReplicaPool(self.replica_factory, size=2)
+        app = ModelServer(self.model, pool).app.test_client()
+        response = app.post(
+            '/predictions',
+            headers={'Content-Type': 'application/json'},
+            data=json.dumps(self.data.data[:10].tolist()),
+        )
+        self.assertEqual(json.loads(response.get_data()), self.model.predict(self.data.data[:10]).tolist())
+        pool.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""Test shadow traffic mirroring with Scikit-Learn models."""
+import json
+import time
+import unittest
+from sklearn.datasets import load_iris
+from sklearn.linear_model import LogisticRegression
+from sklearn.tree import DecisionTreeClassifier
+
+from serveit.server import ModelServer
+from serveit.shadow import ShadowModel, default_agreement
+
+
+class ShadowModelTest(unittest.TestCase):
+    """Test ModelServer with a shadow model."""
+
+    def setUp(self):
+        """Unittest set up."""
+        self.data = load_iris()
+        self.model = LogisticRegression()
+        self.model.fit(self.data.data, self.data.target)
+
+    def _post(self, app, data):
+        """Make a POST request to /predictions and close the response."""
+        response = app.post(
+            '/predictions',
+            headers={'Content-Type': 'application/json'},
+            data=json.dumps(data),
+        )
+        response.close()
+        return response
+
+    @staticmethod
+    def _wait_for(shadow, n, timeout=5.):
+        """Wait until `n` mirrored requests have been processed."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            counts = shadow.stats()['counts']
+            if counts['completed'] + counts['failed'] >= n:
+                return
+            time.sleep(.01)
+
+    def test_default_agreement(self):
+        """Agreement should be the fraction of matching rows."""
+        self.assertEqual(default_agreement([1, 2, 3, 4], [1, 2, 0, 0]), .5)
+        self.assertEqual(default_agreement([[1., 2.], [3., 4.]], [[1., 2.], [3., 5.]]), .5)
+        self.assertEqual(default_agreement(['a', 'b'], ['a', 'b']), 1.)
+        self.assertEqual(default_agreement([1, 2], [1, 2, 3]), 0.)
+
+    def test_shadow_stats(self):
+        """Mirrored requests should be scored by the shadow model and summarized."""
+        shadow_model = DecisionTreeClassifier().fit(self.data.data, self.data.target)
+        shadow = ShadowModel(shadow_model, shadow_model.predict)
+        server = ModelServer(self.model, self.model.predict, shadow=shadow)
+        app = server.app.test_client()
+
+        for _ in range(5):
+            response = self._post(app, self.data.data[:20].tolist())
+            self.assertEqual(response.status_code, 200)
+        self._wait_for(shadow, 5)
+
+        response = app.get('/info/shadow')
+        self.assertEqual(response.status_code, 200)
+        stats = json.loads(response.get_data())
+        self.assertEqual(stats['counts']['mirrored'], 5)
+        self.assertEqual(stats['counts']['completed'], 5)
+        self.assertEqual(stats['counts']['dropped'], 0)
+        self.assertGreater(stats['agreement'], .5)
+        self.assertLessEqual(stats['agreement'], 1.)
+        self.assertIsNotNone(stats['primary_latency_ms']['p99'])
+        self.assertIsNotNone(stats['shadow_latency_ms']['p99'])
+
+    def test_shadow_run_pipeline(self):
+        """Predictions outside of requests should be mirrored too."""
+        shadow = ShadowModel(self.model, self.model.predict)
+        server = ModelServer(self.model, self.model.predict, shadow=shadow)
+        self.assertEqual(len(server.run_pipeline(self.data.data[:10].tolist())), 10)
+        self._wait_for(shadow, 1)
+        self.assertEqual(shadow.stats()['counts']['completed'], 1)
+        self.assertEqual(shadow.stats()['agreement'], 1.)
+
+    def test_shadow_drop_on_overload(self):
+        """Requests should be dropped, not queued, when the shadow model falls behind."""
+        def slow_predict(data):
+            time.sleep(.2)
+            return self.model.predict(data)
+
+        shadow = ShadowModel(self.model, slow_predict, max_queue_size=1)
+        server = ModelServer(self.model, self.model.predict, shadow=shadow)
+        app = server.app.test_client()
+
+        start = time.time()
+        for _ in range(10):
+            response = self._post(app, self.data.data[:5].tolist())
+            self.assertEqual(response.status_code, 200)
+        self.assertLess(time.time() - start, 1.)  # primary path never waits on the shadow
+
+        counts = shadow.stats()['counts']
+        self.assertGreater(counts['dropped'], 0)
+        self.assertEqual(counts['mirrored'] + counts['dropped'], 10)
+
+    def test_shadow_failure(self):
+        """Shadow failures should be counted without affecting primary responses."""
+        def failing_predict(data):
+            raise ValueError('Candidate model is broken')
+
+        shadow = ShadowModel(self.model, failing_predict)
+        server = ModelServer(self.model, self.model.predict, shadow=shadow)
+        app = server.app.test_client()
+
+        response = self._post(app, self.data.data[:5].tolist())
+        self.assertEqual(response.status_code, 200)
+        self._wait_for(shadow, 1)
+        self.assertEqual(shadow.stats()['counts']['failed'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+"""Test pluggable server backends."""
+from http.client import HTTPConnection
+from timeit import default_timer as timer
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import unittest
+
+from serveit import backends
+from serveit.server import ModelServer
+
+
+class WorkerModel(object):
+    """Model that predicts the row sums of its input, and the server process's worker index."""
+
+    @staticmethod
+    def predict(data):
+        """Sum rows."""
+        return data.sum(axis=1)
+
+
+def free_port():
+    """Return a free local port."""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def run_server(port, backend, workers, threads):
+    """Serve a model on a backend."""
+    model = WorkerModel()
+    server = ModelServer(model, model.predict)
+    server.create_info_endpoint('worker', lambda: dict(
+        pid=os.getpid(), index=os.environ.get('SERVEIT_WORKER_INDEX')))
+    server.serve(port=port, backend=backend, workers=workers, threads=threads, backlog=64)
+
+
+class BackendsTest(unittest.TestCase):
+    """Test serving with each installed backend."""
+
+    def _serve(self, backend, workers=1, threads=1):
+        """Start a server in a child process, and return a connection to it once it is up."""
+        if not backends.is_available(backend):
+            self.skipTest('{} is not installed'.format(backend))
+        port = free_port()
+        process = multiprocessing.get_context('fork').Process(
+            target=run_server, args=(port, backend, workers, threads))
+        process.start()
+
+        def stop():
+            os.kill(process.pid, signal.SIGINT)
+            process.join(10)
+            if process.is_alive():
+                process.terminate()
+        self.addCleanup(stop)
+
+        deadline = timer() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except socket.error:
+                if timer() > deadline:
+                    self.fail('{} server did not start'.format(backend))
+                time.sleep(.05)
+        return port
+
+    def _request(self, port, method, path, body=None):
+        """Make a request and return the status and JSON body."""
+        connection = HTTPConnection('127.0.0.1', port, timeout=10)
+        connection.request(method, path, body, {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        data = json.loads(response.read().decode('utf-8'))
+        connection.close()
+        return response.status, data
+
+    def _check(self, backend, workers=1, threads=1):
+        """Check that a backend serves predictions, info and errors from every worker."""
+        port = self._serve(backend, workers, threads)
+        self.assertEqual(self._request(port, 'POST', '/predictions', json.dumps([[1, 2], [3, 4]])), (200, [3, 7]))
+        self.assertEqual(self._request(port, 'POST', '/predictions', '[1, 2]')[0], 500)
+        self.assertEqual(self._request(port, 'GET', '/fake-endpoint')[0], 404)
+        indices = set()
+        deadline = timer() + 10
+        while len(indices) < workers and timer() < deadline:
+            indices.add(self._request(port, 'GET', '/info/worker')[1]['index'])
+        self.assertEqual(indices, {str(i) for i in range(workers)})
+
+    def test_wsgiref(self):
+        """The standard library backend should serve requests, threaded and pre-forked."""
+        self._check('wsgiref')
+        self._check('wsgiref', workers=2, threads=4)
+
+    def test_werkzeug(self):
+        """The werkzeug backend should serve requests."""
+        self._check('werkzeug', workers=2)
+
+    def test_gunicorn(self):
+        """The gunicorn backends should serve requests."""
+        self._check('gunicorn', workers=2)
+        self._check('gunicorn-threaded', threads=4)
+
+    def test_meinheld(self):
+        """The meinheld backend should serve requests."""
+        self._check('meinheld')
+
+    def test_get_backend(self):
+        """Backends should be chosen by name or configuration, falling back when not installed."""
+        self.assertEqual(backends.get_backend('wsgiref'), 'wsgiref')
+        self.assertEqual(backends.get_backend(), backends.get_backend(backends.config.WSGI_BACKEND))
+        with self.assertRaises(ValueError):
+            backends.get_backend('fake-backend')
+        if not backends.is_available('meinheld'):
+            self.assertEqual(backends.get_backend('meinheld'), backends.FALLBACK_BACKEND)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"""Test adaptive batching."""
+import json
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from serveit.batching import AdaptiveBatcher
+from serveit.server import ModelServer
+
+
+class LinearModel(object):
+    """Model with a fixed per-call overhead, that sums rows."""
+
+    def __init__(self, overhead=.002):
+        """Initialize model."""
+        self.overhead = overhead
+        self.batch_sizes = []
+
+    def predict(self, data):
+        """Sum rows, recording the batch size."""
+        self.batch_sizes.append(len(data))
+        time.sleep(self.overhead)
+        return data.sum(axis=1)
+
+
+class AdaptiveBatcherTest(unittest.TestCase):
+    """Test AdaptiveBatcher."""
+
+    def setUp(self):
+        """Unittest set up."""
+        self.model = LinearModel()
+
+    def _run_concurrent(self, batcher, n_requests=400, n_threads=16, rows=2):
+        """Send requests from several threads and check each gets its own predictions."""
+        requests = [np.random.rand(rows, 3) for _ in range(n_requests)]
+        with ThreadPoolExecutor(n_threads) as executor:
+            predictions = list(executor.map(batcher, requests))
+        for data, prediction in zip(requests, predictions):
+            np.testing.assert_allclose(prediction, data.sum(axis=1))
+
+    def test_batches_concurrent_requests(self):
+        """Concurrent requests should be combined into larger batches within the target."""
+        batcher = AdaptiveBatcher(self.model.predict, latency_target=.2, retune_interval=5)
+        self._run_concurrent(batcher)
+        stats = batcher.stats()
+        self.assertGreater(stats['batch_size'], 1)
+        self.assertGreater(max(self.model.batch_sizes), 2)
+        self.assertLess(stats['counts']['batches'], stats['counts']['requests'])
+        self.assertEqual(stats['counts']['samples'], 800)
+        self.assertEqual(stats['sample_shape'], [3])
+        self.assertLessEqual(max(self.model.batch_sizes), batcher.max_batch_size)
+
+    def test_back_off(self):
+        """Batch size should shrink when observed latency exceeds the target."""
+        batcher = AdaptiveBatcher(self.model.predict, latency_target=.001, retune_interval=1)
+        batcher.batch_size = 64
+        self._run_concurrent(batcher, n_requests=20, n_threads=1)
+        self.assertEqual(batcher.stats()['batch_size'], 1)
+        self.assertEqual(batcher.wait_window, 0)
+
+    def test_mixed_shapes(self):
+        """Requests with different sample shapes should never share a batch."""
+        batcher = AdaptiveBatcher(lambda data: data.sum(axis=1), retune_interval=2)
+        requests = [np.ones((1, 2 + i % 3)) for i in range(200)]
+        with ThreadPoolExecutor(8) as executor:
+            predictions = list(executor.map(batcher, requests))
+        for data, prediction in zip(requests, predictions):
+            np.testing.assert_array_equal(prediction, data.sum(axis=1))
+
+    def test_prediction_error(self):
+        """Prediction errors should be raised to every request in the batch."""
+        def predict(data):
+            raise ValueError('Model failure')
+
+        with self.assertRaises(ValueError):
+            AdaptiveBatcher(predict)(np.ones((1, 3)))
+
+    def test_server(self):
+        """ModelServer should serve batched predictions and batching decisions."""
+        batcher = AdaptiveBatcher(self.model.predict)
+        server = ModelServer(self.model, batcher)
+        server.create_info_endpoint('batching', batcher.stats)
+        app = server.app.test_client()
+        response = app.post(
+            '/predictions',
+            headers={'Content-Type': 'application/json'},
+            data=json.dumps([[1, 2, 3], [4, 5, 6]]),
+        )
+        self.assertEqual(json.loads(response.get_data()), [6, 15])
+        stats = json.loads(app.get('/info/batching').get_data())
+        self.assertEqual(stats['counts']['requests'], 1)
+        self.assertIn('wait_window_ms', stats)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+"""Test incremental request body parsing."""
+from io import BytesIO
+import json
+import tracemalloc
+import unittest
+import numpy as np
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from serveit.body import StreamingLoader, TENSOR_CONTENT_TYPE
+from serveit.server import ModelServer
+from serveit.websocket import HEADER_LENGTH, encode_tensor_message
+
+
+class SumModel(object):
+    """Model that predicts the row sums of its input."""
+
+    @staticmethod
+    def predict(data):
+        """Sum rows."""
+        return data.sum(axis=1)
+
+
+class StreamingLoaderTest(unittest.TestCase):
+    """Test StreamingLoader."""
+
+    def setUp(self):
+        """Unittest set up."""
+        self.loader = StreamingLoader(chunk_size=7)  # split numbers across chunks
+
+    def _load(self, body, content_type='application/json', **kwargs):
+        """Load a body through the loader."""
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        kwargs.setdefault('content_length', len(body))
+        return self.loader.load(BytesIO(body), content_type, **kwargs)
+
+    def test_json_arrays(self):
+        """JSON arrays of any dimensions should be parsed like json_numpy_loader."""
+        for data in ([1.5, -2e-3, 3], [[1, 2.25], [3, 4]], [[[1], [2]], [[3], [4]]], [], [[], []], [[1e300, -0.0]]):
+            array = self._load(data)
+            np.testing.assert_array_equal(array, np.array(data, dtype=np.float64))
+            self.assertEqual(array.shape, np.array(data).shape)
+        array = self._load(b'  [ [1 ,2 ] ,\n [3,4] ] ', content_length=None)
+        np.testing.assert_array_equal(array, [[1, 2], [3, 4]])
+
+    def test_dtype(self):
+        """JSON values should be parsed into the loader's type."""
+        self.loader.dtype = np.dtype(np.float32)
+        self.assertEqual(self._load([[1, 2]]).dtype, np.float32)
+
+    def test_invalid_json(self):
+        """Ragged, mixed, non-numeric and truncated arrays should be rejected."""
+        for body in (b'[[1, 2], [3]]', b'[[1, 2], [3, 4, 5]]', b'[[1, 2], 3]', b'[1, [2]]', b'[1, "a"]', b'[true]',
+                     b'{"a": 1}', b'5', b'[1, 2', b'[1, 2]]', b'[1] [2]', b'[1 2]', b''):
+            with self.assertRaises(ValueError):
+                self._load(body)
+
+    def test_tensors(self):
+        """Binary tensors should be read into arrays of their type and shape."""
+        for array in (np.arange(24, dtype=np.int16).reshape(2, 3, 4), np.ones((3, 0)), np.float32(1.5)):
+            loaded = self._load(encode_tensor_message(None, array), TENSOR_CONTENT_TYPE)
+            self.assertEqual(loaded.dtype, array.dtype)
+            np.testing.assert_array_equal(loaded, array)
+        with self.assertRaises(ValueError):
+            self._load(encode_tensor_message(None, np.ones(4))[:-1], TENSOR_CONTENT_TYPE)
+
+    def test_size_limits(self):
+        """Bodies over the limit should be rejected, declared or not."""
+        body = json.dumps(list(range(100))).encode('utf-8')
+        with self.assertRaises(RequestEntityTooLarge):
+            self._load(body, max_content_length=100)
+        with self.assertRaises(RequestEntityTooLarge):
+            self._load(body, content_length=None, max_content_length=100)
+        self.assertEqual(len(self._load(body, max_content_length=len(body))), 100)
+        self.assertEqual(len(self._load(body, content_length=None, max_content_length=len(body))), 100)
+
+        # tensor sizes are checked from their headers
+        tensor = encode_tensor_message(None, np.ones(100))
+        with self.assertRaises(RequestEntityTooLarge):
+            self._load(tensor[:200], TENSOR_CONTENT_TYPE, content_length=None, max_content_length=200)
+
+    def test_tensor_header_sizes(self):
+        """Tensor headers should be checked against the limits before the tensor is allocated."""
+        def header_only(shape):
+            header = json.dumps(dict(dtype='<f8', shape=shape)).encode('utf-8')
+            return HEADER_LENGTH.pack(len(header)) + header
+
+        huge = header_only([10 ** 8, 10 ** 8])  # 80 PB
+        with self.assertRaises(RequestEntityTooLarge):
+            self._load(huge, TENSOR_CONTENT_TYPE, content_length=None, max_content_length=1024)
+        with self.assertRaises(ValueError):
+            self._load(huge, TENSOR_CONTENT_TYPE)
+        with self.assertRaises(ValueError):
+            self._load(header_only([-1, 2]), TENSOR_CONTENT_TYPE)
+        with self.assertRaises(ValueError):
+            self._load(HEADER_LENGTH.pack(10 ** 9) + b'{}', TENSOR_CONTENT_TYPE)
+
+    def test_peak_memory(self):
+        """Parsing should allocate little more than the final array."""
+        self.loader = StreamingLoader()
+        data = np.random.rand(20000, 10)
+        body = json.dumps(data.tolist()).encode('utf-8')
+        tracemalloc.start()
+        try:
+            array = self._load(body)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        np.testing.assert_array_equal(array, data)
+        self.assertLess(peak, 1.5 * data.nbytes)
+
+
+class ServerBodyTest(unittest.TestCase):
+    """Test request body limits and streaming loading in ModelServer."""
+
+    def _client(self, **kwargs):
+        """Return a test client for a server."""
+        model = SumModel()
+        return Client(ModelServer(model, model.predict, **kwargs).get_wsgi_app(), Response)
+
+    def test_streaming_loader(self):
+        """Predictions should be served from JSON and binary bodies."""
+        client = self._client(data_loader=StreamingLoader())
+        response = client.post('/predictions', data=json.dumps([[1, 2], [3, 4]]), content_type='application/json')
+        self.assertEqual(json.loads(response.get_data()), [3, 7])
+        body = encode_tensor_message(None, np.array([[1, 2], [3, 4]], dtype=np.int32))
+        response = client.post('/predictions', data=body, content_type=TENSOR_CONTENT_TYPE)
+        self.assertEqual(json.loads(response.get_data()), [3, 7])
+        response = client.post('/predictions', data='[[1, 2], [3]]', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.get_data())['message'], 'Unable to fetch data')
+
+    def test_max_content_length(self):
+        """Bodies over the server's limit should get 413 responses, with any loader."""
+        body = json.dumps([[1, 2]] * 100)
+        for kwargs in (dict(), dict(data_loader=StreamingLoader()), dict(fast_path=True)):
+            client = self._client(max_content_length=100, **kwargs)
+            response = client.post('/predictions', data=body, content_type='application/json')
+            self.assertEqual(response.status_code, 413)
+            self.assertEqual(json.loads(response.get_data())['message'], 'Request body too large')
+            response = client.post('/predictions', data=body[:99] + ']', content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            response = client.post('/predictions', data='[[1, 2]]', content_type='application/json')
+            self.assertEqual(json.loads(response.get_data()), [3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""Test columnar JSON input with named features."""
+import json
+import unittest
+import numpy as np
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from serveit.columnar import ColumnarFormat, ColumnarInputError
+from serveit.server import ModelServer
+
+FEATURES = ['a', 'b', 'c']
+
+
+class WeightedSumModel(object):
+    """Model that predicts a weighted sum of its features, so that column order matters."""
+
+    @staticmethod
+    def predict(data):
+        """Weighted row sums."""
+        return data.dot([1, 10, 100])
+
+
+class ColumnarFormatTest(unittest.TestCase):
+    """Test converting columns to arrays."""
+
+    def setUp(self):
+        """Unittest set up."""
+        self.columnar = ColumnarFormat(FEATURES)
+
+    def test_order(self):
+        """Columns should be ordered by the registered feature names."""
+        data = self.columnar({'c': [3, 6], 'a': [1, 4], 'b': [2, 5]})
+        np.testing.assert_array_equal(data, [[1, 2, 3], [4, 5, 6]])
+        self.assertEqual(data.dtype, np.float64)
+        self.assertTrue(data.flags.f_contiguous)
+        self.assertEqual(self.columnar({'a': [], 'b': [], 'c': []}).shape, (0, 3))
+        self.assertEqual(ColumnarFormat(FEATURES, dtype=np.float32)({'a': [1], 'b': [2], 'c': [3]}).dtype, np.float32)
+
+    def test_mismatched_features(self):
+        """Missing and extra features should be reported."""
+        with self.assertRaises(ColumnarInputError) as context:
+            self.columnar({'b': [1], 'x': [2], 'd': [3]})
+        self.assertEqual(context.exception.missing, ['a', 'c'])
+        self.assertEqual(context.exception.extra, ['d', 'x'])
+        self.assertIn('2 missing, 2 unknown', str(context.exception))
+        with self.assertRaises(ColumnarInputError) as context:
+            self.columnar({'a': [1], 'b': [2]})
+        self.assertEqual(context.exception.details, dict(missing_features=['c'], extra_features=[]))
+
+    def test_invalid_columns(self):
+        """Ragged, scalar and non-numeric columns should be rejected."""
+        for columns in ({'a': [1], 'b': [2, 3], 'c': [4]},
+                        {'a': 1, 'b': [2], 'c': [3]},
+                        {'a': [1], 'b': 2, 'c': [3]},
+                        {'a': [1], 'b': ['x'], 'c': [3]},
+                        {'a': [1], 'b': [[2, 3]], 'c': [3]}):
+            with self.assertRaises(ColumnarInputError):
+                self.columnar(columns)
+
+    def test_unique_names(self):
+        """Feature names should be unique."""
+        with self.assertRaises(ValueError):
+            ColumnarFormat(['a', 'a'])
+
+
+class ColumnarServerTest(unittest.TestCase):
+    """Test columnar input to the prediction endpoint."""
+
+    def setUp(self):
+        """Unittest set up."""
+        model = WeightedSumModel()
+        self.server = ModelServer(model, model.predict, lambda data: (data.ndim == 2, 'Data should have two dimensions.'))
+        self.clients = (self.server.app.test_client(), Client(self.server.get_wsgi_app(), Response))
+
+    def _post(self, client, data):
+        """Post JSON data; return the status code and decoded response."""
+        response = client.post('/predictions', data=json.dumps(data), content_type='application/json')
+        return response.status_code, json.loads(response.get_data(as_text=True))
+
+    def test_registered_features(self):
+        """Columnar input should be accepted once feature names are registered."""
+        self.assertIsNone(self.server.columnar)
+        self.server.create_info_endpoint('features', FEATURES)
+        for client in self.clients:
+            self.assertEqual(self._post(client, {'c': [3, 6], 'b': [2, 5], 'a': [1, 4]}), (200, [321, 654]))
+            self.assertEqual(self._post(client, [[1, 2, 3]]), (200, [321]))  # row-major input is unchanged
+        self.assertEqual(self.server.run_pipeline({'a': [1], 'b': [1], 'c': [1]}), [111])
+
+    def test_mismatched_features(self):
+        """Missing and extra features should get 400 responses listing them."""
+        self.server.create_info_endpoint('features', FEATURES)
+        for client in self.clients:
+            status, response = self._post(client, {'a': [1], 'b': [2], 'd': [3]})
+            self.assertEqual(status, 400)
+            self.assertIn('registered features', response['message'])
+            self.assertEqual(response['details'], dict(missing_features=['c'], extra_features=['d']))
+            status, response = self._post(client, {'a': [1], 'b': [2, 3], 'c': [3]})
+            self.assertEqual(status, 400)
+            self.assertIn("'b'", response['message'])
+
+    def test_unregistered_features(self):
+        """Without registered feature names, objects are passed to the pipeline as before."""
+        self.server.create_info_endpoint('features', lambda: FEATURES)  # dynamic info isn't registered
+        self.assertIsNone(self.server.columnar)
+        status, response = self._post(self.clients[0], {'a': [1], 'b': [2], 'c': [3]})
+        self.assertEqual(status, 400)
+        self.assertIn('two dimensions', response['message'])
+
+    def test_other_features_info(self):
+        """Static `features` info that isn't a list of unique names should be served, not registered."""
+        for name, data in (('features', None), ('features', ['a', 'a'])):
+            server = ModelServer(WeightedSumModel(), WeightedSumModel.predict)
+            server.create_info_endpoint(name, data)
+            self.assertIsNone(server.columnar)
+            response = server.app.test_client().get('/info/features')
+            self.assertEqual(json.loads(response.get_data(as_text=True)), data)
+        self.server.create_info_endpoint('features', np.array(FEATURES))
+        self.assertEqual(self.server.columnar.feature_names, FEATURES)
+
+    def test_custom_data_loader(self):
+        """Objects returned by custom data loaders should be passed to the pipeline unchanged."""
+        def loader():
+            return {'rows': [[1, 2, 3]]}
+
+        model = WeightedSumModel()
+        server = ModelServer(model, model.predict, data_loader=loader, preprocessor=lambda data: data['rows'])
+        server.register_features(FEATURES)
+        response = server.app.test_client().post('/predictions')
+        self.assertEqual((response.status_code, json.loads(response.get_data(as_text=True))), (200, [321]))
+        self.assertEqual(server.run_pipeline({'rows': [[1, 2, 3]]}), [321])
+
+
+if __name__ == '__main__':
+    unittest.main()
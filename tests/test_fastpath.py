@@ -0,0 +1,136 @@
+"""Test the raw WSGI fast path for predictions."""
+from io import BytesIO
+import json
+import time
+import unittest
+import numpy as np
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from serveit.fastpath import FastPredictions, is_json
+from serveit.server import ModelServer
+from serveit.shadow import ShadowModel
+
+
+class SumModel(object):
+    """Model that predicts the row sums of its input."""
+
+    def __init__(self):
+        """Initialize model."""
+        self.name = 'sum'
+
+    @staticmethod
+    def predict(data):
+        """Sum rows, failing on NaN input."""
+        if np.isnan(data).any():
+            raise ValueError('NaN input')
+        return data.sum(axis=1)
+
+
+class FastPredictionsTest(unittest.TestCase):
+    """Test that FastPredictions responds exactly as the Flask app does."""
+
+    def setUp(self):
+        """Unittest set up."""
+        self.model = SumModel()
+
+        def validator(data):
+            return (data.ndim == 2, 'Data should have two dimensions.')
+
+        def postprocessor(prediction):
+            if (prediction < 0).any():
+                raise ValueError('Negative prediction')
+            return prediction
+
+        self.server = ModelServer(self.model, self.model.predict, validator, postprocessor=postprocessor)
+        self.flask_client = self.server.app.test_client()
+        self.fast_client = Client(FastPredictions(self.server), Response)
+
+    def _assert_same_response(self, method, path, **kwargs):
+        """Make the same request to both apps and compare the responses."""
+        expected = getattr(self.flask_client, method)(path, **kwargs)
+        actual = getattr(self.fast_client, method)(path, **kwargs)
+        self.assertEqual(actual.status_code, expected.status_code)
+        self.assertEqual(actual.get_data(), expected.get_data())
+        self.assertEqual(actual.headers.get('Content-Type'), expected.headers.get('Content-Type'))
+        return actual
+
+    def _post(self, body, content_type='application/json'):
+        """Post a body to both apps and compare the responses."""
+        return self._assert_same_response('post', '/predictions', data=body, content_type=content_type)
+
+    def test_is_json(self):
+        """JSON media types should be recognized."""
+        self.assertTrue(is_json('application/json'))
+        self.assertTrue(is_json('application/json; charset=utf-8'))
+        self.assertTrue(is_json('application/vnd.api+json'))
+        self.assertFalse(is_json('text/plain'))
+        self.assertFalse(is_json(''))
+
+    def test_predictions(self):
+        """Successful predictions should match."""
+        response = self._post(json.dumps([[1, 2], [3, 4.5]]))
+        self.assertEqual(json.loads(response.get_data()), [3, 7.5])
+
+    def test_errors(self):
+        """Error responses from every pipeline stage should match."""
+        self.assertEqual(self._post(json.dumps([1, 2])).status_code, 400)  # validation
+        self.assertEqual(self._post(json.dumps([[1, 2], [3]])).status_code, 400)  # preprocessing
+        self.assertEqual(self._post(json.dumps([[float('nan'), 2]])).status_code, 500)  # prediction
+        self.assertEqual(self._post(json.dumps([[-1, -2]])).status_code, 500)  # postprocessing
+
+    def test_unloadable_requests(self):
+        """Requests Flask can't load should fall back to Flask's own errors."""
+        self._post('{not json')
+        self._post('null')
+        self._post('')
+        self._post(json.dumps([[1, 2]]), content_type='text/plain')
+        self._assert_same_response('post', '/predictions')
+
+    def test_chunked_body(self):
+        """Bodies without a Content-Length should be left for Flask to read."""
+        for client in (self.flask_client, self.fast_client):
+            response = client.post(
+                '/predictions', input_stream=BytesIO(json.dumps([[1, 2]]).encode('utf-8')),
+                content_type='application/json', headers={'Transfer-Encoding': 'chunked'},
+                environ_overrides={'CONTENT_LENGTH': '', 'wsgi.input_terminated': True})
+            self.assertEqual(json.loads(response.get_data()), [3])
+
+    def test_request_context(self):
+        """Callbacks and error responses should run in a request context, as in the Flask app."""
+        from flask import request
+        headers = []
+
+        def validator(data):
+            headers.append(request.headers.get('X-Request-Id'))
+            return (data.ndim == 2, 'Data should have two dimensions.')
+
+        server = ModelServer(self.model, self.model.predict, validator)
+        client = Client(FastPredictions(server), Response)
+        response = client.post('/predictions', data=json.dumps([1, 2]), content_type='application/json',
+                               headers={'X-Request-Id': 'a'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(headers, ['a'])
+
+    def test_other_endpoints(self):
+        """Other endpoints, methods and 404s should be served by Flask."""
+        self._assert_same_response('get', '/info/model')
+        self._assert_same_response('get', '/predictions')
+        self._assert_same_response('get', '/fake-endpoint')
+
+    def test_shadow(self):
+        """Shadow mirroring should work from the fast path."""
+        shadow = ShadowModel(self.model, self.model.predict)
+        server = ModelServer(self.model, self.model.predict, shadow=shadow, fast_path=True)
+        client = Client(server.get_wsgi_app(), Response)
+        response = client.post('/predictions', data=json.dumps([[1, 2]]), content_type='application/json')
+        self.assertEqual(json.loads(response.get_data()), [3])
+        response.close()
+        deadline = time.time() + 5
+        while shadow.stats()['counts']['completed'] < 1 and time.time() < deadline:
+            time.sleep(.01)
+        self.assertEqual(shadow.stats()['agreement'], 1.)
+
+
+if __name__ == '__main__':
+    unittest.main()
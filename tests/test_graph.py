@@ -0,0 +1,130 @@
+"""Test parallel execution of pipeline graphs."""
+from timeit import default_timer as timer
+import json
+import time
+import unittest
+import numpy as np
+
+from serveit.graph import PipelineGraph
+from serveit.server import ModelServer
+
+
+def slow(fn, seconds=.2):
+    """Return a function that sleeps before applying `fn`, releasing the GIL like compiled models."""
+    def node(*args):
+        time.sleep(seconds)
+        return fn(*args)
+    return node
+
+
+class PipelineGraphTest(unittest.TestCase):
+    """Test PipelineGraph."""
+
+    def setUp(self):
+        """Build a feature extractor feeding two heads."""
+        self.graph = PipelineGraph(max_workers=4)
+        self.graph.add('features', lambda data: np.asarray(data) * 2)
+        self.graph.add('total', lambda features: features.sum(axis=1), inputs=['features'])
+        self.graph.add('largest', lambda features: features.max(axis=1), inputs=['features'])
+        self.data = np.array([[1., 2.], [3., 4.]])
+
+    def test_outputs(self):
+        """Sink nodes should be returned by default, or the requested outputs."""
+        outputs = self.graph(self.data)
+        self.assertEqual(sorted(outputs), ['largest', 'total'])
+        np.testing.assert_array_equal(outputs['total'], [6, 14])
+        np.testing.assert_array_equal(outputs['largest'], [4, 8])
+
+        self.graph.outputs = 'total'
+        np.testing.assert_array_equal(self.graph(self.data), [6, 14])
+        self.graph.outputs = ['features']
+        self.assertEqual(list(self.graph(self.data)), ['features'])
+
+    def test_graph_input_and_node_inputs(self):
+        """Nodes taking both the graph input and other nodes' outputs should run once those are done."""
+        self.graph.add('residual', lambda data, total: total - np.asarray(data).sum(axis=1),
+                       inputs=['input', 'total'])
+        np.testing.assert_array_equal(self.graph.run(self.data, outputs=['residual'])['residual'], [3, 7])
+        self.graph.outputs = 'residual'
+        np.testing.assert_array_equal(self.graph(self.data), [3, 7])
+
+    def test_unused_nodes_skipped(self):
+        """Only the nodes needed for the outputs should run."""
+        calls = []
+        self.graph.add('unused', lambda features: calls.append(features), inputs=['features'])
+        self.graph.run(self.data, outputs=['total'])
+        self.assertEqual(calls, [])
+        self.assertEqual(self.graph.stats()['nodes']['largest']['count'], 0)
+
+    def test_parallel(self):
+        """Independent nodes should run concurrently."""
+        graph = PipelineGraph(max_workers=4)
+        graph.add('a', slow(lambda data: data + 1))
+        graph.add('b', slow(lambda data: data + 2))
+        graph.add('c', slow(lambda data: data + 3))
+        graph.add('sum', lambda a, b, c: a + b + c, inputs=['a', 'b', 'c'])
+        start = timer()
+        self.assertEqual(graph(1), 9)
+        self.assertLess(timer() - start, .5)
+
+    def test_shared_arrays(self):
+        """Arrays consumed by several nodes should be passed as read-only views without copying."""
+        seen = []
+        graph = PipelineGraph()
+        graph.add('features', lambda data: data * 2)
+        graph.add('a', lambda features: seen.append(features) or 1, inputs=['features'])
+        graph.add('b', lambda features: seen.append(features) or 2, inputs=['features'])
+
+        graph(self.data)
+        self.assertEqual(len(seen), 2)
+        self.assertIs(seen[0].base, seen[1].base)
+        for features in seen:
+            self.assertFalse(features.flags.writeable)
+            with self.assertRaises(ValueError):
+                features[0, 0] = 0
+
+        # a single consumer gets the array itself
+        graph = PipelineGraph(outputs='double')
+        graph.add('double', lambda data: data * 2)
+        graph.add('in_place', lambda double: double.__imul__(2), inputs=['double'])
+        self.assertTrue(graph(self.data).flags.writeable)
+
+    def test_invalid_graphs(self):
+        """Unknown inputs and duplicate names should be rejected."""
+        with self.assertRaises(ValueError):
+            self.graph.add('head', lambda x: x, inputs=['missing'])
+        with self.assertRaises(ValueError):
+            self.graph.add('features', lambda x: x)
+        with self.assertRaises(ValueError):
+            self.graph.run(self.data, outputs=['missing'])
+
+    def test_errors(self):
+        """A failing node's exception should be raised."""
+        self.graph.add('broken', lambda total: 1 / 0, inputs=['total'])
+        with self.assertRaises(ZeroDivisionError):
+            self.graph(self.data)
+
+    def test_stats(self):
+        """Per-node and total timings should be reported."""
+        self.graph(self.data)
+        self.graph(self.data)
+        stats = self.graph.stats()
+        self.assertEqual(stats['total']['count'], 2)
+        self.assertEqual(stats['nodes']['features']['count'], 2)
+        self.assertEqual(stats['nodes']['total']['inputs'], ['features'])
+        self.assertGreaterEqual(stats['total']['p99_ms'], stats['nodes']['features']['p99_ms'])
+
+    def test_server(self):
+        """A graph should serve predictions in place of a predict function."""
+        server = ModelServer(self.graph, self.graph)
+        server.create_info_endpoint('graph', self.graph.stats)
+        client = server.app.test_client()
+        response = client.post('/predictions', data=json.dumps(self.data.tolist()), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.get_data()), dict(total=[6, 14], largest=[4, 8]))
+        response = client.get('/info/graph')
+        self.assertEqual(json.loads(response.get_data())['total']['count'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
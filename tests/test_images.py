@@ -0,0 +1,160 @@
+"""Test batch predictions for many images per request."""
+from io import BytesIO
+import json
+import time
+import unittest
+import numpy as np
+from PIL import Image
+
+from serveit.images import LENGTH_PREFIX, LENGTH_PREFIXED_CONTENT_TYPE, ImageBatchPredictions, iter_length_prefixed
+from serveit.monitoring import FeatureMonitor
+from serveit.server import ModelServer
+from serveit.shadow import ShadowModel
+from serveit.tracing import Tracer
+from serveit.utils import get_bytes_to_image_callback
+
+
+def encode_image(color, size=(40, 30), format='PNG'):
+    """Encode a solid color image."""
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def length_prefixed(images):
+    """Encode images as a length-prefixed body."""
+    return b''.join(LENGTH_PREFIX.pack(len(image)) + image for image in images)
+
+
+class BrightnessModel(object):
+    """Model that predicts the mean pixel intensity of each image."""
+
+    def __init__(self):
+        """Initialize model."""
+        self.batch_shapes = []
+
+    def predict(self, data):
+        """Average each image, recording the batch shape."""
+        self.batch_shapes.append(data.shape)
+        return data.reshape(len(data), -1).mean(axis=1)
+
+
+class ImageBatchTest(unittest.TestCase):
+    """Test image batch predictions."""
+
+    def setUp(self):
+        """Unittest set up."""
+        self.model = BrightnessModel()
+        self.server = ModelServer(self.model, self.model.predict)
+        self.server.create_image_batch_endpoint(image_dims=(16, 8), max_images=4)
+        self.client = self.server.app.test_client()
+        self.images = [encode_image((10, 10, 10)), encode_image((200, 200, 200), format='JPEG'), encode_image('white')]
+
+    def _post(self, body, content_type=LENGTH_PREFIXED_CONTENT_TYPE):
+        """Post a body to the image batch endpoint."""
+        response = self.client.post('/predictions/images', data=body, content_type=content_type)
+        return response.status_code, json.loads(response.get_data())
+
+    def test_same_decoding(self):
+        """Batch images should be decoded exactly as single images are."""
+        buffer = BytesIO()
+        pixels = np.random.RandomState(0).randint(0, 256, (300, 400, 3)).astype(np.uint8)
+        Image.fromarray(pixels).save(buffer, format='JPEG')
+        jpeg = buffer.getvalue()
+        images = ImageBatchPredictions(self.server, image_dims=(16, 8))
+        _, batch, _ = images.decode([('a', jpeg), ('b', encode_image((1, 2, 3), format='BMP'))])
+        np.testing.assert_array_equal(batch[0], get_bytes_to_image_callback((16, 8))(jpeg)[0])
+        np.testing.assert_array_equal(batch[1, 0, 0], [1, 2, 3])
+
+    def test_decode_batch(self):
+        """Decoded images should be written into a single batch, in request order."""
+        images = ImageBatchPredictions(self.server, image_dims=(16, 8), dtype=np.float64, max_workers=2)
+        names, batch, errors = images.decode(
+            [('a', self.images[0]), ('b', b'garbage'), ('c', self.images[2])])
+        self.assertEqual(names, ['a', 'b', 'c'])
+        self.assertEqual((batch.shape, batch.dtype), ((2, 8, 16, 3), np.float64))
+        self.assertTrue(batch.flags.c_contiguous and batch.flags.owndata)
+        np.testing.assert_array_equal(batch[:, 0, 0, 0], [10, 255])
+        self.assertEqual([type(error).__name__ if error else None for error in errors], [None, 'ValueError', None])
+
+    def test_iter_length_prefixed(self):
+        """Length-prefixed bodies should be split into images, and truncated bodies rejected."""
+        body = length_prefixed([b'abc', b'', b'defg'])
+        self.assertEqual(list(iter_length_prefixed(BytesIO(body))), [('0', b'abc'), ('1', b''), ('2', b'defg')])
+        self.assertEqual(list(iter_length_prefixed(BytesIO(b''))), [])
+        with self.assertRaises(ValueError):
+            list(iter_length_prefixed(BytesIO(body[:-1])))
+        with self.assertRaises(ValueError):
+            list(iter_length_prefixed(BytesIO(body[:2])))
+
+    def test_length_prefixed(self):
+        """Length-prefixed images should be predicted in one batch, in order."""
+        status, results = self._post(length_prefixed(self.images))
+        self.assertEqual(status, 200)
+        self.assertEqual([result['name'] for result in results], ['0', '1', '2'])
+        predictions = [result['prediction'] for result in results]
+        self.assertAlmostEqual(predictions[0], 10)
+        self.assertAlmostEqual(predictions[1], 200, delta=2)  # JPEG compression
+        self.assertAlmostEqual(predictions[2], 255)
+        self.assertEqual(self.model.batch_shapes, [(3, 8, 16, 3)])
+
+    def test_multipart(self):
+        """Multipart images should be named by their file names."""
+        data = {'images': [(BytesIO(image), 'image{}.png'.format(i)) for i, image in enumerate(self.images)]}
+        response = self.client.post('/predictions/images', data=data, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.get_data())
+        self.assertEqual([result['name'] for result in results], ['image0.png', 'image1.png', 'image2.png'])
+        self.assertAlmostEqual(results[2]['prediction'], 255)
+        self.assertEqual(self.model.batch_shapes, [(3, 8, 16, 3)])
+
+    def test_per_image_errors(self):
+        """Images that can't be decoded should get errors without failing the others."""
+        status, results = self._post(length_prefixed([self.images[0], b'garbage', self.images[2]]))
+        self.assertEqual(status, 200)
+        self.assertAlmostEqual(results[0]['prediction'], 10)
+        self.assertEqual(results[1]['error']['message'], 'Could not decode image')
+        self.assertEqual(results[1]['error']['details']['exception_type'], 'ValueError')
+        self.assertAlmostEqual(results[2]['prediction'], 255)
+        self.assertEqual(self.model.batch_shapes, [(2, 8, 16, 3)])
+
+        status, results = self._post(length_prefixed([b'garbage']))
+        self.assertEqual(status, 200)
+        self.assertIn('error', results[0])
+        self.assertEqual(len(self.model.batch_shapes), 1)
+
+    def test_server_hooks(self):
+        """Batches should be monitored, traced and mirrored to the shadow model like other predictions."""
+        tracer = Tracer(sample_rate=1.)
+        monitor = FeatureMonitor()
+        shadow = ShadowModel(self.model, self.model.predict)
+        server = ModelServer(self.model, self.model.predict, tracer=tracer, monitor=monitor, shadow=shadow)
+        server.create_image_batch_endpoint(image_dims=(2, 2))
+        response = server.app.test_client().post(
+            '/predictions/images', data=length_prefixed(self.images), content_type=LENGTH_PREFIXED_CONTENT_TYPE)
+        response.close()  # mirrored once the response is sent
+        self.assertEqual(response.status_code, 200)
+        spans = {span['name']: span for span in tracer.drain()}
+        self.assertEqual(sorted(spans), ['POST /predictions/images', 'decode', 'postprocess', 'predict', 'validate'])
+        self.assertEqual(spans['POST /predictions/images']['attributes']['status_code'], 200)
+        self.assertEqual(monitor.skipped, 1)  # observed, but only 2D inputs are summarized
+        deadline = time.time() + 5
+        while shadow.stats()['counts']['completed'] < 1 and time.time() < deadline:
+            time.sleep(.01)
+        self.assertEqual(shadow.stats()['counts']['completed'], 1)
+
+    def test_request_errors(self):
+        """Malformed, empty, oversized and unsupported requests should be rejected."""
+        status, body = self._post(length_prefixed(self.images)[:-1])
+        self.assertEqual((status, body['message']), (400, 'Unable to fetch data'))
+        status, body = self._post(b'')
+        self.assertEqual((status, body['message']), (400, 'Request contains no images'))
+        status, body = self._post(length_prefixed(self.images * 2))
+        self.assertEqual((status, body['message']), (413, 'Too many images'))
+        status, body = self._post(length_prefixed(self.images), content_type='application/json')
+        self.assertEqual((status, body['message']), (400, 'Unable to fetch data'))
+        self.assertEqual(self.model.batch_shapes, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
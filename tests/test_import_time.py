@@ -0,0 +1,62 @@
+"""Test the import time of serveit, to catch cold start regressions."""
+import os
+import subprocess
+import sys
+import unittest
+
+# modules that must only be imported by the examples and adapters that use them
+FRAMEWORKS = ('keras', 'tensorflow', 'torch', 'torchvision', 'sklearn', 'scipy', 'pandas', 'PIL')
+
+# budgets in milliseconds: serveit's own modules, and `import serveit.server` in total
+# (dominated by Flask and NumPy; override on slow machines)
+SERVEIT_BUDGET_MS = float(os.getenv('SERVEIT_IMPORT_BUDGET_MS', 50))
+TOTAL_BUDGET_MS = float(os.getenv('SERVEIT_TOTAL_IMPORT_BUDGET_MS', 2000))
+
+
+def import_times(statement):
+    """Run a statement in a new interpreter with `-X importtime`; return {module: (self ms, cumulative ms)}."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root, LOGLEVEL='WARNING')
+    command = [sys.executable, '-X', 'importtime', '-c', statement]
+    subprocess.check_call(command, env=env, stderr=subprocess.DEVNULL)  # write bytecode caches first
+    output = subprocess.run(command, env=env, stderr=subprocess.PIPE, check=True).stderr.decode()
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us) / 1e3, int(cumulative_us) / 1e3)
+    return times
+
+
+def report(times, n=10):
+    """Format the modules with the highest cumulative import times."""
+    slowest = sorted(times.items(), key=lambda item: -item[1][1])[:n]
+    return '\n'.join('{:>9.1f} ms  {:>9.1f} ms  {}'.format(self_ms, cumulative_ms, name)
+                     for name, (self_ms, cumulative_ms) in slowest)
+
+
+class ImportTimeTest(unittest.TestCase):
+    """Test that importing serveit is fast and doesn't import ML frameworks."""
+
+    def test_server(self):
+        """`import serveit.server` should stay within its budgets."""
+        times = import_times('import serveit.server')
+        total = times['serveit.server'][1]
+        own = sum(self_ms for name, (self_ms, _) in times.items() if name.split('.')[0] == 'serveit')
+        message = 'import serveit.server: {:.1f} ms ({:.1f} ms in serveit); slowest:\n{}'.format(
+            total, own, report(times))
+        self.assertLess(own, SERVEIT_BUDGET_MS, message)
+        self.assertLess(total, TOTAL_BUDGET_MS, message)
+
+    def test_lazy_frameworks(self):
+        """Core modules and the adapters package should not import ML frameworks."""
+        for statement in ('import serveit.server',
+                          'import serveit.utils',
+                          'from serveit.adapters import LinearModelAdapter'):
+            imported = sorted({name.split('.')[0] for name in import_times(statement)} & set(FRAMEWORKS))
+            self.assertEqual(imported, [], '{!r} imported {}'.format(statement, ', '.join(imported)))
+
+
+if __name__ == '__main__':
+    unittest.main()
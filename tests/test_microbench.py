@@ -0,0 +1,61 @@
+"""Test the microbenchmark suite's baselines and regression thresholds."""
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks import microbench
+
+
+class MicrobenchTest(unittest.TestCase):
+    """Test comparing stage timings with baselines."""
+
+    def setUp(self):
+        """Unittest set up."""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'baselines', 'microbench.json')
+
+    def test_compare(self):
+        """Stages slower than their baselines by more than the threshold should regress."""
+        rows = microbench.compare(dict(a=130., b=120., c=50., d=10.), dict(a=100., b=100., c=100.), threshold=.25)
+        self.assertEqual([(row[0], row[4]) for row in rows], [('a', 'regressed'), ('b', 'ok'), ('c', 'ok'), ('d', 'new')])
+        self.assertAlmostEqual(rows[0][3], .3)
+        self.assertEqual(microbench.compare(dict(a=130.), dict(a=100.), threshold=.5)[0][4], 'ok')
+
+    def test_baseline_files(self):
+        """Baselines should be saved with their environment, and updated per stage."""
+        self.assertIsNone(microbench.load_baseline(self.path))
+        microbench.save_baseline(self.path, dict(a=1.))
+        baseline = microbench.load_baseline(self.path)
+        self.assertEqual(baseline['stages_us'], dict(a=1.))
+        self.assertEqual(baseline['environment'], microbench.environment())
+
+        self.assertEqual(microbench.main(['--baseline', self.path, '--update', '--stage', 'make_serializable',
+                                          '--repeat', '1']), 0)
+        stages = microbench.load_baseline(self.path)['stages_us']
+        self.assertEqual(sorted(stages), ['a', 'make_serializable'])
+        self.assertGreater(stages['make_serializable'], 0)
+
+    def test_regression(self):
+        """The suite should fail when a stage regresses beyond the threshold."""
+        args = ['--baseline', self.path, '--stage', 'make_serializable', '--repeat', '1', '--retries', '0']
+        microbench.save_baseline(self.path, dict(make_serializable=1e9))
+        self.assertEqual(microbench.main(args), 0)
+        microbench.save_baseline(self.path, dict(make_serializable=1e-3))
+        self.assertEqual(microbench.main(args), 1)
+        self.assertEqual(microbench.main(args + ['--threshold', '1e9']), 0)
+
+    def test_no_baseline(self):
+        """Without a baseline, every stage should be new and the suite should pass."""
+        self.assertEqual(microbench.main(['--baseline', self.path, '--stage', 'make_serializable', '--repeat', '1']), 0)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_stages(self):
+        """Every stage should run."""
+        for stage in microbench.STAGES.values():
+            stage()()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+"""Test input feature statistics and drift monitoring."""
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import unittest
+import numpy as np
+
+from serveit.monitoring import FeatureMonitor, FeatureStats, ReferenceProfile, population_stability_index
+from serveit.server import ModelServer
+
+
+def observe_in_child(monitor, data):
+    """Observe data in a forked worker, and share its statistics."""
+    monitor.observe(data)
+    monitor.share()
+
+
+class FeatureMonitorTest(unittest.TestCase):
+    """Test FeatureStats, ReferenceProfile and FeatureMonitor."""
+
+    def setUp(self):
+        """Unittest set up."""
+        self.random = np.random.RandomState(0)
+        self.train = self.random.normal(size=(5000, 3)) * [1, 2, 3] + [0, 10, -5]
+        self.reference = ReferenceProfile.from_data(self.train, feature_names=['a', 'b', 'c'])
+
+    def test_stats(self):
+        """Block updates and merges should match statistics of all the data, ignoring NaNs."""
+        data = self.random.rand(1000, 3)
+        data[::7, 1] = np.nan
+        stats = FeatureStats(3, self.reference.edges)
+        for block in np.array_split(data[:600], 4):
+            stats.update(block)
+        other = FeatureStats(3, self.reference.edges)
+        other.update(data[600:])
+        stats.merge(other)
+        np.testing.assert_array_equal(stats.count, [1000, 1000 - 143, 1000])
+        np.testing.assert_array_equal(stats.missing, [0, 143, 0])
+        np.testing.assert_allclose(stats.mean, np.nanmean(data, axis=0))
+        np.testing.assert_allclose(stats.m2 / stats.count, np.nanvar(data, axis=0))
+        np.testing.assert_allclose(stats.min, np.nanmin(data, axis=0))
+        np.testing.assert_allclose(stats.max, np.nanmax(data, axis=0))
+        self.assertEqual([histogram.sum() for histogram in stats.histograms], [1000, 857, 1000])
+        loaded = FeatureStats.from_dict(json.loads(json.dumps(stats.to_dict())), self.reference.edges)
+        np.testing.assert_array_equal(loaded.histograms[1], stats.histograms[1])
+
+    def test_reference_profile(self):
+        """Profiles should bin training data at its quantiles, and round trip through files."""
+        self.assertEqual(len(self.reference.edges[0]), 19)
+        np.testing.assert_allclose(self.reference.proportions[0], .05, atol=.005)
+        np.testing.assert_allclose(self.reference.mean, self.train.mean(axis=0))
+        path = tempfile.mktemp(suffix='.json')
+        self.addCleanup(os.remove, path)
+        self.reference.save(path)
+        loaded = ReferenceProfile.load(path)
+        self.assertEqual(loaded.feature_names, ['a', 'b', 'c'])
+        np.testing.assert_array_equal(loaded.edges[2], self.reference.edges[2])
+
+    def test_psi(self):
+        """PSI should be zero for equal distributions and grow with the difference."""
+        self.assertAlmostEqual(population_stability_index([.5, .5], [.5, .5]), 0)
+        self.assertGreater(population_stability_index([.5, .5], [.9, .1]),
+                           population_stability_index([.5, .5], [.6, .4]))
+
+    def test_drift(self):
+        """Shifted features should be reported as drifted."""
+        monitor = FeatureMonitor(self.reference, block_size=256)
+        live = self.random.normal(size=(2000, 3)) * [1, 2, 3] + [0, 10, -5]
+        live[:, 2] += 6  # two standard deviations
+        for batch in np.array_split(live, 300):
+            monitor.observe(batch)
+        report = monitor.report()
+        self.assertEqual(report['count'], 2000)
+        self.assertEqual(report['drifted'], ['c'])
+        a = report['features'][0]
+        self.assertLess(a['psi'], .05)
+        self.assertAlmostEqual(a['quantiles']['p50'], 0, delta=.1)
+        self.assertAlmostEqual(a['quantiles']['p95'], 1.645, delta=.15)
+        self.assertAlmostEqual(report['features'][1]['std'], 2, delta=.1)
+        self.assertGreater(report['features'][2]['psi'], 1)
+
+    def test_constant_reference_feature(self):
+        """Shifts of a feature that was constant in training should be reported as drift, in valid JSON."""
+        train = self.train.copy()
+        train[:, 0] = 1
+        monitor = FeatureMonitor(ReferenceProfile.from_data(train), block_size=16)
+        monitor.observe(train[:100] + [1, 0, 0])
+        report = json.loads(json.dumps(monitor.report(), allow_nan=False))
+        self.assertIsNone(report['features'][0]['mean_shift'])
+        self.assertIn('0', report['drifted'])
+        self.assertLess(report['features'][1]['mean_shift'], 1)
+
+    def test_skipped(self):
+        """Inputs that can't be monitored should be counted and ignored."""
+        monitor = FeatureMonitor(self.reference)
+        monitor.observe(np.ones((2, 4)))
+        monitor.observe(np.array([['a', 'b', 'c']]))
+        monitor.observe(np.ones(3))
+        report = monitor.report()
+        self.assertEqual((report['count'], report['skipped']), (0, 3))
+
+        # without a reference, moments are tracked for any number of features
+        monitor = FeatureMonitor()
+        self.assertEqual(monitor.report()['features'], [])
+        monitor.observe(np.array([[1, 2], [3, 4]]))
+        report = monitor.report()
+        self.assertEqual([feature['mean'] for feature in report['features']], [2, 3])
+        self.assertNotIn('psi', report['features'][0])
+
+    def test_observe_allocation_free(self):
+        """Observing batches between block updates shouldn't allocate memory."""
+        monitor = FeatureMonitor(self.reference, block_size=4096)
+        batch = self.train[:16]
+        monitor.observe(batch)  # allocate the block
+        tracemalloc.start()
+        try:
+            for _ in range(100):
+                monitor.observe(batch)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 4096)
+
+    def test_shared_workers(self):
+        """Reports should merge statistics from all workers sharing a directory."""
+        shared_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, shared_dir)
+        monitor = FeatureMonitor(self.reference, shared_dir=shared_dir, share_interval=3600)
+        monitor.observe(self.train[:100])
+        context = multiprocessing.get_context('fork')
+        for data in (self.train[100:300], self.train[300:600]):
+            worker = context.Process(target=observe_in_child, args=(monitor, data))
+            worker.start()
+            worker.join()
+        report = monitor.report()
+        self.assertEqual(report['count'], 600)
+        self.assertAlmostEqual(report['features'][1]['mean'], self.train[:600, 1].mean())
+
+        # workers that stopped sharing their statistics are dropped
+        path = os.path.join(shared_dir, [
+            name for name in os.listdir(shared_dir) if name != 'worker-{}.json'.format(os.getpid())][0])
+        with open(path) as f:
+            count = FeatureStats.from_dict(json.load(f), self.reference.edges).count[0]
+        stale = time.time() - 120
+        os.utime(path, (stale, stale))
+        self.assertEqual(monitor.report()['count'], 600 - count)
+        self.assertFalse(os.path.exists(path))
+
+    def test_sharing_off_request_path(self):
+        """Statistics should be written to the shared directory by a background thread, not by observe."""
+        shared_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, shared_dir)
+        monitor = FeatureMonitor(self.reference, block_size=10, shared_dir=shared_dir, share_interval=.05)
+        self.addCleanup(setattr, monitor, '_pid', None)  # stop sharing before the directory is removed
+        monitor.observe(self.train[:100])
+        path = os.path.join(shared_dir, 'worker-{}.json'.format(os.getpid()))
+        self.assertFalse(os.path.exists(path))
+        deadline = time.time() + 5
+        while not os.path.exists(path) and time.time() < deadline:
+            time.sleep(.01)
+        with open(path) as f:
+            self.assertEqual(FeatureStats.from_dict(json.load(f), self.reference.edges).count.tolist(), [100] * 3)
+
+    def test_server(self):
+        """Validated inputs should be monitored and reported at /info/drift."""
+        monitor = FeatureMonitor(self.reference)
+        server = ModelServer(monitor, lambda data: data.sum(axis=1), monitor=monitor,
+                             input_validation=lambda data: (data.ndim == 2, 'Data should have two dimensions.'))
+        client = server.app.test_client()
+        for data in ([[1, 2, 3], [4, 5, 6]], [1, 2, 3]):
+            client.post('/predictions', data=json.dumps(data), content_type='application/json')
+        report = json.loads(client.get('/info/drift').get_data())
+        self.assertEqual(report['count'], 2)
+        self.assertEqual(report['features'][0]['mean'], 2.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+"""Test routing requests across ModelServer backends."""
+from io import BytesIO
+from threading import Thread
+import json
+import time
+import unittest
+import numpy as np
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from serveit.router import Router, header_key, body_key
+from serveit.server import ModelServer
+
+
+class SumModel(object):
+    """Model that predicts the row sums of its input."""
+
+    def __init__(self, name):
+        """Initialize model."""
+        self.name = name
+
+    @staticmethod
+    def predict(data):
+        """Sum rows."""
+        return np.asarray(data).sum(axis=1)
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """HTTP/1.1 request handler serving a WSGI app over keep-alive connections.
+
+    Werkzeug's development server always closes connections after a response.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def _handle(self):
+        """Run the request through the server's WSGI app and send the response."""
+        if self.server.stopped:
+            # drop open connections, like a server that has gone down
+            self.close_connection = True
+            return
+        self.server.requests += 1
+        time.sleep(self.server.delay)
+        length = int(self.headers.get('Content-Length') or 0)
+        response = self.server.client.open(
+            self.path, method=self.command, data=self.rfile.read(length), headers=list(self.headers.items()))
+        body = response.get_data()
+        self.send_response(response.status_code)
+        for name, value in response.headers.items():
+            if name.lower() != 'content-length':
+                self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = _handle
+
+    def log_message(self, *args):
+        """Don't log requests."""
+
+
+class RouterTest(unittest.TestCase):
+    """Test Router with several local servers on different ports."""
+
+    def setUp(self):
+        """Start three backend servers."""
+        self.backends = []
+        for i in range(3):
+            model = SumModel('backend-{}'.format(i))
+            server = ModelServer(model, model.predict)
+            http_server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+            http_server.client = Client(server.app, Response)
+            http_server.stopped = False
+            http_server.requests = 0
+            http_server.delay = 0
+            http_server.block_on_close = False  # don't wait for idle keep-alive connections on close
+            thread = Thread(target=http_server.serve_forever, args=(.05,))
+            thread.daemon = True
+            thread.start()
+            self.backends.append(http_server)
+        self.addresses = ['127.0.0.1:{}'.format(server.server_port) for server in self.backends]
+
+    def tearDown(self):
+        """Stop backend servers."""
+        for server in self.backends:
+            self._stop(server)
+
+    @staticmethod
+    def _stop(server):
+        """Stop a backend server and close its socket."""
+        server.stopped = True
+        server.shutdown()
+        server.server_close()
+
+    def _client(self, **kwargs):
+        """Return a test client for a router over the backends."""
+        self.router = Router(self.addresses, health_interval=None, **kwargs)
+        self.addCleanup(self.router.stop)
+        return Client(self.router, Response)
+
+    def _predict(self, client, data, **kwargs):
+        """Post data to the router and return the response."""
+        return client.post('/predictions', data=json.dumps(data), content_type='application/json', **kwargs)
+
+    def _backend_name(self, client, **kwargs):
+        """Return the name of the model serving a request."""
+        response = client.get('/info/model', **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.get_data())['name']
+
+    def test_predictions(self):
+        """Requests should be forwarded, and responses relayed."""
+        client = self._client()
+        response = self._predict(client, [[1, 2], [3, 4]])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.get_data()), [3, 7])
+        response = self._predict(client, [1, 2])
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(json.loads(response.get_data())['message'], 'Unable to make prediction')
+        self.assertEqual(client.get('/fake-endpoint').status_code, 404)
+
+    def test_least_outstanding_requests(self):
+        """Requests should go to the backend with the fewest outstanding requests."""
+        client = self._client()
+        names = {self._backend_name(client) for _ in range(6)}
+        self.assertEqual(len(names), 3)  # idle backends take turns
+
+        busy = [self.router.choose() for _ in range(2)]
+        chosen = self.router.choose()
+        self.assertNotIn(chosen, busy)
+        self.assertEqual([backend.outstanding for backend in self.router.backends], [1, 1, 1])
+
+    def test_keep_alive(self):
+        """Connections should be reused across requests."""
+        client = self._client()
+        for _ in range(9):
+            self.assertEqual(self._predict(client, [[1, 2]]).status_code, 200)
+        stats = self.router.stats()['backends']
+        self.assertEqual(sum(backend['requests'] for backend in stats), 9)
+        self.assertEqual(sum(backend['connections'] for backend in stats), 3)
+
+    def test_health_check_ejection(self):
+        """Failed health checks should eject backends until they recover."""
+        client = self._client()
+        self._stop(self.backends.pop(0))
+        self.router.check_health()
+        self.assertEqual([backend.healthy for backend in self.router.backends], [False, True, True])
+        names = {self._backend_name(client) for _ in range(6)}
+        self.assertEqual(names, {'backend-1', 'backend-2'})
+        stats = json.loads(client.get('/info/router').get_data())
+        self.assertEqual(stats['backends'][0]['ejections'], 1)
+        self.assertEqual(stats['backends'][0]['requests'], 0)
+
+        # recover once health checks pass again
+        self.router.backends[0].port = self.backends[0].server_port
+        self.router.check_health()
+        self.assertTrue(all(backend.healthy for backend in self.router.backends))
+
+    def test_connection_error_retry(self):
+        """Requests to an unreachable backend should be retried on another, and the backend ejected."""
+        client = self._client()
+        self._stop(self.backends.pop(1))
+        for _ in range(6):
+            response = self._predict(client, [[1, 2]])
+            self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.router.backends[1].healthy)
+
+        for backend in self.backends:
+            self._stop(backend)
+        self.backends = []
+        response = self._predict(client, [[1, 2]])
+        self.assertEqual(response.status_code, 503)
+
+    def test_timeout(self):
+        """Requests timing out should get 504 responses, without being replayed or ejecting the backend."""
+        client = self._client(timeout=.1)
+        for server in self.backends:
+            server.delay = .5
+        response = self._predict(client, [[1, 2]])
+        self.assertEqual(response.status_code, 504)
+        time.sleep(.6)
+        self.assertEqual(sum(server.requests for server in self.backends), 1)
+        self.assertTrue(all(backend.healthy for backend in self.router.backends))
+        self.assertEqual(sum(backend['errors'] for backend in self.router.stats()['backends']), 1)
+
+    def test_failure_after_sending(self):
+        """Requests failing after they were sent should get 502 responses, without being replayed."""
+        self.addresses = self.addresses[:1]
+        client = self._client()
+        self.backends[0].stopped = True  # closes connections without responding, but still accepts them
+        response = self._predict(client, [[1, 2]])
+        self.assertEqual(response.status_code, 502)
+        stats = self.router.stats()['backends'][0]
+        self.assertEqual((stats['healthy'], stats['errors'], stats['connections']), (False, 1, 1))
+
+    def test_chunked_body(self):
+        """Chunked bodies should be forwarded once decoded by the server, and otherwise rejected."""
+        client = self._client()
+        for environ, status in (({'wsgi.input_terminated': True}, 200), ({}, 411)):
+            response = client.post(
+                '/predictions', input_stream=BytesIO(json.dumps([[1, 2]]).encode('utf-8')),
+                content_type='application/json', headers={'Transfer-Encoding': 'chunked'},
+                environ_overrides=dict(environ, CONTENT_LENGTH=''))
+            self.assertEqual(response.status_code, status)
+            if status == 200:
+                self.assertEqual(json.loads(response.get_data()), [3])
+
+    def test_unexpected_error(self):
+        """Backends should be released when a request fails with any other error."""
+        client = self._client()
+
+        def request(*args, **kwargs):
+            raise RuntimeError('Unexpected failure')
+        for backend in self.router.backends:
+            backend.request = request
+        for _ in range(3):
+            with self.assertRaises(RuntimeError):
+                self._predict(client, [[1, 2]])
+        stats = self.router.stats()['backends']
+        self.assertEqual([backend['outstanding'] for backend in stats], [0, 0, 0])
+        self.assertEqual(sum(backend['errors'] for backend in stats), 3)
+
+    def test_consistent_hashing(self):
+        """Requests with the same key should go to the same backend."""
+        client = self._client(hash_key=header_key())
+        owners = {}
+        for key in range(30):
+            headers = {'X-Routing-Key': str(key)}
+            owners[key] = self._backend_name(client, headers=headers)
+            self.assertEqual(self._backend_name(client, headers=headers), owners[key])
+        self.assertEqual(len(set(owners.values())), 3)
+
+        # ejecting a backend only moves its own keys
+        self.router._set_health(self.router.backends[0], False)
+        for key, owner in owners.items():
+            name = self._backend_name(client, headers={'X-Routing-Key': str(key)})
+            if owner == 'backend-0':
+                self.assertNotEqual(name, owner)
+            else:
+                self.assertEqual(name, owner)
+
+    def test_body_key(self):
+        """Identical request bodies should go to the same backend."""
+        self._client(hash_key=body_key)
+        first = self.router.choose(body_key({}, b'[[1, 2]]'))
+        self.assertIs(self.router.choose(body_key({}, b'[[1, 2]]')), first)
+        self.assertEqual(first.outstanding, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+"""Test priority classes and weighted fair scheduling."""
+from threading import Barrier, Event, Thread
+import json
+import time
+import unittest
+import numpy as np
+from flask import Flask
+
+from serveit.scheduling import PriorityScheduler
+from serveit.server import ModelServer
+
+INTERACTIVE, BULK = 2, 1  # markers in the first column of inputs
+
+
+class RecordingModel(object):
+    """Model that predicts the row sums of its input and records the marker of each call."""
+
+    def __init__(self):
+        """Initialize model."""
+        self.calls = []
+        self.gate = Event()
+        self.gate.set()
+        self.blocked = Event()
+
+    def predict(self, data):
+        """Sum rows, waiting at the gate."""
+        self.calls.append((int(data[0, 0]) if len(data) else None, len(data)))
+        self.blocked.set()
+        self.gate.wait()
+        return data.sum(axis=1)
+
+
+class PrioritySchedulerTest(unittest.TestCase):
+    """Test PriorityScheduler."""
+
+    def setUp(self):
+        """Unittest set up."""
+        self.model = RecordingModel()
+        self.scheduler = PriorityScheduler(
+            self.model.predict, classes={'interactive': 4, 'bulk': 1}, max_interactive_rows=5, slice_size=10)
+
+    def _submit(self, data, results):
+        """Predict in a thread, storing the predictions."""
+        thread = Thread(target=lambda: results.append(self.scheduler(data)))
+        thread.start()
+        return thread
+
+    def _wait_for_queue(self, n_slices):
+        """Wait until `n_slices` slices are queued."""
+        deadline = time.time() + 5
+        while sum(stats['queued_slices'] for stats in self.scheduler.stats().values()) < n_slices:
+            self.assertLess(time.time(), deadline)
+            time.sleep(.005)
+
+    def test_slices(self):
+        """Large requests should be predicted in slices and joined in order."""
+        data = np.random.rand(25, 3)
+        np.testing.assert_allclose(self.scheduler(data), data.sum(axis=1))
+        self.assertEqual([n for _, n in self.model.calls], [10, 10, 5])
+        self.assertEqual(len(self.scheduler(data[:0])), 0)
+
+    def test_list_predictions(self):
+        """Slices of non-array predictions should be joined into a list."""
+        scheduler = PriorityScheduler(lambda data: data.sum(axis=1).tolist(), slice_size=10)
+        data = np.ones((15, 2))
+        self.assertEqual(scheduler(data), [2.] * 15)
+
+    def test_fair_queuing(self):
+        """Interactive requests should interleave with the slices of a bulk request."""
+        bulk = np.full((50, 2), BULK, dtype=float)
+        interactive = np.full((1, 2), INTERACTIVE, dtype=float)
+        results = []
+        self.model.gate.clear()
+        threads = [self._submit(bulk, results)]
+        self.assertTrue(self.model.blocked.wait(5))  # first bulk slice in service
+        self._wait_for_queue(4)
+        threads.extend(self._submit(interactive, results) for _ in range(3))
+        self._wait_for_queue(7)
+        self.model.gate.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual([marker for marker, _ in self.model.calls], [BULK] + [INTERACTIVE] * 3 + [BULK] * 4)
+        self.assertEqual(len(results), 4)
+
+    def test_weights(self):
+        """Backlogged classes should share rows by weight."""
+        bulk = np.full((40, 2), BULK, dtype=float)  # 4 slices of 10 rows
+        interactive = np.full((40, 2), INTERACTIVE, dtype=float)
+        results = []
+        self.model.gate.clear()
+        blocker = self._submit(np.full((1, 2), BULK, dtype=float), results)
+        self.assertTrue(self.model.blocked.wait(5))
+        # both requests are larger than `max_interactive_rows`, so they're classified by header
+        app = Flask(__name__)
+
+        def submit(data, priority):
+            def predict():
+                with app.test_request_context(headers={'X-Priority': priority}):
+                    results.append(self.scheduler(data))
+            thread = Thread(target=predict)
+            thread.start()
+            return thread
+
+        threads = [submit(bulk, 'bulk')]
+        self._wait_for_queue(4)
+        threads.append(submit(interactive, 'interactive'))
+        self._wait_for_queue(8)
+        self.model.gate.set()
+        for thread in [blocker] + threads:
+            thread.join(5)
+        # interactive slices cost 10 / 4 each, bulk slices 10 / 1
+        self.assertEqual([marker for marker, _ in self.model.calls[1:]], [INTERACTIVE] * 4 + [BULK] * 4)
+
+    def test_classify(self):
+        """Requests should be classified by a valid header, and otherwise by size."""
+        app = Flask(__name__)
+        small, large = np.ones((5, 2)), np.ones((6, 2))
+        self.assertEqual(self.scheduler.classify(small), 'interactive')
+        self.assertEqual(self.scheduler.classify(large), 'bulk')
+        with app.test_request_context(headers={'X-Priority': 'bulk'}):
+            self.assertEqual(self.scheduler.classify(small), 'bulk')
+        with app.test_request_context(headers={'X-Priority': 'urgent'}):
+            self.assertEqual(self.scheduler.classify(large), 'bulk')
+        with self.assertRaises(ValueError):
+            PriorityScheduler(self.model.predict, classes={'a': 0})
+
+    def test_errors(self):
+        """Exceptions from `predict` should be raised to the caller, once per request."""
+        def predict(data):
+            raise RuntimeError('Prediction failed')
+        scheduler = PriorityScheduler(predict, slice_size=2)
+        with self.assertRaises(RuntimeError):
+            scheduler(np.ones((5, 2)))
+        scheduler.predict = lambda data: data[:1]
+        with self.assertRaises(ValueError):
+            scheduler(np.ones((2, 2)))
+        scheduler.predict = lambda data: data.sum(axis=1)
+        np.testing.assert_allclose(scheduler(np.ones((3, 2))), [2, 2, 2])
+
+    def test_concurrent_errors(self):
+        """Slices of a request failing in several workers at once should leave the workers running."""
+        both_predicting = Barrier(2, timeout=5)  # both workers have to be alive to get past it
+        failing = [True]
+
+        def predict(data):
+            both_predicting.wait()
+            if failing[0]:
+                raise RuntimeError('Prediction failed')
+            return data.sum(axis=1)
+        scheduler = PriorityScheduler(predict, slice_size=2, workers=2)
+        with self.assertRaises(RuntimeError):
+            scheduler(np.ones((4, 2)))
+        failing[0] = False
+        np.testing.assert_allclose(scheduler(np.ones((4, 2))), [2, 2, 2, 2])
+
+    def test_stats(self):
+        """Stats should report counts and queue times per class."""
+        self.scheduler(np.ones((25, 2)))
+        self.scheduler(np.ones((1, 2)))
+        stats = self.scheduler.stats()
+        self.assertEqual(sorted(stats), ['bulk', 'interactive'])
+        self.assertEqual((stats['bulk']['requests'], stats['bulk']['slices'], stats['bulk']['rows']), (1, 3, 25))
+        self.assertEqual((stats['interactive']['requests'], stats['interactive']['weight']), (1, 4))
+        self.assertGreaterEqual(stats['bulk']['latency']['p50_ms'], stats['bulk']['queue_time']['p50_ms'])
+
+    def test_server(self):
+        """ModelServer should serve predictions through the scheduler, with the priority header."""
+        server = ModelServer(self.model, self.scheduler)
+        server.create_info_endpoint('scheduling', self.scheduler.stats)
+        app = server.app.test_client()
+        response = app.post('/predictions', data=json.dumps([[1, 2]]), content_type='application/json',
+                            headers={'X-Priority': 'bulk'})
+        self.assertEqual(json.loads(response.get_data(as_text=True)), [3])
+        stats = json.loads(app.get('/info/scheduling').get_data(as_text=True))
+        self.assertEqual(stats['bulk']['requests'], 1)
+        self.assertEqual(stats['interactive']['requests'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+"""Test inference processes fed through shared memory."""
+import json
+import multiprocessing
+import os
+import time
+import unittest
+import numpy as np
+
+from serveit.server import ModelServer
+from serveit.sharedmem import InferenceError, SharedMemoryPredictor
+
+
+def predict(data):
+    """Sum rows, with special inputs to test other outputs and failures."""
+    if data.dtype.kind == 'U':
+        return np.array(['label-{}'.format(value) for value in data], dtype=object)
+    if data.ndim != 2:
+        raise ValueError('Data should have two dimensions.')
+    if (data < 0).any():
+        time.sleep(float(-data.min()))
+    if data.size and data[0, 0] == 42:
+        return np.array([os.getpid(), data.flags.owndata])
+    return data.sum(axis=1)
+
+
+def predict_or_fail(data):
+    """Sum rows, exiting the process or raising an error with a long message for special inputs."""
+    if data[0, 0] == 1:
+        os._exit(1)
+    if data[0, 0] == 2:
+        raise ValueError('x' * 10000)
+    return data.sum(axis=1)
+
+
+def predict_in_child(predictor, data, results):
+    """Predict from a forked I/O process."""
+    results.put(predictor(data).tolist())
+
+
+class SharedMemoryPredictorTest(unittest.TestCase):
+    """Test SharedMemoryPredictor."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Start inference processes."""
+        cls.predictor = SharedMemoryPredictor(lambda: predict, workers=2, slots=4, slot_size=64 * 1024,
+                                              timeout=5, start_method='fork').start()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Stop inference processes."""
+        cls.predictor.shutdown()
+
+    def test_predictions(self):
+        """Predictions should be computed in inference processes on views of shared memory."""
+        np.testing.assert_array_equal(self.predictor(np.array([[1, 2], [3, 4]])), [3, 7])
+        np.testing.assert_array_equal(self.predictor([[1.5, 2]]), [3.5])
+        pid, owndata = self.predictor(np.array([[42.]]))
+        self.assertNotEqual(pid, os.getpid())
+        self.assertFalse(owndata)
+
+    def test_object_predictions(self):
+        """Non-numeric predictions should be passed back pickled."""
+        self.assertEqual(self.predictor(np.array(['a', 'b'])).tolist(), ['label-a', 'label-b'])
+
+    def test_errors(self):
+        """Prediction errors should be raised, and slots reused."""
+        with self.assertRaises(InferenceError) as context:
+            self.predictor(np.ones(3))
+        self.assertEqual(str(context.exception), 'ValueError: Data should have two dimensions.')
+        with self.assertRaises(ValueError):
+            self.predictor(np.ones((100, 100)))  # larger than a slot
+        for _ in range(8):  # more requests than slots
+            np.testing.assert_array_equal(self.predictor(np.ones((1, 2))), [2])
+
+    def test_forked_io_processes(self):
+        """Processes forked after starting should share the inference processes."""
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        children = [
+            context.Process(target=predict_in_child, args=(self.predictor, np.full((3, 2), i), results))
+            for i in range(4)
+        ]
+        for child in children:
+            child.start()
+        outputs = sorted(results.get(timeout=10) for _ in children)
+        for child in children:
+            child.join()
+        self.assertEqual(outputs, [[2 * i] * 3 for i in range(4)])
+
+    def test_server(self):
+        """A predictor should serve predictions in place of a predict function."""
+        server = ModelServer(self.predictor, self.predictor)
+        client = server.app.test_client()
+        response = client.post('/predictions', data=json.dumps([[1, 2]]), content_type='application/json')
+        self.assertEqual(json.loads(response.get_data()), [3])
+        response = client.post('/predictions', data=json.dumps([1, 2]), content_type='application/json')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(json.loads(response.get_data())['details']['exception_type'], 'InferenceError')
+
+
+class SharedMemoryTimeoutTest(unittest.TestCase):
+    """Test SharedMemoryPredictor timeouts."""
+
+    def test_timeout(self):
+        """Slow predictions should time out."""
+        predictor = SharedMemoryPredictor(lambda: predict, slots=1, slot_size=8192, timeout=.2,
+                                          start_method='fork').start()
+        self.addCleanup(predictor.shutdown)
+        with self.assertRaises(InferenceError):
+            predictor(np.array([[-.5]]))
+        with self.assertRaises(InferenceError):  # the only slot was abandoned
+            predictor(np.array([[1.]]))
+        time.sleep(.5)  # until the late predictions arrive and the slot is reclaimed
+        np.testing.assert_array_equal(predictor(np.array([[1.]])), [1.])
+
+
+class SharedMemoryFailureTest(unittest.TestCase):
+    """Test SharedMemoryPredictor failures."""
+
+    def setUp(self):
+        """Start an inference process."""
+        self.predictor = SharedMemoryPredictor(lambda: predict_or_fail, slots=2, slot_size=8192,
+                                               start_method='fork').start()
+        self.addCleanup(self.predictor.shutdown)
+
+    def test_long_error_message(self):
+        """Long error messages should be truncated to fit the response header."""
+        with self.assertRaises(InferenceError) as context:
+            self.predictor(np.array([[2.]]))
+        message = str(context.exception)
+        self.assertTrue(message.startswith('ValueError: xxx') and message.endswith(' [truncated]'))
+        self.assertLess(len(message), 4096)
+        np.testing.assert_array_equal(self.predictor(np.array([[3., 4.]])), [7.])
+
+    def test_exited(self):
+        """Callers without a timeout should get an error if the inference process exits."""
+        start = time.time()
+        with self.assertRaises(InferenceError) as context:
+            self.predictor(np.array([[1.]]))
+        self.assertIn('exited', str(context.exception))
+        self.assertLess(time.time() - start, 5)
+        with self.assertRaises(InferenceError):  # queued requests have no inference process left either
+            self.predictor(np.array([[3.]]))
+
+
+if __name__ == '__main__':
+    unittest.main()
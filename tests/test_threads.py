@@ -0,0 +1,79 @@
+"""Test CPU thread budgets."""
+import json
+import os
+import unittest
+
+from serveit.server import ModelServer
+from serveit.threads import ThreadBudget, THREAD_ENV_VARS, available_cpus
+
+
+class DummyModel(object):
+    """Model that predicts the row sums of its input."""
+
+    def __init__(self):
+        """Initialize model attributes served by /info/model."""
+        self.name = 'dummy'
+
+    @staticmethod
+    def predict(data):
+        """Sum rows."""
+        return data.sum(axis=1)
+
+
+class ThreadBudgetTest(unittest.TestCase):
+    """Test ThreadBudget."""
+
+    def setUp(self):
+        """Save environment and CPU affinity."""
+        self.environ = dict(os.environ)
+        self.affinity = available_cpus()
+
+    def tearDown(self):
+        """Restore environment and CPU affinity."""
+        os.environ.clear()
+        os.environ.update(self.environ)
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, self.affinity)
+
+    def test_threads_per_executor(self):
+        """CPUs should be divided between workers and executors."""
+        self.assertEqual(ThreadBudget(workers=2, executors=2, cpus=range(16)).threads_per_executor, 4)
+        self.assertEqual(ThreadBudget(workers=4, cpus=range(16)).threads_per_executor, 4)
+        self.assertEqual(ThreadBudget(workers=8, executors=4, cpus=range(16)).threads_per_executor, 1)
+
+    def test_worker_cpus(self):
+        """Each worker should get its own CPU set."""
+        budget = ThreadBudget(workers=4, cpus=range(8))
+        self.assertEqual(budget.worker_cpus(0), [0, 1])
+        self.assertEqual(budget.worker_cpus(3), [6, 7])
+        self.assertEqual(ThreadBudget(workers=3, cpus=range(2)).worker_cpus(2), [0])
+
+    def test_apply(self):
+        """Applying a budget should set thread limits and report them."""
+        settings = ThreadBudget(workers=len(self.affinity), executors=1).apply()
+        self.assertEqual(settings['threads_per_executor'], 1)
+        for name in THREAD_ENV_VARS:
+            self.assertEqual(os.environ[name], '1')
+        for threadpool in settings.get('threadpools', []):
+            self.assertEqual(threadpool['num_threads'], 1)
+
+    @unittest.skipUnless(hasattr(os, 'sched_setaffinity'), 'CPU pinning not supported')
+    def test_pin(self):
+        """Pinned workers should only run on their own CPU set."""
+        budget = ThreadBudget(workers=len(self.affinity), pin=True, worker_index=len(self.affinity) - 1)
+        settings = budget.apply()
+        self.assertEqual(settings['cpu_affinity'], self.affinity[-1:])
+
+    def test_info_endpoint(self):
+        """ModelServer should apply the budget and report it on /info/threads."""
+        model = DummyModel()
+        server = ModelServer(model, model.predict, thread_budget=ThreadBudget(executors=2))
+        response = server.app.test_client().get('/info/threads')
+        self.assertEqual(response.status_code, 200)
+        settings = json.loads(response.get_data())
+        self.assertEqual(settings['executors'], 2)
+        self.assertEqual(settings['threads_per_executor'], max(1, len(self.affinity) // 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
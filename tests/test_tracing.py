@@ -0,0 +1,250 @@
+"""Test span tracing of prediction requests."""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from serveit.server import ModelServer
+from serveit.tracing import (
+    CollectorExporter, FileExporter, NOOP_SPAN, Tracer, current_traceparent, format_traceparent, parse_traceparent)
+from serveit.utils import json_numpy_loader
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+PARENT_ID = '00f067aa0ba902b7'
+SAMPLED = '00-{}-{}-01'.format(TRACE_ID, PARENT_ID)
+UNSAMPLED = '00-{}-{}-00'.format(TRACE_ID, PARENT_ID)
+
+
+class SumModel(object):
+    """Model that predicts the row sums of its input."""
+
+    @staticmethod
+    def predict(data):
+        """Sum rows."""
+        return data.sum(axis=1)
+
+
+def double(data):
+    """Preprocessing step."""
+    return np.asarray(data) * 2
+
+
+def negate(data):
+    """Preprocessing step."""
+    return -data
+
+
+class TraceparentTest(unittest.TestCase):
+    """Test parsing and formatting trace context headers."""
+
+    def test_parse(self):
+        """Valid headers should be parsed, and invalid ones ignored."""
+        self.assertEqual(parse_traceparent(SAMPLED), (TRACE_ID, PARENT_ID, 1))
+        self.assertEqual(parse_traceparent(' ' + UNSAMPLED.upper()), (TRACE_ID, PARENT_ID, 0))
+        for header in (None, '', 'garbage', SAMPLED[:-1], 'ff' + SAMPLED[2:],
+                       '00-{}-{}-01'.format('0' * 32, PARENT_ID), '00-{}-{}-01'.format(TRACE_ID, '0' * 16)):
+            self.assertIsNone(parse_traceparent(header))
+        self.assertEqual(format_traceparent(TRACE_ID, PARENT_ID), SAMPLED)
+        self.assertEqual(format_traceparent(TRACE_ID, PARENT_ID, sampled=False), UNSAMPLED)
+
+
+class TracerTest(unittest.TestCase):
+    """Test Tracer sampling, span nesting and export."""
+
+    def test_sampling(self):
+        """Requests should follow their caller's sampling decision, or the sample rate."""
+        tracer = Tracer(sample_rate=0.)
+        self.assertIs(tracer.trace('request'), NOOP_SPAN)
+        self.assertIs(tracer.span('stage'), NOOP_SPAN)
+        with tracer.trace('request', UNSAMPLED) as span:
+            self.assertIs(span, NOOP_SPAN)
+            self.assertEqual(current_traceparent(), UNSAMPLED)  # still propagated downstream
+        self.assertIsNone(current_traceparent())
+        with tracer.trace('request', SAMPLED) as span:
+            self.assertEqual((span.trace_id, span.parent_id), (TRACE_ID, PARENT_ID))
+        self.assertIsNot(Tracer(sample_rate=1.).trace('request'), NOOP_SPAN)
+        self.assertEqual(tracer.stats()['traces'], 1)
+
+    def test_nesting(self):
+        """Spans should nest in the current thread, and record errors."""
+        tracer = Tracer()
+        with tracer.trace('request') as root:
+            with tracer.span('stage', rows=3) as stage:
+                self.assertEqual(current_traceparent(), format_traceparent(root.trace_id, stage.span_id))
+            with self.assertRaises(ValueError):
+                with tracer.span('failing'):
+                    raise ValueError('failed')
+            with tracer.trace('nested') as nested:
+                self.assertEqual(nested.parent_id, root.span_id)
+        spans = {span['name']: span for span in tracer.drain()}
+        self.assertEqual(sorted(spans), ['failing', 'nested', 'request', 'stage'])
+        self.assertIsNone(spans['request']['parent_id'])
+        self.assertEqual(spans['stage']['parent_id'], root.span_id)
+        self.assertEqual(spans['stage']['attributes'], dict(rows=3))
+        self.assertEqual(spans['failing']['status'], 'error')
+        self.assertEqual(spans['failing']['attributes']['exception_type'], 'ValueError')
+        self.assertEqual(len({span['trace_id'] for span in spans.values()}), 1)
+        self.assertGreaterEqual(spans['request']['duration_ms'], spans['stage']['duration_ms'])
+
+    def test_buffer(self):
+        """The oldest spans should be dropped when the buffer is full."""
+        tracer = Tracer(max_spans=3)
+        for i in range(5):
+            with tracer.trace('request-{}'.format(i)):
+                pass
+        self.assertEqual([span['name'] for span in tracer.drain()], ['request-2', 'request-3', 'request-4'])
+        self.assertEqual(tracer.stats()['dropped'], 2)
+
+    def test_flush_without_exporter(self):
+        """Flushing without an exporter should keep spans buffered."""
+        tracer = Tracer()
+        with tracer.trace('request'):
+            pass
+        tracer.flush()
+        self.assertEqual([span['name'] for span in tracer.drain()], ['request'])
+
+    def test_file_exporter(self):
+        """Spans should be exported in batches to JSON lines files."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'spans.jsonl')
+        tracer = Tracer(FileExporter(path), batch_size=4, flush_interval=60)
+        for _ in range(2):
+            with tracer.trace('request'):
+                with tracer.span('stage'):
+                    pass
+        deadline = time.time() + 5
+        while tracer.stats()['exported'] < 4 and time.time() < deadline:
+            time.sleep(.01)
+        with open(path) as f:
+            spans = [json.loads(line) for line in f]
+        self.assertEqual([span['name'] for span in spans], ['stage', 'request'] * 2)
+        self.assertEqual(tracer.stats()['buffered'], 0)
+
+    def test_collector_exporter(self):
+        """Spans should be posted to a collector, and counted as dropped when it fails."""
+        batches = []
+
+        class Collector(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                batches.append((self.path, json.loads(body.decode('utf-8'))))
+                self.send_response(200 if len(batches) == 1 else 500)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        collector = HTTPServer(('127.0.0.1', 0), Collector)
+        thread = Thread(target=collector.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(collector.server_close)
+        self.addCleanup(collector.shutdown)
+
+        tracer = Tracer(CollectorExporter(port=collector.server_address[1]), flush_interval=60)
+        with tracer.trace('request'):
+            pass
+        tracer.flush()
+        self.assertEqual(batches[0][0], '/spans')
+        self.assertEqual([span['name'] for span in batches[0][1]['spans']], ['request'])
+        with tracer.trace('request'):
+            pass
+        tracer.flush()
+        stats = tracer.stats()
+        self.assertEqual((stats['exported'], stats['dropped'], stats['export_errors']), (1, 1, 1))
+
+
+class ServerTracingTest(unittest.TestCase):
+    """Test spans of prediction requests."""
+
+    def setUp(self):
+        """Unittest set up."""
+        self.model = SumModel()
+        self.tracer = Tracer(sample_rate=0.)
+        self.downstream = []
+
+        def loader():
+            self.downstream.append(current_traceparent())  # e.g., headers of a downstream fetch
+            return json_numpy_loader()
+
+        self.server = ModelServer(self.model, self.model.predict, preprocessor=[double, negate],
+                                  postprocessor=lambda prediction: -prediction, tracer=self.tracer)
+        self.loader_server = ModelServer(self.model, self.model.predict, data_loader=loader, tracer=self.tracer)
+
+    def _post(self, client, traceparent=None, body='[[1, 2], [3, 4]]'):
+        """Post a prediction request."""
+        headers = {'traceparent': traceparent} if traceparent else {}
+        return client.post('/predictions', data=body, content_type='application/json', headers=headers)
+
+    def test_spans(self):
+        """Sampled requests should have spans for each stage and step, in the caller's trace."""
+        response = self._post(self.server.app.test_client(), SAMPLED)
+        self.assertEqual(json.loads(response.get_data(as_text=True)), [6, 14])
+        spans = {span['name']: span for span in self.tracer.drain()}
+        self.assertEqual(sorted(spans), [
+            'POST /predictions', 'load', 'postprocess', 'predict',
+            'preprocess', 'preprocess:double', 'preprocess:negate', 'validate'])
+        root = spans['POST /predictions']
+        self.assertEqual((root['trace_id'], root['parent_id']), (TRACE_ID, PARENT_ID))
+        self.assertEqual(root['attributes']['status_code'], 200)
+        for name in ('load', 'preprocess', 'validate', 'predict', 'postprocess'):
+            self.assertEqual(spans[name]['parent_id'], root['span_id'])
+        self.assertEqual(spans['preprocess:negate']['parent_id'], spans['preprocess']['span_id'])
+        self.assertEqual(spans['validate']['attributes'], dict(passed=True))
+
+    def test_unsampled(self):
+        """Unsampled requests should record nothing, but still propagate their trace context."""
+        client = self.loader_server.app.test_client()
+        self._post(client)
+        self._post(client, UNSAMPLED)
+        self.assertEqual(self.tracer.drain(), [])
+        self.assertEqual(self.downstream, [None, UNSAMPLED])
+
+    def test_propagation(self):
+        """Data loaders should propagate the trace to downstream services."""
+        self._post(self.loader_server.app.test_client(), SAMPLED)
+        spans = {span['name']: span for span in self.tracer.drain()}
+        self.assertEqual(self.downstream, [format_traceparent(TRACE_ID, spans['load']['span_id'])])
+
+    def test_errors(self):
+        """Failed stages should be recorded in their spans."""
+        self._post(self.server.app.test_client(), SAMPLED, body='[1, 2]')  # can't sum rows of a 1D array
+        spans = {span['name']: span for span in self.tracer.drain()}
+        self.assertEqual(spans['predict']['status'], 'error')
+        self.assertEqual(spans['POST /predictions']['attributes']['status_code'], 500)
+
+    def test_fast_path(self):
+        """The fast path should record the same stages, and nest the Flask app's spans if it falls back."""
+        self.server.fast_path = True
+        client = Client(self.server.get_wsgi_app(), Response)
+        self.assertEqual(json.loads(self._post(client, SAMPLED).get_data(as_text=True)), [6, 14])
+        spans = {span['name']: span for span in self.tracer.drain()}
+        self.assertIn('serialize', spans)
+        self.assertIn('preprocess:negate', spans)
+        self.assertTrue(spans['POST /predictions']['attributes']['fast_path'])
+        self.assertEqual(spans['POST /predictions']['parent_id'], PARENT_ID)
+
+        self.assertEqual(self._post(client, SAMPLED, body='null').status_code, 400)
+        spans = self.tracer.drain()
+        flask, fast = [span for span in spans if span['name'] == 'POST /predictions']  # in order of ending
+        self.assertEqual(flask['parent_id'], fast['span_id'])
+        self.assertEqual(fast['parent_id'], PARENT_ID)
+
+    def test_info(self):
+        """Tracing stats should be served."""
+        self._post(self.server.app.test_client(), SAMPLED)
+        stats = json.loads(self.server.app.test_client().get('/info/tracing').get_data(as_text=True))
+        self.assertEqual((stats['traces'], stats['buffered']), (1, 8))
+
+
+if __name__ == '__main__':
+    unittest.main()
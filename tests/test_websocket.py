@@ -0,0 +1,284 @@
+"""Test streaming predictions over WebSocket connections."""
+from queue import Queue
+from threading import Event, Thread, current_thread
+from timeit import default_timer as timer
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import unittest
+import numpy as np
+
+try:
+    import simple_websocket
+except ImportError:
+    simple_websocket = None
+
+from serveit import backends
+from serveit.server import ModelServer
+from serveit.websocket import StreamingPredictions, encode_tensor_message, decode_message
+
+
+class SumModel(object):
+    """Model that predicts the row sums of its input."""
+
+    def __init__(self):
+        """Initialize model."""
+        self.batch_sizes = []
+
+    def predict(self, data):
+        """Sum rows, recording the batch size."""
+        self.batch_sizes.append(len(data))
+        if np.isnan(data).any():
+            raise ValueError('NaN input')
+        return data.sum(axis=1)
+
+
+class SlowModel(object):
+    """Model that predicts the row sums of its input, slowly for three columns."""
+
+    def __init__(self):
+        """Initialize model."""
+        self.fast_sent = Event()
+
+    def predict(self, data):
+        """Sum rows, waiting for another response to be sent first if data has three columns."""
+        if data.shape[1] == 3:
+            self.fast_sent.wait(5)
+        return data.sum(axis=1)
+
+
+class FakeWebSocket(object):
+    """WebSocket connection with scripted incoming messages."""
+
+    def __init__(self, messages):
+        """Queue incoming messages, followed by a closed connection."""
+        self.incoming = Queue()
+        for message in messages:
+            self.incoming.put(message)
+        self.incoming.put(None)
+        self.sent = []
+        self.senders = set()
+
+    def receive(self):
+        """Return the next incoming message, or None once closed."""
+        return self.incoming.get()
+
+    def send(self, message):
+        """Record a sent message and the thread sending it."""
+        self.senders.add(current_thread().name)
+        self.sent.append(json.loads(message))
+        self.on_send(self.sent[-1])
+
+    def on_send(self, response):
+        """Hook called with each sent response."""
+
+
+class SimpleWebSocketMiddleware(object):
+    """Serve WebSocket connections with simple-websocket, as `environ['wsgi.websocket']`."""
+
+    class Connection(object):
+        """Connection whose `receive` returns None once closed."""
+
+        def __init__(self, websocket):
+            self.websocket = websocket
+            self.send = websocket.send
+
+        def receive(self):
+            try:
+                return self.websocket.receive()
+            except simple_websocket.ConnectionClosed:
+                return None
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        if environ.get('HTTP_UPGRADE', '').lower() != 'websocket':
+            return self.app(environ, start_response)
+        websocket = simple_websocket.Server(environ)
+        environ['wsgi.websocket'] = self.Connection(websocket)
+        try:
+            self.app(environ, start_response)
+        finally:
+            websocket.close()
+        raise ConnectionError  # the connection has been taken over; Werkzeug sends no HTTP response
+
+
+def free_port():
+    """Return a free local port."""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def stream(port, messages, timeout=10):
+    """Send messages to a WebSocket server, and return responses in order of arrival."""
+    client = simple_websocket.Client.connect('ws://127.0.0.1:{}/ws/predictions'.format(port))
+    try:
+        for message in messages:
+            client.send(message)
+        return [json.loads(client.receive(timeout)) for _ in messages]
+    finally:
+        client.close()
+
+
+def run_meinheld(port):
+    """Serve a model with meinheld."""
+    model = SumModel()
+    ModelServer(model, model.predict).serve(port=port, backend='meinheld')
+
+
+class StreamingPredictionsTest(unittest.TestCase):
+    """Test StreamingPredictions."""
+
+    def setUp(self):
+        """Unittest set up."""
+        self.model = SumModel()
+
+        def validator(data):
+            return (data.ndim == 2, 'Data should have two dimensions.')
+
+        self.server = ModelServer(self.model, self.model.predict, validator)
+        self.streaming = StreamingPredictions(self.server, max_delay=.05)
+
+    def _responses(self, messages):
+        """Stream messages over a fake connection and return responses keyed by id."""
+        websocket = FakeWebSocket(messages)
+        self.streaming.handle(websocket)
+        self.assertEqual(len(websocket.senders), 1)  # a single sender, rather than each prediction thread
+        return {response['id']: response for response in websocket.sent}
+
+    def test_tensor_message_round_trip(self):
+        """Binary tensor messages should decode to the original array."""
+        array = np.arange(12, dtype=np.float32).reshape(3, 4)
+        message_id, data = decode_message(encode_tensor_message('a', array))
+        self.assertEqual(message_id, 'a')
+        np.testing.assert_array_equal(data, array)
+
+    def test_json_and_binary_messages(self):
+        """JSON and binary messages should be answered with their ids."""
+        responses = self._responses([
+            json.dumps(dict(id=1, data=[[1, 2], [3, 4]])),
+            encode_tensor_message(2, np.array([[5., 6.]])),
+        ])
+        self.assertEqual(responses[1], dict(id=1, status=200, prediction=[3, 7]))
+        self.assertEqual(responses[2], dict(id=2, status=200, prediction=[11.]))
+
+    def test_batching(self):
+        """Compatible messages arriving together should share a predict call."""
+        messages = [json.dumps(dict(id=i, data=[[i, i]])) for i in range(10)]
+        messages += [json.dumps(dict(id='wide', data=[[1, 2, 3]]))]
+        responses = self._responses(messages)
+        for i in range(10):
+            self.assertEqual(responses[i]['prediction'], [2 * i])
+        self.assertEqual(responses['wide']['prediction'], [6])
+        self.assertEqual(sorted(self.model.batch_sizes), [1, 10])
+
+    def test_errors(self):
+        """Errors should be reported per message without affecting other messages."""
+        responses = self._responses([
+            'not json',
+            json.dumps(dict(id='flat', data=[1, 2])),
+            json.dumps(dict(id='nan', data=[[float('nan'), 1.]])),
+            json.dumps(dict(id='ok', data=[[1., 1.]])),
+        ])
+        self.assertEqual(responses[None]['status'], 400)
+        self.assertEqual(responses[None]['message'], 'Unable to fetch data')
+        self.assertEqual(responses['flat']['status'], 400)
+        self.assertIn('Data should have two dimensions', responses['flat']['message'])
+        self.assertEqual(responses['nan']['status'], 500)
+        self.assertEqual(responses['nan']['message'], 'Unable to make prediction')
+        self.assertEqual(responses['ok'], dict(id='ok', status=200, prediction=[2.]))
+
+    def test_out_of_order(self):
+        """A slow group shouldn't hold back responses to messages queued behind it."""
+        model = SlowModel()
+        streaming = StreamingPredictions(ModelServer(model, model.predict), max_delay=.05, workers=2)
+        websocket = FakeWebSocket([
+            json.dumps(dict(id='slow', data=[[1, 2, 3]])),
+            json.dumps(dict(id='fast', data=[[1, 2]])),
+        ])
+        websocket.on_send = lambda response: response['id'] == 'fast' and model.fast_sent.set()
+        streaming.handle(websocket)
+        self.assertEqual([response['id'] for response in websocket.sent], ['fast', 'slow'])
+        self.assertEqual(websocket.sent[1]['prediction'], [6])
+
+    def test_prediction_length(self):
+        """Batched predictions without one entry per row should be retried message by message."""
+        model = SumModel()
+        server = ModelServer(model, lambda data: [model.predict(data).sum()])
+        responses = {response['id']: response for response in self._stream(server, [
+            json.dumps(dict(id=i, data=[[i, i], [1, 1]])) for i in range(3)])}
+        self.assertEqual({i: response['prediction'] for i, response in responses.items()}, {0: [2], 1: [4], 2: [6]})
+        self.assertEqual(model.batch_sizes, [6, 2, 2, 2])
+
+    def _stream(self, server, messages):
+        """Stream messages to a server over a fake connection and return the responses."""
+        websocket = FakeWebSocket(messages)
+        StreamingPredictions(server, max_delay=.05).handle(websocket)
+        return websocket.sent
+
+    @unittest.skipIf(simple_websocket is None, 'simple-websocket is not installed')
+    def test_werkzeug_transport(self):
+        """Messages should be answered over a real connection to a threaded server."""
+        from werkzeug.serving import make_server
+        http_server = make_server('127.0.0.1', 0, SimpleWebSocketMiddleware(self.streaming), threaded=True)
+        thread = Thread(target=http_server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(http_server.server_close)
+        self.addCleanup(http_server.shutdown)
+
+        messages = [json.dumps(dict(id=i, data=[[i, i]])) for i in range(20)]
+        messages.append(encode_tensor_message('tensor', np.ones((2, 3))))
+        responses = {response['id']: response for response in stream(http_server.server_port, messages)}
+        self.assertEqual(sorted(responses, key=str), sorted(list(range(20)) + ['tensor'], key=str))
+        self.assertEqual(responses[7]['prediction'], [14])
+        self.assertEqual(responses['tensor']['prediction'], [3., 3.])
+
+    @unittest.skipIf(simple_websocket is None, 'simple-websocket is not installed')
+    def test_meinheld_transport(self):
+        """Messages should be answered over a real connection to the meinheld backend."""
+        if not backends.is_available('meinheld'):
+            self.skipTest('meinheld is not installed')
+        port = free_port()
+        process = multiprocessing.get_context('fork').Process(target=run_meinheld, args=(port,))
+        process.start()
+
+        def stop():
+            os.kill(process.pid, signal.SIGINT)
+            process.join(10)
+            if process.is_alive():
+                process.terminate()
+        self.addCleanup(stop)
+
+        deadline = timer() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except socket.error:
+                if timer() > deadline:
+                    self.fail('meinheld server did not start')
+                time.sleep(.05)
+        responses = stream(port, [json.dumps(dict(id=i, data=[[i, 1]])) for i in range(20)])
+        self.assertEqual(sorted(response['id'] for response in responses), list(range(20)))
+        self.assertEqual({response['id']: response['prediction'] for response in responses}[5], [6])
+
+    def test_http_passthrough(self):
+        """Non-WebSocket requests should be served by the Flask app."""
+        from werkzeug.test import Client
+        from werkzeug.wrappers import Response
+        client = Client(self.streaming, Response)
+        response = client.post('/predictions', data=json.dumps([[1, 2]]), content_type='application/json')
+        self.assertEqual(json.loads(response.get_data()), [3])
+        self.assertEqual(client.get('/fake-endpoint').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()